@@ -0,0 +1,74 @@
+"""Rows per second writing quotes to HDF5: per-row loop vs bulk append.
+
+    $ python benchmarks/bench_append.py 1000000
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import tables
+
+from pyreuters import hdf_repos_filters
+from pyreuters.data import Quote, quote_records
+
+
+def synthetic_quotes(n):
+    rs = np.random.RandomState(0)
+    index = pd.date_range("2016-01-04", periods=n, freq="10ms")
+    bid = 98.5 + np.round(rs.randn(n).cumsum() * 0.0025, 4)
+    quotes = pd.DataFrame({"bid": bid, "ask": bid + 0.005,
+                           "bid_size": rs.randint(1, 500, n).astype(float),
+                           "ask_size": rs.randint(1, 500, n).astype(float)},
+                          index=index)
+    quotes.loc[rs.rand(n) < 0.3, ["bid", "bid_size"]] = np.nan
+    quotes.loc[rs.rand(n) < 0.3, ["ask", "ask_size"]] = np.nan
+    return quotes
+
+
+def row_loop(table, quotes, file_date):
+    row = table.row
+    date_times = quotes.index.values.astype('datetime64[ns]').astype(
+        np.int64)
+    for date_time, (_, q) in zip(date_times, quotes.iterrows()):
+        row['file_date'] = file_date
+        row['date_time'] = date_time
+        if not np.isnan(q['bid']):
+            row['bid'] = float(q['bid'])
+        if not np.isnan(q['ask']):
+            row['ask'] = float(q['ask'])
+        if not np.isnan(q['bid_size']):
+            row['bid_size'] = int(q['bid_size'])
+        if not np.isnan(q['ask_size']):
+            row['ask_size'] = int(q['ask_size'])
+        row.append()
+    table.flush()
+
+
+def bulk_append(table, quotes, file_date):
+    table.append(quote_records(quotes, file_date))
+    table.flush()
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    quotes = synthetic_quotes(n)
+    path = os.path.join(tempfile.mkdtemp(), "bench_append.h5")
+    with tables.open_file(path, mode="w", filters=hdf_repos_filters) as store:
+        for name, writer in (("iterrows", row_loop), ("append", bulk_append)):
+            table = store.create_table("/", name, Quote, expectedrows=n)
+            start = time.time()
+            writer(table, quotes, 20160104)
+            elapsed = time.time() - start
+            print("{:>10}: {:>12,.0f} rows/s ({:.2f}s)".format(
+                name, n / elapsed, elapsed))
+        assert pd.DataFrame(store.root.iterrows.read()).equals(
+            pd.DataFrame(store.root.append.read()))
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
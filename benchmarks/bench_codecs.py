@@ -0,0 +1,79 @@
+"""File size, write rate and range query latency of a quotes table for each
+compression library and level.
+
+    $ python benchmarks/bench_codecs.py 2000000
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tables
+
+from pyreuters import hdf5_filters
+from pyreuters.data import Quote, quote_records, index_table
+
+from bench_append import synthetic_quotes
+
+
+complibs = ["zlib", "blosc:blosclz", "blosc:lz4", "blosc:zstd"]
+
+complevels = [1, 5, 9]
+
+
+def write(path, records, filters):
+    start = time.time()
+    with tables.open_file(path, mode="w") as store:
+        table = store.create_table("/", "quotes", Quote, filters=filters,
+                                   expectedrows=len(records))
+        table.append(records)
+        table.flush()
+        index_table(table)
+    return time.time() - start
+
+
+def query(path, windows):
+    """Median seconds to read every row of one window."""
+    elapsed = []
+    with tables.open_file(path, mode="r") as store:
+        table = store.root.quotes
+        for start_time, end_time in windows:
+            start = time.time()
+            table.read_where("(date_time >= {}) & (date_time < {})".format(
+                start_time, end_time))
+            elapsed.append(time.time() - start)
+    return np.median(elapsed)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    records = quote_records(synthetic_quotes(n), 20160104)
+    times = records['date_time']
+    rs = np.random.RandomState(0)
+    # one window is 1% of the rows
+    starts = rs.randint(0, n - n // 100, 20)
+    windows = [(times[x], times[x + n // 100]) for x in starts]
+
+    path = tempfile.mkdtemp()
+    matrix = [("none", 0, "none")] + \
+        [(x, y, "byte") for x in complibs for y in complevels] + \
+        [("blosc:zstd", 5, "bit")]
+    print("{:>14} {:>5} {:>7} {:>10} {:>14} {:>11}".format(
+        "complib", "level", "shuffle", "size MB", "write rows/s", "query ms"))
+    for complib, complevel, shuffle in matrix:
+        to_write = os.path.join(path, "{}_{}_{}.h5".format(
+            complib.replace(":", "_"), complevel, shuffle))
+        filters = hdf5_filters("zlib" if complib == "none" else complib,
+                               complevel, shuffle)
+        elapsed = write(to_write, records, filters)
+        print("{:>14} {:>5} {:>7} {:>10.1f} {:>14,.0f} {:>11.2f}".format(
+            complib, complevel, shuffle, os.path.getsize(to_write) / 1e6,
+            n / elapsed, query(to_write, windows) * 1e3))
+    shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Throughput of read_ticks on one large synthetic .csv.gz tick file with
+1, 2, 4 and 8 decompression/parse threads, in compressed and uncompressed
+MB/s.
+
+    $ python benchmarks/bench_gzip.py 5000000
+"""
+
+import gzip
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pyreuters.data import read_ticks
+from pyreuters.testing import write_raw_file
+
+
+def uncompressed_size(to_read):
+    size = 0
+    with gzip.open(to_read, 'rb') as stream:
+        while True:
+            data = stream.read(1 << 24)
+            if not data:
+                return size
+            size += len(data)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    path = tempfile.mkdtemp()
+    to_read = write_raw_file(path, "EDH6", "2016-01-04", n)
+    packed = os.path.getsize(to_read) / 1e6
+    unpacked = uncompressed_size(to_read) / 1e6
+    print("{:,} rows, {:.1f} MB compressed, {:.1f} MB uncompressed, "
+          "{} cpus".format(n, packed, unpacked, multiprocessing.cpu_count()))
+
+    serial = None
+    for threads in (1, 2, 4, 8):
+        start = time.time()
+        ticks = read_ticks("EDH6", "2016-01-04", path=path, threads=threads)
+        elapsed = time.time() - start
+        if serial is None:
+            serial = ticks
+        assert serial.equals(ticks)
+        print("threads={}: {:6.2f}s {:8.1f} MB/s gz {:8.1f} MB/s csv".format(
+            threads, elapsed, packed / elapsed, unpacked / elapsed))
+    shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""One-hour read_where latency on a Quote table with and without the CSI
+indexes created by reuters_convert.
+
+    $ python benchmarks/bench_index.py 5000000
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tables
+
+from pyreuters import hdf_repos_filters
+from pyreuters.data import Quote, quote_dtype, index_table
+
+hour = 3600 * 10**9
+
+
+def synthetic_records(n, days=250):
+    rs = np.random.RandomState(0)
+    records = np.zeros(n, dtype=quote_dtype)
+    start = np.datetime64("2016-01-04", "ns").astype(np.int64)
+    records['date_time'] = start + np.sort(
+        rs.randint(0, days * 24 * hour, n).astype(np.int64))
+    records['file_date'] = 20160104 + (records['date_time'] - start) // \
+        (24 * hour)
+    records['bid'] = 98.5 + rs.randn(n).cumsum() * 0.0025
+    records['ask'] = records['bid'] + 0.005
+    records['bid_size'] = rs.randint(1, 500, n)
+    records['ask_size'] = rs.randint(1, 500, n)
+    return records
+
+
+def query_latency(table, windows):
+    start = time.time()
+    rows = 0
+    for lo in windows:
+        hi = lo + hour
+        rows += len(table.read_where('(date_time >= lo) & (date_time < hi)'))
+    return (time.time() - start) / len(windows), rows
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    records = synthetic_records(n)
+    rs = np.random.RandomState(1)
+    windows = rs.randint(records['date_time'][0],
+                         records['date_time'][-1] - hour, 50)
+    path = os.path.join(tempfile.mkdtemp(), "bench_index.h5")
+    with tables.open_file(path, mode="w", filters=hdf_repos_filters) as store:
+        for name in ("scan", "indexed"):
+            table = store.create_table("/", name, Quote, expectedrows=n)
+            table.append(records)
+            table.flush()
+        start = time.time()
+        index_table(store.root.indexed)
+        print("index build: {:.2f}s for {:,} rows".format(time.time() - start,
+                                                          n))
+        for name in ("scan", "indexed"):
+            latency, rows = query_latency(store.get_node("/", name), windows)
+            print("{:>8}: {:8.2f} ms per one-hour window ({:,} rows)".format(
+                name, latency * 1000, rows))
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Seconds to compute microstructure metrics with pyreuters.metrics (NumPy,
+and Numba when installed) vs naive pandas code.
+
+    $ python benchmarks/bench_metrics.py 2000000
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from pyreuters import metrics
+
+from bench_append import synthetic_quotes
+
+
+def synthetic_trades(quotes):
+    rs = np.random.RandomState(1)
+    picked = np.sort(rs.choice(len(quotes), len(quotes) // 10,
+                               replace=False))
+    mids = quotes[["bid", "ask"]].ffill().mean(axis=1).values[picked]
+    return pd.DataFrame({"price": np.round(mids + rs.choice(
+        [-0.0025, 0.0025], len(picked)), 4),
+        "volume": rs.randint(1, 50, len(picked)).astype(float)},
+        index=quotes.index[picked])
+
+
+def pandas_spread(quotes):
+    filled = quotes.ffill()
+    spread = filled["ask"] - filled["bid"]
+    durations = quotes.index.to_series().diff().shift(-1).dt.total_seconds()
+    valid = spread.notnull() & durations.notnull()
+    return (spread[valid] * durations[valid]).sum() / durations[valid].sum()
+
+
+def pandas_microprice(quotes):
+    filled = quotes.ffill()
+    return filled.apply(lambda x: (x["bid"] * x["ask_size"] +
+                                   x["ask"] * x["bid_size"]) /
+                        (x["bid_size"] + x["ask_size"]), axis=1)
+
+
+def pandas_tick_signs(trades):
+    signs = []
+    last_price = None
+    sign = 0
+    for _, trade in trades.iterrows():
+        if last_price is not None and trade["price"] != last_price:
+            sign = 1 if trade["price"] > last_price else -1
+        signs.append(sign)
+        last_price = trade["price"]
+    return pd.Series(signs, index=trades.index)
+
+
+def pandas_effective_spread(trades, quotes):
+    mids = quotes[["bid", "ask"]].ffill().mean(axis=1, skipna=False)
+    merged = pd.merge_asof(trades[["price"]], mids.rename("mid").to_frame(),
+                           left_index=True, right_index=True)
+    signs = np.sign(merged["price"] - merged["mid"])
+    return 2 * signs * (merged["price"] - merged["mid"])
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    quotes = synthetic_quotes(n)
+    trades = synthetic_trades(quotes)
+    engines = ["numpy"] + (["numba"] if metrics.numba is not None else [])
+
+    def run(name, f, rows):
+        start = time.time()
+        f()
+        elapsed = time.time() - start
+        print("{:>28}: {:>8.3f}s {:>14,.0f} rows/s".format(
+            name, elapsed, rows / elapsed))
+
+    for engine in engines:
+        # compiles the kernels before they are timed
+        metrics.quote_metrics(quotes.iloc[:10], engine)
+        metrics.trade_metrics(trades.iloc[:10], quotes.iloc[:10],
+                              engine=engine)
+
+    small = quotes.iloc[:n // 10]
+    run("pandas time weighted spread", lambda: pandas_spread(quotes), n)
+    for engine in engines:
+        run("{} time weighted spread".format(engine),
+            lambda: metrics.time_weighted_spread(quotes, engine=engine), n)
+    run("pandas microprice", lambda: pandas_microprice(small), len(small))
+    for engine in engines:
+        run("{} quote metrics".format(engine),
+            lambda: metrics.quote_metrics(quotes, engine), n)
+    run("pandas tick signs", lambda: pandas_tick_signs(trades),
+        len(trades))
+    for engine in engines:
+        run("{} tick signs".format(engine),
+            lambda: metrics.tick_signs(trades["price"].values, engine),
+            len(trades))
+    run("pandas effective spread",
+        lambda: pandas_effective_spread(trades, quotes), len(trades))
+    for engine in engines:
+        run("{} trade metrics".format(engine),
+            lambda: metrics.trade_metrics(trades, quotes, engine=engine),
+            len(trades))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Parse time of a synthetic raw .csv.gz tick file: the original read_raw
+(inferred dtypes, string concatenation and strptime) against read_ticks.
+
+    $ python benchmarks/bench_read_raw.py 5000000
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from pyreuters.data import read_ticks
+from pyreuters.testing import write_raw_file
+
+
+def original_read_raw(to_read):
+    rd = pd.read_csv(to_read, compression='gzip')
+    rd['date_time'] = pd.to_datetime(rd['Date[G]'] + " " + rd['Time[G]'],
+                                     format='%d-%b-%Y %H:%M:%S.%f')
+    rd.set_index('date_time', inplace=True)
+    return rd
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    path = tempfile.mkdtemp()
+    to_read = write_raw_file(path, "EDH6", "2016-01-04", n)
+
+    start = time.time()
+    original = original_read_raw(to_read)
+    original_time = time.time() - start
+
+    start = time.time()
+    ticks = read_ticks("EDH6", "2016-01-04", path=path)
+    ticks_time = time.time() - start
+
+    assert original.index.equals(ticks.index)
+    print("read_raw (original): {:6.2f}s {:>12,.0f} rows/s".format(
+        original_time, n / original_time))
+    print("read_ticks:          {:6.2f}s {:>12,.0f} rows/s".format(
+        ticks_time, n / ticks_time))
+    print("speedup: {:.1f}x".format(original_time / ticks_time))
+    shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
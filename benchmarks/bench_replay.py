@@ -0,0 +1,92 @@
+"""Events per second replaying the quotes and trades of several contracts in
+time order: Replay in chunks vs Replay reading each table whole vs a
+heapq.merge of single events.
+
+    $ python benchmarks/bench_replay.py 8 500000
+"""
+
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import tables
+
+from pyreuters import hdf_repos_filters
+from pyreuters.data import Quote, Trade, quote_records, trade_records, \
+    index_table
+from pyreuters.replay import replay
+
+from bench_append import synthetic_quotes
+
+
+def write_store(path, contracts, n):
+    rs = np.random.RandomState(1)
+    with tables.open_file(path, mode="w") as store:
+        for kind in ("quotes", "trades"):
+            store.create_group("/", kind)
+        for i in range(contracts):
+            quotes = synthetic_quotes(n)
+            # shifted so the contracts interleave
+            quotes.index = quotes.index + pd.Timedelta(i, "ms")
+            table = store.create_table("/quotes", "C{}".format(i), Quote,
+                                       filters=hdf_repos_filters,
+                                       expectedrows=n)
+            table.append(quote_records(quotes, 20160104))
+            index_table(table)
+            picked = np.sort(rs.choice(n, n // 10, replace=False))
+            trades = pd.DataFrame({"price": quotes["bid"].values[picked],
+                                   "volume": rs.randint(1, 50, len(picked))
+                                   .astype(float)},
+                                  index=quotes.index[picked])
+            table = store.create_table("/trades", "C{}".format(i), Trade,
+                                       filters=hdf_repos_filters,
+                                       expectedrows=n)
+            table.append(trade_records(trades, 20160104))
+            index_table(table)
+
+
+def per_event(path, limit):
+    # every event goes through the heap, as a naive replay would do it
+    with tables.open_file(path, mode="r") as store:
+        iterators = [iter(x.iterrows(stop=limit)) for kind in
+                     ("quotes", "trades")
+                     for x in store.list_nodes("/" + kind, "Table")]
+        keyed = [((row["date_time"], row.nrow) for row in x)
+                 for x in iterators]
+        return sum(1 for _ in heapq.merge(*keyed))
+
+
+def main():
+    contracts = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    directory = tempfile.mkdtemp()
+    write_store(os.path.join(directory, "BENCH.h5"), contracts, n)
+    path = os.path.join(directory, "BENCH.h5")
+
+    def run(name, f):
+        start = time.time()
+        events = f()
+        elapsed = time.time() - start
+        print("{:>14}: {:>12,.0f} events/s ({:,} events, {:.2f}s)".format(
+            name, events / elapsed, events, elapsed))
+
+    def replayed(batch_size, chunk_rows):
+        return sum(len(x) for x in replay(
+            ["BENCH"], "2016-01-01", "2016-01-31", h5_dir=directory,
+            batch_size=batch_size, chunk_rows=chunk_rows))
+
+    for batch_size in (10000, 100000):
+        run("replay {}".format(batch_size),
+            lambda: replayed(batch_size, 100000))
+    run("whole tables", lambda: replayed(100000, n))
+    run("heapq.merge", lambda: per_event(path, min(n, 50000)))
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
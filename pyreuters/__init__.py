@@ -9,9 +9,6 @@ __version__ = '1.0.2'
 __package__ = 'pyreuters'
 
 
-hdf_repos_filters = tables.Filters(complevel=1, complib='zlib')
-
-
 with open(resource_filename(__name__, './resources/symbols.json')) as \
         data_file:
     symbols = json.load(data_file)
@@ -20,6 +17,33 @@ with open(resource_filename(__name__, './resources/server_config.json')) as \
         data_file:
     server_config = json.load(data_file)
 
+
+def hdf5_filters(complib='zlib', complevel=1, shuffle='byte'):
+    """PyTables filters for the market data tables.
+
+    `complib` is any library PyTables knows, e.g. zlib, blosc:lz4 or
+    blosc:zstd, and `shuffle` is one of byte, bit or none.
+    """
+    if shuffle not in ('byte', 'bit', 'none'):
+        raise ValueError("Unknown shuffle {}".format(shuffle))
+    return tables.Filters(complevel=complevel, complib=complib,
+                          shuffle=shuffle == 'byte',
+                          bitshuffle=shuffle == 'bit')
+
+
+# the "hdf5" section of server_config.json, with these defaults
+hdf5_config = {"complib": "zlib", "complevel": 1, "shuffle": "byte",
+               "expectedrows": 1000000, "chunkshape": None}
+hdf5_config.update(server_config.get("hdf5", {}))
+
+hdf_repos_filters = hdf5_filters(hdf5_config["complib"],
+                                 hdf5_config["complevel"],
+                                 hdf5_config["shuffle"])
+
+# the "cache" section of server_config.json: where parsed raw files are kept
+cache_config = {"cache_dir": "~/dev/reuters/tick_cache", "max_size_mb": 10240}
+cache_config.update(server_config.get("cache", {}))
+
 server_ip = server_config["server"]["server_ip"]
 
 remote_dir = server_config["server"]["server_dir"]
@@ -1,4 +1,6 @@
+import collections
 import logging
+import multiprocessing
 import tables
 import datetime
 import numpy as np
@@ -7,9 +9,193 @@ import os
 import re
 import json
 
-from pyreuters.clean import clean_quotes, clean_trades
-from ..data import Quote, Trade, read_raw, quotes_data, trades_data
-from .. import reuters_data_dir, hdf5_dir, hdf_repos_filters, symbols
+from pyreuters.clean import CleaningPipeline
+from pyreuters.cache import TickCache
+from ..data import Quote, Trade, Bar, split_ticks, quote_records, \
+    trade_records, bar_records, bar_nanos, index_table, indexed_columns, \
+    ingested_dates, add_ingested_date
+from .. import reuters_data_dir, hdf5_dir, hdf5_config, hdf5_filters, \
+    hdf_repos_filters, symbols
+
+# a run that adds more than this fraction of the rows of a table appends
+# with its indexes switched off and rebuilds them once at the end, smaller
+# ones update the indexes as the rows are flushed
+bulk_fraction = 0.1
+
+
+def indexes_up_to_date(table, columns=indexed_columns):
+    """Whether every index of `table` covers all its rows."""
+    return table.nrows > 0 and all(
+        table.colinstances[x].is_indexed and
+        not table.colinstances[x].index.dirty for x in columns)
+
+
+def contract_regex(instrument):
+    return re.compile("\\d{4}\\.\\d{2}\\.\\d{2}\\.(" + instrument +
+                      "(BF)*[FGHJKMNQUVXZ]\\S*\\d)\\.csv\\.gz")
+
+
+def add_hdf5_arguments(parser):
+    """Compression and chunking options shared by reuters_convert and
+    reuters_repack. Defaults come from the hdf5 section of the config.
+    """
+    parser.add_argument("--complib",
+                        help="Compression library, e.g. zlib, blosc:lz4 or "
+                             "blosc:zstd",
+                        action="store", type=str, dest="complib",
+                        default=hdf5_config["complib"])
+    parser.add_argument("--complevel",
+                        help="Compression level, 0 to 9",
+                        action="store", type=int, dest="complevel",
+                        default=hdf5_config["complevel"])
+    parser.add_argument("--shuffle",
+                        help="Shuffle filter applied before compression",
+                        action="store", type=str, dest="shuffle",
+                        choices=["byte", "bit", "none"],
+                        default=hdf5_config["shuffle"])
+    parser.add_argument("--expectedrows",
+                        help="Expected rows per table, used by PyTables to "
+                             "size the chunks",
+                        action="store", type=int, dest="expectedrows",
+                        default=hdf5_config["expectedrows"])
+    parser.add_argument("--chunkshape",
+                        help="Rows per chunk. Overrides --expectedrows for "
+                             "the chunk size",
+                        action="store", type=int, dest="chunkshape",
+                        default=hdf5_config["chunkshape"])
+
+
+def hdf5_options(options):
+    return hdf5_filters(options.complib, options.complevel,
+                        options.shuffle), options.expectedrows, \
+        options.chunkshape
+
+
+def open_store(hdf_file, verbose=False, logger=None,
+               filters=hdf_repos_filters):
+    store = tables.open_file(hdf_file, mode='a', filters=filters)
+    if not store.__contains__("/quotes"):
+        if verbose:
+            logger.info("quotes node doesn not exist in the file."
+                        "Creating...")
+        store.create_group("/", "quotes", "Quotes Market Data")
+    if not store.__contains__("/trades"):
+        if verbose:
+            logger.info("trades node doesn not exist in the file."
+                        "Creating...")
+        store.create_group("/", "trades", "Trades Market Data")
+    return store
+
+
+def get_table(store, where, table_name, verbose=False, logger=None,
+              filters=None, expectedrows=hdf5_config["expectedrows"],
+              chunkshape=hdf5_config["chunkshape"]):
+    if not store.__contains__("/" + where):
+        # bar groups, e.g. /bars/1min, are created on first use
+        parent, name = ("/" + where).rsplit("/", 1)
+        store.create_group(parent, name, "{} Bars".format(name),
+                           createparents=True)
+    group = store.get_node("/", where)
+    if not group.__contains__(table_name):
+        if verbose:
+            logger.info("{} table does not exist in {} group. "
+                        "Creating...".format(table_name, where))
+        description = {"quotes": Quote, "trades": Trade}.get(where, Bar)
+        store.create_table(group, table_name, description,
+                           "{} data for {}".format(where.capitalize(),
+                                                   table_name),
+                           filters=filters, expectedrows=expectedrows,
+                           chunkshape=None if chunkshape is None else
+                           (chunkshape,))
+    return store.get_node(group, table_name)
+
+
+def load_journal(journal_file):
+    """Raw files and dated directories seen by earlier --incremental runs.
+
+    "files" maps an output scope to {"YYYYMMDD": {filename: [size,
+    mtime]}} and "dirs" maps an output and instrument scope to
+    {"YYYYMMDD": mtime}. Journals written with "YYYYMMDD/filename" keys
+    are nested by directory when they are loaded.
+    """
+    if not os.path.exists(journal_file):
+        return {"files": {}, "dirs": {}}
+    with open(journal_file) as data_file:
+        journal = json.load(data_file)
+    for scope, done in journal["files"].items():
+        nested = {}
+        for key, value in done.items():
+            if "/" in key:
+                dr, filename = key.split("/", 1)
+                nested.setdefault(dr, {})[filename] = value
+            else:
+                nested.setdefault(key, {}).update(value)
+        journal["files"][scope] = nested
+    return journal
+
+
+def save_journal(journal, journal_file):
+    temp_file = journal_file + ".tmp"
+    with open(temp_file, "w") as data_file:
+        json.dump(journal, data_file, indent=2, sort_keys=True)
+    os.rename(temp_file, journal_file)
+
+
+def parse_contract(task):
+    """Read and optionally clean one (date, contract) raw file.
+
+    Runs in the worker processes when converting with --workers, so it only
+    takes and returns picklable values: the task tuple in, and a dict of
+    structured arrays out, keyed by the requested kinds of data (quotes,
+    trades or bars/<freq>). The dict is empty when the file is missing.
+    """
+    data_path, dr, contract, clean, wanted, verbose, threads, cache = task
+    logger = logging.getLogger(__name__)
+    quotes, trades = split_ticks(
+        symbol=contract, date=datetime.datetime.strptime(dr, "%Y%m%d"),
+        path=data_path, verbose=verbose, logger=logger, threads=threads,
+        cache=cache)
+    if quotes is None:
+        return {}
+
+    # bars are built from the cleaned quotes and trades
+    if clean and any(x != "trades" for x in wanted):
+        quotes, report = CleaningPipeline.for_quotes().run(quotes)
+        if verbose:
+            logger.info("Cleaned quotes for {} on {} - {}".format(
+                contract, dr, report))
+    if clean and any(x != "quotes" for x in wanted):
+        trades, report = CleaningPipeline.for_trades().run(trades)
+        if verbose:
+            logger.info("Cleaned trades for {} on {} - {}".format(
+                contract, dr, report))
+
+    records = {}
+    for where in wanted:
+        if where == "quotes":
+            records[where] = quote_records(quotes, int(dr))
+        elif where == "trades":
+            records[where] = trade_records(trades, int(dr))
+        else:
+            records[where] = bar_records(quotes, trades, int(dr),
+                                         where.split("/")[1])
+    return records
+
+
+def imap_bounded(pool, func, jobs, pending):
+    """Results of func over jobs from pool, in submission order.
+
+    Unlike pool.imap, at most `pending` jobs are submitted and not yet
+    handed back, so workers running ahead of a slow consumer cannot pile up
+    parsed files in memory.
+    """
+    submitted = collections.deque()
+    for job in jobs:
+        if len(submitted) >= pending:
+            yield submitted.popleft().get()
+        submitted.append(pool.apply_async(func, (job,)))
+    while submitted:
+        yield submitted.popleft().get()
 
 
 def main():
@@ -49,6 +235,36 @@ def main():
                         action="store", type=str, dest="data_path")
     parser.add_argument("-d", "--destination", help="Destination directory",
                         action="store", type=str, dest="dest_path")
+    parser.add_argument("-w", "--workers",
+                        help="Number of processes reading and cleaning raw "
+                             "files. All writes stay in the main process",
+                        action="store", type=int, dest="workers", default=1)
+    parser.add_argument("-f", "--format",
+                        help="Storage format. parquet writes a directory "
+                             "named like the hdf5 file with one Parquet file "
+                             "per contract and date",
+                        action="store", type=str, dest="format",
+                        choices=["hdf5", "parquet"], default="hdf5")
+    parser.add_argument("-b", "--bars",
+                        help="Bar frequencies to store in /bars/<freq>, "
+                             "separate frequencies by ,. e.g. 1s,1min",
+                        action="store", type=str, dest="bars")
+    parser.add_argument("-t", "--threads",
+                        help="Number of threads decompressing and parsing "
+                             "each raw file. Helps with a few large files "
+                             "where --workers has little to spread",
+                        action="store", type=int, dest="threads", default=1)
+    parser.add_argument("--no-cache",
+                        help="Parse every raw file, without reading or "
+                             "filling the cache of parsed files",
+                        action="store_false", dest="cache", default=True)
+    parser.add_argument("--incremental",
+                        help="Only look at raw files that are new or changed "
+                             "since the last incremental run, as recorded "
+                             "in .reuters_convert.json in the destination",
+                        action="store_true", dest="incremental",
+                        default=False)
+    add_hdf5_arguments(parser)
 
     options = parser.parse_args()
 
@@ -63,21 +279,42 @@ def main():
             os.path.expanduser(reuters_data_dir)
         dest_path = options.dest_path if options.dest_path else \
             os.path.expanduser(hdf5_dir)
+
+        filters, expectedrows, chunkshape = hdf5_options(options)
+        cache = TickCache() if options.cache else None
+
+        bar_freqs = options.bars.split(',') if options.bars else []
+        for freq in bar_freqs:
+            bar_nanos(freq)
+        kinds = ["quotes", "trades"] + \
+            ["bars/{}".format(x) for x in bar_freqs]
+
+        replace_symbols = symbols
+        if options.symbols:
+            with open(options.symbols) as data_file:
+                replace_symbols = json.load(data_file)
+
+        journal_file = os.path.join(dest_path, ".reuters_convert.json")
+        journal = load_journal(journal_file) if options.incremental else \
+            {"files": {}, "dirs": {}}
+        seen_files = []
+        seen_dirs = []
+
+        stores = {}
+        ingested = {}
+        tasks = []
         date_match = re.compile("\\d{8}")
         dated_dirs = [x for x in os.listdir(data_path) if date_match.match(x)]
         for dr in np.sort(dated_dirs):
             if options.verbose:
                 logger.info("Loading data for {}".format(dr))
+            dir = os.path.join(data_path, dr)
+            dir_mtime = os.path.getmtime(dir)
+            date_files = None
             for instrument in instruments:
                 if options.verbose:
                     logger.info("Converting data for {}".format(instrument))
 
-                replace_symbols = symbols
-
-                if options.symbols:
-                    with open(options.config) as data_file:
-                        replace_symbols = json.load(data_file)
-
                 hdf_file = "{}.h5".format(replace_symbols[instrument])
                 if options.keep_ric:
                     hdf_file = "{}.h5".format(instrument)
@@ -90,127 +327,149 @@ def main():
                 if options.verbose:
                     logger.info("HDF5 File for {} : {}".format(instrument,
                                                                hdf_file))
-                store = tables.open_file(hdf_file, mode='a',
-                                         filters=hdf_repos_filters)
-                if not store.__contains__("/quotes"):
-                    if options.verbose:
-                        logger.info("quotes node doesn not exist in the file."
-                                    "Creating...")
-                    store.create_group("/", "quotes", "Quotes Market Data")
-                if not store.__contains__("/trades"):
-                    if options.verbose:
-                        logger.info("trades node doesn not exist in the file."
-                                    "Creating...")
-                    store.create_group("/", "trades", "Trades Market Data")
-
-                dir = os.path.join(data_path, dr)
-                date_files = np.array(os.listdir(dir))
-                reg = re.compile("\\d{4}\\.\\d{2}\\.\\d{2}\\.(" + instrument +
-                                 "(BF)*[FGHJKMNQUVXZ]\\S*\\d)\\.csv\\.gz")
+                if options.format == "parquet":
+                    hdf_file = os.path.splitext(hdf_file)[0]
+
+                files_scope = "{}|{}".format(os.path.abspath(hdf_file),
+                                             ",".join(kinds))
+                dirs_scope = "{}|{}".format(files_scope, instrument)
+                done = journal["files"].get(files_scope, {}).get(dr, {})
+                reg = contract_regex(instrument)
+                if options.incremental and \
+                        journal["dirs"].get(dirs_scope, {}).get(dr) == \
+                        dir_mtime:
+                    # nothing was added, removed or renamed into the
+                    # directory since the last run
+                    continue
+                seen_dirs.append((dirs_scope, dr, dir_mtime))
+                if date_files is None:
+                    date_files = np.array(os.listdir(dir))
                 inst_files = [x for x in date_files if reg.match(x)]
                 if options.verbose:
                     logger.info("Found {} files for {}".format(len(inst_files),
                                                                instrument))
                 for f in inst_files:
+                    key = "{}/{}".format(dr, f)
+                    stat = os.stat(os.path.join(dir, f))
+                    fingerprint = [stat.st_size, stat.st_mtime]
+                    if options.incremental and f in done:
+                        if done[f] == fingerprint:
+                            continue
+                        # converted rows are never replaced
+                        logger.warning("{} changed since it was converted"
+                                       .format(key))
+                    seen_files.append((files_scope, dr, f, fingerprint))
+
+                    # stores are only opened once they have a file to take
+                    if hdf_file not in stores:
+                        if options.format == "parquet":
+                            from ..parquet import ParquetStore
+                            stores[hdf_file] = ParquetStore(hdf_file)
+                        else:
+                            stores[hdf_file] = open_store(
+                                hdf_file, options.verbose, logger, filters)
+                    store = stores[hdf_file]
+
                     contract = reg.match(f).group(1)
                     table_name = contract.replace(".", "_")
 
-                    raw_data = None
-
-                    quotes_group = store.get_node("/", "quotes")
-                    if not quotes_group.__contains__(table_name):
-                        if options.verbose:
-                            logger.info(
-                                "{} table does not exist in quotes group. "
-                                "Creating...".format(table_name))
-                        store.create_table(quotes_group, table_name, Quote,
-                                           "Quotes data for {}".format(
-                                               table_name))
-
-                    table = store.get_node(quotes_group, table_name)
-                    existing = np.array([str(x) for x in
-                                np.unique(table.col('file_date'))])
-                    date_exists = np.any(existing == dr)
-
-                    if not date_exists:
-                        raw_data = read_raw(symbol=contract,
-                                            date=datetime.datetime.strptime(
-                                                dr, "%Y%m%d"),
-                                            path=reuters_data_dir,
-                                            verbose=options.verbose,
-                                            logger=logger)
-                        quotes = quotes_data(raw_data=raw_data)
-                        if options.clean:
-                            quotes = clean_quotes(quotes)
-                        num_rows = len(quotes.index)
-                        if options.verbose:
-                            logger.info("Adding {} new quotes to {}".format(
-                                num_rows, hdf_file))
-                        if num_rows > 0:
-                            row = table.row
-                            quotes['DateTime'] = quotes.index.astype(np.int64)
-                            for index, q in quotes.iterrows():
-                                row['file_date'] = int(dr)
-                                row['date_time'] = q['date_time']
-                                if not np.isnan(q['bid']):
-                                    row['bid'] = float(q['bid'])
-                                if not np.isnan(q['ask']):
-                                    row['ask'] = float(q['ask'])
-                                if not np.isnan(q['bid_size']):
-                                    row['bid_size'] = int(q['bid_size'])
-                                if not np.isnan(q['ask_size']):
-                                    row['ask_size'] = int(q['ask_size'])
-                                row.append()
-                        table.flush()
-
-                    trades_group = store.get_node("/", "trades")
-
-                    if not trades_group.__contains__(table_name):
-                        if options.verbose:
-                            logger.info(
-                                "{} table does not exist in the trades "
-                                "group. Creating...".format(table_name))
-                        store.create_table(trades_group, table_name, Trade,
-                                           "Trades data for {}".format(
-                                               table_name))
-
-                    table = store.get_node(trades_group, table_name)
-                    existing = np.array([str(x) for x in
-                                np.unique(table.col('file_date'))])
-                    date_exists = np.any(existing == dr)
-
-                    if not date_exists:
-                        row = table.row
-                        if raw_data is None:
-                            raw_data = read_raw(symbol=contract,
-                                                date=datetime.datetime.strptime(
-                                                    dr, "%Y%m%d"),
-                                                path=reuters_data_dir,
-                                                verbose=options.verbose,
-                                                logger=logger)
-
-                        trades = trades_data(raw_data=raw_data)
-                        if options.clean:
-                            trades = clean_trades(trades)
-                        num_rows = len(trades.index)
-                        if options.verbose:
-                            logger.info("Adding {} new trades to {}".format(
-                                num_rows, hdf_file))
-                        if num_rows > 0:
-                            trades['DateTime'] = trades.index.astype(np.int64)
-                            for index, trd in trades.iterrows():
-                                row['file_date'] = int(dr)
-                                row['date_time'] = trd['date_time']
-                                if not np.isnan(trd['volume']):
-                                    row['volume'] = int(trd['volume'])
-                                if not np.isnan(trd['price']):
-                                    row['price'] = float(trd['price'])
-                                row.append()
-                        table.flush()
-
-                store.flush()
-                store.close()
+                    if options.format == "parquet":
+                        targets = dict((x, table_name) for x in kinds)
+                        wanted = [x for x in kinds if int(dr) not in
+                                  store.ingested_dates(x, table_name)]
+                    else:
+                        targets = dict(
+                            (x, get_table(store, x, table_name,
+                                          options.verbose, logger, filters,
+                                          expectedrows, chunkshape))
+                            for x in kinds)
+                        for table in targets.values():
+                            key = (hdf_file, table._v_pathname)
+                            if key not in ingested:
+                                ingested[key] = ingested_dates(table)
+                        wanted = [x for x in kinds if int(dr) not in
+                                  ingested[(hdf_file,
+                                            targets[x]._v_pathname)]]
+
+                    if wanted:
+                        tasks.append(((data_path, str(dr), contract,
+                                       options.clean, wanted,
+                                       options.verbose, options.threads,
+                                       cache),
+                                      hdf_file, targets))
+
+        pool = None
+        jobs = [task for task, _, _ in tasks]
+        if options.workers > 1:
+            pool = multiprocessing.Pool(processes=options.workers)
+            # two jobs per worker keep them busy while the main process
+            # writes, without holding every parsed file in memory
+            results = imap_bounded(pool, parse_contract, jobs,
+                                   2 * options.workers)
+        else:
+            results = (parse_contract(job) for job in jobs)
+
+        # results come back in submission order, so every table sees its
+        # appends in the same order as a serial run
+        written = {}
+        for (task, hdf_file, targets), records in zip(tasks, results):
+            store = stores[hdf_file]
+            for where in task[4]:
+                if where not in records:
+                    continue
+                if options.verbose:
+                    logger.info("Adding {} new {} to {}".format(
+                        len(records[where]), where, hdf_file))
+                if options.format == "parquet":
+                    store.append(where, targets[where], task[1],
+                                 records[where])
+                    continue
+                table = targets[where]
+                appends = written.setdefault(hdf_file, {})
+                if table._v_pathname not in appends:
+                    # a new table, or one without up to date indexes, is
+                    # indexed once all the appends are done
+                    appends[table._v_pathname] = {
+                        "table": table, "nrows": table.nrows,
+                        "bulk": not indexes_up_to_date(table)}
+                entry = appends[table._v_pathname]
+                if not entry["bulk"] and \
+                        table.nrows + len(records[where]) - entry["nrows"] > \
+                        bulk_fraction * entry["nrows"]:
+                    entry["bulk"] = True
+                table.autoindex = not entry["bulk"]
+                if len(records[where]) > 0:
+                    table.append(records[where])
+                table.flush()
+                add_ingested_date(table, task[1])
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        for hdf_file, store in stores.items():
+            if options.format == "parquet":
+                continue
+            for entry in written.get(hdf_file, {}).values():
+                table = entry["table"]
+                if not entry["bulk"]:
+                    # updated as the rows were flushed
+                    continue
+                if options.verbose:
+                    logger.info("Indexing {} in {}".format(
+                        table._v_pathname, hdf_file))
+                index_table(table)
+            store.flush()
+            store.close()
+
+        if options.incremental:
+            for files_scope, dr, f, fingerprint in seen_files:
+                journal["files"].setdefault(files_scope, {}).setdefault(
+                    dr, {})[f] = fingerprint
+            for dirs_scope, dr, dir_mtime in seen_dirs:
+                journal["dirs"].setdefault(dirs_scope, {})[dr] = dir_mtime
+            save_journal(journal, journal_file)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -4,11 +4,91 @@ import os
 import pandas as pd
 from pandas.tseries.offsets import BDay
 import datetime
+import gzip
+import json
+import threading
+from multiprocessing.pool import ThreadPool
 import pysftp
 import re
+import zlib
 
 from .. import reuters_data_dir, server_ip, remote_dir
 
+block_size = 1 << 20
+
+# errors that fail the download of one file, not the whole run
+transfer_errors = (IOError, OSError, EOFError, pysftp.ConnectionException,
+                   pysftp.SSHException)
+
+
+def load_manifest(manifest_file):
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as data_file:
+            return json.load(data_file)
+    return {}
+
+
+def save_manifest(manifest, manifest_file):
+    temp_file = manifest_file + ".tmp"
+    with open(temp_file, "w") as data_file:
+        json.dump(manifest, data_file, indent=2, sort_keys=True)
+    os.rename(temp_file, manifest_file)
+
+
+def check_gzip(path):
+    """Raise IOError unless `path` is a complete gzip file.
+
+    Reading to the end makes gzip check the CRC and length of every member.
+    """
+    try:
+        with gzip.open(path, "rb") as data_file:
+            while data_file.read(block_size):
+                pass
+    except (IOError, OSError, EOFError, zlib.error) as err:
+        raise IOError("{} is not a valid gzip file: {}".format(path, err))
+
+
+def fetch(connection, remote_file, version, part_file, dest_file):
+    """Download remote_file into dest_file through part_file.
+
+    `version` is the size and modification time of the remote file. It is
+    kept in part_file.json while the download is in progress, and bytes
+    already in part_file from an interrupted run are only resumed from if
+    they came from the same version of the remote file. dest_file only
+    appears once the whole file is on disk and is a valid gzip file.
+    """
+    size = version["size"]
+    version_file = part_file + ".json"
+    offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+    if offset > 0 and (offset > size or
+                       load_manifest(version_file) != version):
+        # left by another version of the remote file
+        os.unlink(part_file)
+        offset = 0
+    save_manifest(version, version_file)
+    with open(part_file, "ab") as local:
+        if offset < size:
+            with connection.open(remote_file, "rb") as remote:
+                remote.seek(offset)
+                while True:
+                    chunk = remote.read(block_size)
+                    if not chunk:
+                        break
+                    local.write(chunk)
+    downloaded = os.path.getsize(part_file)
+    if downloaded != size:
+        raise IOError("Downloaded {} of {} bytes for {}".format(
+            downloaded, size, remote_file))
+    try:
+        check_gzip(part_file)
+    except IOError:
+        # the next run downloads it again from the start
+        os.unlink(part_file)
+        os.unlink(version_file)
+        raise
+    os.rename(part_file, dest_file)
+    os.unlink(version_file)
+
 
 def main():
     logger = logging.getLogger(__name__)
@@ -45,6 +125,9 @@ def main():
     parser.add_argument('-e', '--end',
                         help='End date for data in format YYYYMMDD',
                         action='store', type=str, dest='end_date')
+    parser.add_argument("-P", "--parallel",
+                        help="Number of concurrent sftp sessions",
+                        action="store", type=int, dest="parallel", default=1)
 
     options = parser.parse_args()
     missing_args = not all((options.username, options.password,
@@ -55,22 +138,12 @@ def main():
             logger.error("Missing required arguments")
         parser.print_help()
     else:
-        server_address = server_ip if options.network_ip else options.network_ip
+        server_address = options.network_ip if options.network_ip else \
+            server_ip
         save_dir = options.dir if options.dir else \
             os.path.expanduser(reuters_data_dir)
         cache_dir = os.path.abspath(os.path.join(save_dir, "../cache"))
-
-        for the_file in os.listdir(cache_dir):
-            file_path = os.path.join(cache_dir, the_file)
-            try:
-                if os.path.isfile(file_path):
-                    if options.verbose:
-                        logger.info("Removing {} from cache directory".format(
-                            file_path))
-                    os.unlink(file_path)
-            except Exception as e:
-                logger.error("Failed to delete file in cache directory with "
-                             "error - {}", e)
+        manifest_file = os.path.join(save_dir, "manifest.json")
 
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
@@ -105,62 +178,118 @@ def main():
         if options.verbose:
             logger.info("Instruments " + str(instruments))
 
+        def connect():
+            return pysftp.Connection(server_address,
+                                     username=options.username,
+                                     password=options.password)
+
         connection = None
         try:
-            connection = pysftp.Connection(server_address,
-                                           username=options.username,
-                                           password=options.password)
+            connection = connect()
         except (pysftp.ConnectionException,
                 pysftp.CredentialException,
                 pysftp.SSHException,
                 pysftp.AuthenticationException) as e:
-            logger.error("Sftp connection error. Error message: ", e)
-            connection.close()
+            logger.error("Sftp connection error. Error message: {}".format(e))
             return
 
-        wd = os.getcwd()
-        os.chdir(cache_dir)
+        manifest = load_manifest(manifest_file)
+        jobs = []
 
         for dt in pd.date_range(start=start_date, end=end_date, freq='D'):
             if options.verbose:
-                logger.info("Downloading data for date " + dt.strftime('%Y-%m-%d'))
+                logger.info("Listing data for date " + dt.strftime('%Y-%m-%d'))
             date_dir = remote_dir + dt.strftime('%Y.%m.%d')
-            with connection.cd():
-                if connection.exists(date_dir):
-                    connection.chdir(date_dir)
-                    files = connection.listdir()
-                    for inst in instruments:
-                        r = re.compile("\\d{4}\\.\\d{2}\\.\\d{2}\\." + inst +
-                                       "(BF)*[FGHJKMNQUVXZ]\\S*\\d\\.csv\\.gz")
-                        inst_files = [f for f in files if r.match(f)]
-                        if options.verbose:
-                            logger.info("Found {} files on the server "
-                                        "for {}".format(len(inst_files), inst))
-                            logger.info("Downloading data for " + str(inst))
-                            logger.info("Found " + str(len(inst_files)) +
-                                        ' files')
-
-                        for filename in inst_files:
-                            to_move = os.path.abspath(filename)
-                            dest_dir = os.path.join(save_dir,
-                                                    dt.strftime('%Y%m%d'))
-                            dest_file = os.path.join(dest_dir, filename)
-                            if not os.path.exists(dest_dir):
-                                os.makedirs(dest_dir)
-                            if not os.path.exists(dest_file):
-                                connection.get(filename)
-                                downloaded_file = os.path.join('.', to_move)
-                                if os.path.isfile(downloaded_file):
-                                    if options.verbose:
-                                        logger.info("Moving " +
-                                                    str(downloaded_file) +
-                                                    " to " + str(dest_file))
-                                    os.rename(downloaded_file, dest_file)
-
-        os.chdir(wd)
-
-        if connection is not None:
-            connection.close()
+            if not connection.exists(date_dir):
+                continue
+            files = connection.listdir_attr(date_dir)
+            dest_dir = os.path.join(save_dir, dt.strftime('%Y%m%d'))
+            for inst in instruments:
+                r = re.compile("\\d{4}\\.\\d{2}\\.\\d{2}\\." + inst +
+                               "(BF)*[FGHJKMNQUVXZ]\\S*\\d\\.csv\\.gz")
+                inst_files = [f for f in files if r.match(f.filename)]
+                if options.verbose:
+                    logger.info("Found {} files on the server "
+                                "for {}".format(len(inst_files), inst))
+
+                for attr in inst_files:
+                    key = "{}/{}".format(dt.strftime('%Y%m%d'), attr.filename)
+                    dest_file = os.path.join(dest_dir, attr.filename)
+                    done = {"size": attr.st_size, "mtime": attr.st_mtime}
+                    if os.path.exists(dest_file):
+                        if manifest.get(key) == done:
+                            continue
+                        if key not in manifest and \
+                                os.path.getsize(dest_file) == attr.st_size:
+                            manifest[key] = done
+                            continue
+                    if not os.path.exists(dest_dir):
+                        os.makedirs(dest_dir)
+                    part_file = os.path.join(cache_dir,
+                                             attr.filename + ".part")
+                    jobs.append((key, done, date_dir + "/" + attr.filename,
+                                 part_file, dest_file))
+
+        if options.verbose:
+            logger.info("Downloading {} files over {} sessions".format(
+                len(jobs), options.parallel))
+
+        sessions = threading.local()
+        opened = [connection]
+        opened_lock = threading.Lock()
+
+        def session():
+            if not hasattr(sessions, "connection"):
+                sessions.connection = connect()
+                with opened_lock:
+                    opened.append(sessions.connection)
+            return sessions.connection
+
+        def download(job):
+            key, done, remote_file, part_file, dest_file = job
+            if options.verbose:
+                logger.info("Downloading {} to {}".format(remote_file,
+                                                          dest_file))
+            try:
+                fetch(session(), remote_file, done, part_file, dest_file)
+            except transfer_errors as err:
+                # the partial file is kept, the next run resumes it
+                logger.error("Failed to download {}: {}".format(
+                    remote_file, err))
+                return key, None, remote_file, err
+            return key, done, remote_file, None
+
+        pool = None
+        if options.parallel > 1:
+            pool = ThreadPool(options.parallel)
+            results = pool.imap_unordered(download, jobs)
+        else:
+            sessions.connection = connection
+            results = (download(job) for job in jobs)
+
+        failures = []
+        try:
+            for key, done, remote_file, err in results:
+                if err is not None:
+                    failures.append((remote_file, err))
+                    continue
+                manifest[key] = done
+                save_manifest(manifest, manifest_file)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            save_manifest(manifest, manifest_file)
+            for conn in opened:
+                conn.close()
+
+        if failures:
+            logger.error("{} of {} files failed to download, run again to "
+                         "resume them:\n{}".format(
+                             len(failures), len(jobs),
+                             "\n".join("  {}: {}".format(*x)
+                                        for x in sorted(failures))))
+            return 1
 
 if __name__ == '__main__':
     main()
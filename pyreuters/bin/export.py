@@ -0,0 +1,106 @@
+import logging
+import tables
+import argparse
+import os
+
+import numpy as np
+
+from ..data import ingested_dates
+from ..memmap import MemmapStore, memmap_columns
+from .. import hdf5_dir
+
+
+def __frame_ready__(kind, records):
+    # the -1 size and volume placeholders of the hdf5 tables become NaN
+    data = {"date_time": records["date_time"]}
+    for column in memmap_columns[kind]:
+        values = records[column].astype(np.float64)
+        if records[column].dtype.kind == "i":
+            values[records[column] == -1] = np.nan
+        data[column] = values
+    return data
+
+
+def export_file(hdf_file, root, contracts=None, verbose=False, logger=None):
+    """Append to the memmap store at `root` every file date of `hdf_file`
+    that it does not have yet.
+
+    `contracts` restricts the tables exported.
+    """
+    store = MemmapStore(root)
+    with tables.open_file(hdf_file, mode="r") as h5:
+        for kind in ("quotes", "trades"):
+            for table in h5.list_nodes("/" + kind, "Table"):
+                if contracts is not None and table.name not in contracts:
+                    continue
+                done = store.ingested_dates(kind, table.name)
+                for file_date in sorted(ingested_dates(table) - done):
+                    records = table.read_where(
+                        "file_date == {}".format(file_date))
+                    if verbose:
+                        logger.info("Exporting {} {} of {} for {}".format(
+                            len(records), kind, table.name, file_date))
+                    store.append(kind, table.name, file_date,
+                                 __frame_ready__(kind, records))
+
+
+def main():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    parser = argparse.ArgumentParser(
+        description="Export hdf5 market data files to uncompressed column "
+                    "files read with memory maps",
+        epilog="Example : reuters_export -f CME_NG.h5 -c NGH6,NGJ6")
+    parser.add_argument("-v", "--verbose",
+                        help="Verbose output for the export",
+                        action='store_true', default=False, dest='verbose')
+    parser.add_argument("-f", "--files",
+                        help="hdf5 files to export, separate files by ,. "
+                             "Relative names are looked up in the "
+                             "destination directory. Defaults to every "
+                             ".h5 file in it",
+                        action="store", type=str, dest="files")
+    parser.add_argument("-c", "--contracts",
+                        help="Contracts to export, separate contracts by ,. "
+                             "Defaults to every contract",
+                        action="store", type=str, dest="contracts")
+    parser.add_argument("-d", "--destination",
+                        help="Directory with the hdf5 files",
+                        action="store", type=str, dest="dest_path")
+    parser.add_argument("-o", "--output",
+                        help="Directory of the exported stores. Defaults to "
+                             "memmap in the destination directory",
+                        action="store", type=str, dest="output")
+
+    options = parser.parse_args()
+
+    dest_path = options.dest_path if options.dest_path else \
+        os.path.expanduser(hdf5_dir)
+    output = options.output if options.output else \
+        os.path.join(dest_path, "memmap")
+    contracts = options.contracts.split(',') if options.contracts else None
+
+    if options.files:
+        hdf_files = [os.path.join(dest_path, x)
+                     for x in options.files.split(',')]
+    else:
+        hdf_files = [os.path.join(dest_path, x)
+                     for x in sorted(os.listdir(dest_path))
+                     if x.endswith(".h5")]
+
+    for hdf_file in hdf_files:
+        root = os.path.join(output,
+                            os.path.splitext(os.path.basename(hdf_file))[0])
+        if options.verbose:
+            logger.info("Exporting {} to {}".format(hdf_file, root))
+        export_file(hdf_file, root, contracts, options.verbose, logger)
+
+
+if __name__ == '__main__':
+    main()
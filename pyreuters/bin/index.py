@@ -0,0 +1,68 @@
+import logging
+import tables
+import argparse
+import os
+
+from ..data import index_table, indexed_columns
+from .. import hdf5_dir
+
+
+def main():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    parser = argparse.ArgumentParser(
+        description="Create or rebuild the date_time and file_date indexes "
+                    "of hdf5 market data files",
+        epilog="Example : reuters_index -f GE.h5,CME_NG.h5")
+    parser.add_argument("-v", "--verbose",
+                        help="Verbose output for the indexing",
+                        action='store_true', default=False, dest='verbose')
+    parser.add_argument("-f", "--files",
+                        help="hdf5 files to index, separate files by ,. "
+                             "Relative names are looked up in the "
+                             "destination directory. Defaults to every "
+                             ".h5 file in it",
+                        action="store", type=str, dest="files")
+    parser.add_argument("-d", "--destination",
+                        help="Directory with the hdf5 files",
+                        action="store", type=str, dest="dest_path")
+    parser.add_argument("--force",
+                        help="Rebuild indexes that are already up to date",
+                        action="store_true", default=False, dest="force")
+
+    options = parser.parse_args()
+
+    dest_path = options.dest_path if options.dest_path else \
+        os.path.expanduser(hdf5_dir)
+
+    if options.files:
+        hdf_files = [os.path.join(dest_path, x)
+                     for x in options.files.split(',')]
+    else:
+        hdf_files = [os.path.join(dest_path, x)
+                     for x in sorted(os.listdir(dest_path))
+                     if x.endswith(".h5")]
+
+    for hdf_file in hdf_files:
+        if options.verbose:
+            logger.info("Indexing {}".format(hdf_file))
+        store = tables.open_file(hdf_file, mode='a')
+        for table in store.walk_nodes("/", "Table"):
+            if not all(x in table.colnames for x in indexed_columns):
+                continue
+            if options.verbose:
+                logger.info("Indexing {} ({} rows)".format(
+                    table._v_pathname, table.nrows))
+            index_table(table, force=options.force)
+        store.flush()
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
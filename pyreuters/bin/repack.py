@@ -0,0 +1,95 @@
+import logging
+import tables
+import argparse
+import os
+
+from ..data import index_table, indexed_columns
+from .. import hdf5_dir
+from .convert import add_hdf5_arguments, hdf5_options
+
+
+def repack(hdf_file, filters, chunkshape=None):
+    """Rewrite `hdf_file` with `filters`, replacing it in place.
+
+    Every table is copied with its attributes and indexes, chunked for
+    its actual number of rows unless `chunkshape` rows per chunk is given.
+    The copy is written next to the file and renamed over it at the end.
+    """
+    tmp_file = os.path.join(os.path.dirname(hdf_file),
+                            "." + os.path.basename(hdf_file) + ".repack")
+    # File.copy_file keeps the filters of every node, so the hierarchy is
+    # copied one node at a time
+    with tables.open_file(hdf_file, mode='r') as source, \
+            tables.open_file(tmp_file, mode='w', title=source.title,
+                             filters=filters) as store:
+        source.root._v_attrs._f_copy(store.root)
+        for group in source.walk_groups("/"):
+            if group is not source.root:
+                copy = store.create_group(group._v_parent._v_pathname,
+                                          group._v_name, group._v_title,
+                                          filters=filters)
+                group._v_attrs._f_copy(copy)
+            for leaf in source.list_nodes(group, "Leaf"):
+                leaf.copy(store.get_node(group._v_pathname), filters=filters,
+                          chunkshape='auto' if chunkshape is None else
+                          (chunkshape,), propindexes=True)
+        for table in store.walk_nodes("/", "Table"):
+            if all(x in table.colnames for x in indexed_columns):
+                index_table(table)
+    os.rename(tmp_file, hdf_file)
+
+
+def main():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    parser = argparse.ArgumentParser(
+        description="Rewrite hdf5 market data files with new compression "
+                    "and chunking",
+        epilog="Example : reuters_repack -f CME_NG.h5 --complib blosc:zstd "
+               "--complevel 5")
+    parser.add_argument("-v", "--verbose",
+                        help="Verbose output for the repacking",
+                        action='store_true', default=False, dest='verbose')
+    parser.add_argument("-f", "--files",
+                        help="hdf5 files to repack, separate files by ,. "
+                             "Relative names are looked up in the "
+                             "destination directory. Defaults to every "
+                             ".h5 file in it",
+                        action="store", type=str, dest="files")
+    parser.add_argument("-d", "--destination",
+                        help="Directory with the hdf5 files",
+                        action="store", type=str, dest="dest_path")
+    add_hdf5_arguments(parser)
+
+    options = parser.parse_args()
+
+    dest_path = options.dest_path if options.dest_path else \
+        os.path.expanduser(hdf5_dir)
+
+    if options.files:
+        hdf_files = [os.path.join(dest_path, x)
+                     for x in options.files.split(',')]
+    else:
+        hdf_files = [os.path.join(dest_path, x)
+                     for x in sorted(os.listdir(dest_path))
+                     if x.endswith(".h5")]
+
+    filters, _, chunkshape = hdf5_options(options)
+    for hdf_file in hdf_files:
+        size = os.path.getsize(hdf_file)
+        if options.verbose:
+            logger.info("Repacking {} with {}".format(hdf_file, filters))
+        repack(hdf_file, filters, chunkshape)
+        if options.verbose:
+            logger.info("{}: {:,} -> {:,} bytes".format(
+                hdf_file, size, os.path.getsize(hdf_file)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""On-disk cache of parsed raw tick files.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from . import cache_config
+
+# bump when the layout of the cached arrays or the parsing changes
+cache_version = 1
+
+# an eviction brings the cache down to this fraction of max_bytes, so the
+# cache directory is not walked again on the next few puts
+low_water = 0.9
+
+# temporary entries older than this, in seconds, were left by a process
+# that died while writing them
+stale_seconds = 3600
+
+
+class TickCache(object):
+    """Parsed read_ticks frames stored as .npy arrays, one directory per
+    raw file.
+
+    Entries are keyed by the path, size and modification time of the raw
+    file, so a file that changes is parsed again. The arrays are loaded
+    memory mapped.
+
+    The size of the cache is counted as entries are stored, and the
+    directory is only walked once that count goes past `max_bytes`: then
+    the least recently used entries are removed down to `low_water` of
+    `max_bytes`, and temporary entries left by dead processes are deleted.
+    Every process counts its own puts, so with several writers the cache
+    can briefly grow past `max_bytes`. Only plain attributes are kept, so a
+    cache can be handed to worker processes.
+    """
+    def __init__(self, cache_dir=cache_config["cache_dir"],
+                 max_bytes=cache_config["max_size_mb"] * 2**20):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        # bytes in the cache as of the last walk plus the puts since then,
+        # None until the first walk
+        self.total = None
+
+    def key(self, raw_file):
+        path = os.path.abspath(raw_file)
+        stat = os.stat(path)
+        fingerprint = "{}|{}|{}|{}".format(cache_version, path, stat.st_size,
+                                           stat.st_mtime)
+        return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+
+    def get(self, raw_file):
+        """The cached frame for `raw_file`, or None."""
+        entry = os.path.join(self.cache_dir, self.key(raw_file))
+        try:
+            with open(os.path.join(entry, "meta.json")) as meta_file:
+                meta = json.load(meta_file)
+            arrays = dict((name, np.load(os.path.join(entry, name + ".npy"),
+                                         mmap_mode="r"))
+                          for name in ["date_time", "Type"] + meta["columns"])
+            # the modification time orders entries for eviction
+            os.utime(entry, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        data = pd.DataFrame(dict((x, arrays[x]) for x in meta["columns"]),
+                            columns=meta["columns"])
+        data.insert(0, "Type", pd.Categorical.from_codes(
+            arrays["Type"], categories=meta["types"]))
+        data.index = pd.DatetimeIndex(
+            np.asarray(arrays["date_time"]).view("datetime64[ns]"),
+            name="date_time")
+        return data
+
+    def put(self, raw_file, data):
+        """Store the read_ticks frame of `raw_file` and evict old entries.
+        """
+        entry = os.path.join(self.cache_dir, self.key(raw_file))
+        # written under a temporary name so readers never see half an entry
+        part = os.path.join(self.cache_dir, ".{}".format(uuid.uuid4().hex))
+        os.makedirs(part)
+        types = data["Type"].astype("category")
+        columns = [x for x in data.columns if x != "Type"]
+        np.save(os.path.join(part, "date_time.npy"),
+                data.index.values.astype("datetime64[ns]").view(np.int64))
+        np.save(os.path.join(part, "Type.npy"), types.cat.codes.values)
+        for name in columns:
+            np.save(os.path.join(part, name + ".npy"), data[name].values)
+        with open(os.path.join(part, "meta.json"), "w") as meta_file:
+            json.dump({"raw_file": os.path.abspath(raw_file),
+                       "columns": columns,
+                       "types": list(types.cat.categories)}, meta_file)
+        added = __entry_size__(part)
+        try:
+            os.rename(part, entry)
+        except OSError:
+            # another process stored the same file first
+            shutil.rmtree(part, ignore_errors=True)
+            added = 0
+        if self.total is None or self.total + added > self.max_bytes:
+            self.evict()
+        else:
+            self.total += added
+
+    def entries(self):
+        """(modification time, size, path) of every entry, oldest first."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            try:
+                entries.append((os.path.getmtime(entry),
+                                __entry_size__(entry), entry))
+            except OSError:
+                continue
+        return sorted(entries)
+
+    def size(self):
+        return sum(x[1] for x in self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries if the cache is larger
+        than `max_bytes`, and the stale temporary entries."""
+        self.sweep()
+        entries = self.entries()
+        total = sum(x[1] for x in entries)
+        if total > self.max_bytes:
+            for _, size, entry in entries:
+                if total <= self.max_bytes * low_water:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+        self.total = total
+
+    def sweep(self):
+        """Remove the temporary entries of puts that never finished."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            part = os.path.join(self.cache_dir, name)
+            try:
+                if name.startswith(".") and os.path.isdir(part) and \
+                        now - os.path.getmtime(part) > stale_seconds:
+                    shutil.rmtree(part, ignore_errors=True)
+            except OSError:
+                continue
+
+    def clear(self):
+        self.sweep()
+        for _, _, entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
+        self.total = 0
+
+
+def __entry_size__(entry):
+    return sum(os.path.getsize(os.path.join(entry, x))
+               for x in os.listdir(entry))
@@ -1,6 +1,9 @@
+import logging
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from statsmodels.robust.scale import mad
+from collections import OrderedDict
 
 
 def __check_quotes__(qdata):
@@ -33,67 +36,196 @@ def check_quotes(quotes):
     return quotes
 
 
-def clean_quotes(quotes,
-                 how=("zero_quotes", "error_quotes",
-                      "outliers", "large_spreads")):
-    [clean_quote_funcs[x](quotes) for x in how]
-    return quotes
+default_quote_rules = ("zero_quotes", "error_quotes", "outliers",
+                       "large_spreads")
 
+default_trade_rules = ("zero_prices",)
 
-def clean_trades(trades, how=tuple(["zero_prices"])):
-    [clean_trade_funcs[x](trades) for x in list(how)]
-    return trades
 
+class CleaningReport(object):
+    """Rows removed by a CleaningPipeline run.
 
-def no_zero_quotes(quotes):
-    __check_quotes__(quotes)
-    original_count = len(quotes.index)
-    quotes = quotes.ix[quotes.apply(__non_zero_quote, axis=1)]
-    final_count = len(quotes.index)
-    print("Removed {} zero quotes".format(original_count - final_count))
-    return quotes
+    `removed` maps every rule to the number of rows it rejected on the
+    original data, so a row failing several rules counts once per rule.
+    """
+    def __init__(self, original_count, final_count, removed):
+        self.original_count = original_count
+        self.final_count = final_count
+        self.removed = removed
 
+    @property
+    def removed_count(self):
+        return self.original_count - self.final_count
 
-def __non_zero_quote(row):
-    return (row.bid != 0 and row.ask != 0 and row.bid_size != 0 and
-            row.ask_size != 0) or (row.bid != 0 and row.bid_size != 0) \
-           or (row.ask != 0 and row.ask_size != 0)
+    def to_dict(self):
+        return {"original_count": self.original_count,
+                "final_count": self.final_count,
+                "removed": dict(self.removed)}
 
+    def __repr__(self):
+        rules = ", ".join("{}: {}".format(rule, count)
+                          for rule, count in self.removed.items())
+        return "Removed {} of {} rows ({})".format(
+            self.removed_count, self.original_count, rules)
 
-def no_zero_prices(trades):
-    original_count = len(trades.index)
-    trades = trades.ix[trades.apply(__non_zero_price, axis=1)]
-    final_count = len(trades.index)
-    print("Removed {} zero priced trades".format(original_count - final_count))
-    return trades
 
+class CleaningPipeline(object):
+    """Applies the cleaning rules named in `how` in a single pass.
 
-def __non_zero_price(row):
-    return not(row.price == 0 or row.volume == 0 or
-               np.isnan(row.price) or np.isnan(row.volume))
+    The forward and back filled view of the data is computed once and
+    shared by every rule that needs it, and the rows are selected once
+    with the combined mask. `options` maps a rule to the keyword arguments
+    of its mask, e.g. {"outliers": {"window": 100}}.
+    """
+    def __init__(self, how, masks, check=None, fill=True, options=None):
+        unknown = [x for x in how if x not in masks]
+        if unknown:
+            raise ValueError('Unknown cleaning rules {}'.format(unknown))
+        self.rules = [(x, masks[x]) for x in how]
+        self.check = check
+        self.fill = fill
+        self.options = options or {}
 
+    @classmethod
+    def for_quotes(cls, how=default_quote_rules, options=None):
+        return cls(how, clean_quote_masks, check=__check_quotes__,
+                   options=options)
 
-def rm_large_spreads(quotes, func=np.median, mult=50):
-    __check_quotes__(quotes)
-    temp = quotes.ffill().bfill()
-    original_count = len(quotes)
+    @classmethod
+    def for_trades(cls, how=default_trade_rules, options=None):
+        return cls(how, clean_trade_masks, check=__check_trades__,
+                   fill=False, options=options)
+
+    def run(self, data):
+        if self.check is not None:
+            self.check(data)
+        filled = data.ffill().bfill() if self.fill and self.rules else None
+        keep = np.ones(len(data.index), dtype=bool)
+        removed = OrderedDict()
+        for rule, mask in self.rules:
+            rule_keep = np.asarray(
+                mask(data, filled=filled, **self.options.get(rule, {})),
+                dtype=bool)
+            removed[rule] = int(len(rule_keep) - np.count_nonzero(rule_keep))
+            keep &= rule_keep
+        cleaned = data.loc[keep]
+        return cleaned, CleaningReport(len(data.index), len(cleaned.index),
+                                       removed)
+
+
+def clean_quotes(quotes, how=default_quote_rules):
+    return CleaningPipeline.for_quotes(how).run(quotes)[0]
+
+
+def clean_trades(trades, how=default_trade_rules):
+    return CleaningPipeline.for_trades(how).run(trades)[0]
+
+
+def __run_rule__(pipeline, data):
+    """Rows of `data` kept by a single rule pipeline. The report is logged
+    instead of returned, so the helpers keep returning only the frame.
+    """
+    cleaned, report = pipeline.run(data)
+    logging.getLogger(__name__).info("{} - {}".format(
+        pipeline.rules[0][0], report))
+    return cleaned
+
+
+def non_zero_quote_mask(quotes, filled=None):
+    bid_side = (quotes.bid.values != 0) & (quotes.bid_size.values != 0)
+    ask_side = (quotes.ask.values != 0) & (quotes.ask_size.values != 0)
+    return bid_side | ask_side
+
+
+def no_zero_quotes(quotes):
+    return __run_rule__(CleaningPipeline.for_quotes(["zero_quotes"]), quotes)
+
+
+def non_zero_price_mask(trades, filled=None):
+    price = trades.price.values
+    volume = trades.volume.values
+    return (price != 0) & (volume != 0) & ~np.isnan(price) & \
+        ~np.isnan(volume)
+
+
+def no_zero_prices(trades):
+    return __run_rule__(CleaningPipeline.for_trades(["zero_prices"]), trades)
+
+
+def spread_mask(quotes, func=np.median, mult=50, filled=None):
+    temp = quotes.ffill().bfill() if filled is None else filled
     spreads = temp.ask - temp.bid
     indicator = func(spreads)
-    to_keep = spreads <= mult*indicator
-    quotes = quotes.ix[to_keep]
-    final_count = len(quotes)
-    print("Removed {} large spread quotes".format(original_count - final_count))
-    return quotes
+    return (spreads <= mult*indicator).values
 
 
-def rm_quote_outliers(quotes, mult=10, window=50, center=np.median,
-                      filter_type='advanced'):
-    __check_quotes__(quotes)
-    original_count = len(quotes.index)
-    cleaned_qd = quotes
-    if original_count > window:
+def rm_large_spreads(quotes, func=np.median, mult=50):
+    return __run_rule__(CleaningPipeline.for_quotes(
+        ["large_spreads"], {"large_spreads": {"func": func, "mult": mult}}),
+        quotes)
+
+
+def __sliding_order_stats__(values, width, kth, chunk_rows=65536):
+    """kth order statistics of every complete window of `width` values.
+
+    Windows are strided views over `values` and are partitioned in chunks
+    of `chunk_rows`, which keeps the temporary copy to
+    chunk_rows * width floats.
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    count = max(len(values) - width + 1, 0)
+    stats = np.empty((count, len(kth)))
+    step = values.strides[0]
+    for start in range(0, count, chunk_rows):
+        rows = min(chunk_rows, count - start)
+        windows = as_strided(values[start:], shape=(rows, width),
+                             strides=(step, step))
+        stats[start:start + rows] = np.partition(windows, kth, axis=1)[:, kth]
+    return stats
+
+
+def rolling_medians(values, window):
+    """Centered, forward and backward rolling medians of `values`.
+
+    For an even `window`, row i gets the median of the `window` values
+    around it excluding itself (centered), of the `window` values after it
+    (forward) and of the `window` values before it (backward). Rows without
+    a complete window are NaN, matching the centered pandas rolling windows
+    of `window + 1` and `2 * window + 1` values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    half = window // 2
+    centered = np.full(n, np.nan)
+    forward = np.full(n, np.nan)
+    backward = np.full(n, np.nan)
+
+    if n > window:
+        # median of 2h values once the center of a 2h + 1 window is removed,
+        # from the window's order statistics h - 1, h and h + 1
+        low, mid, high = __sliding_order_stats__(
+            values, window + 1, [half - 1, half, half + 1]).T
+        center = values[half:n - half]
+        centered[half:n - half] = np.where(
+            center < mid, (mid + high) / 2,
+            np.where(center > mid, (low + mid) / 2, (low + high) / 2))
+
+    if n > 2 * window:
+        low, high = __sliding_order_stats__(
+            values, window, [half - 1, half]).T
+        meds = (low + high) / 2
+        forward[window:n - window] = meds[window + 1:n - window + 1]
+        backward[window:n - window] = meds[:n - 2 * window]
+
+    return centered, forward, backward
+
+
+def outlier_mask(quotes, mult=10, window=50, center=np.median,
+                 filter_type='advanced', filled=None):
+    condition = np.ones(len(quotes.index), dtype=bool)
+    if len(quotes.index) > window:
         window = int(np.floor(window/2) * 2)
-        temp = quotes.ffill().bfill()
+        temp = quotes.ffill().bfill() if filled is None else filled
         mid_quotes = (temp.bid + temp.ask)/2
         mq_mad = mad(mid_quotes, center=center)
         if mq_mad == 0:
@@ -102,64 +234,60 @@ def rm_quote_outliers(quotes, mult=10, window=50, center=np.median,
                 [True], (m[1:len(m)].values - m[0:(len(m)-1)].values) != 0)
             mq_mad = mad(mid_quotes[s])
 
-        def __modified_median__(arr):
-            w = len(arr)
-            return np.median(np.append(arr[0:(w-1)/2], arr[(w/2 + 1):w]))
+        mids = mid_quotes.values
+        meds, forward, backward = rolling_medians(mids, window)
 
         roll_meds = None
-        meds = mid_quotes.rolling(
-            window=window + 1, center=True).apply(__modified_median__)
-
         if filter_type == 'standard':
-            roll_meds = meds.ffill().bfill()
+            roll_meds = pd.Series(meds).ffill().bfill().values
 
         if filter_type == 'advanced':
-            def __forward_median__(arr):
-                w = (len(arr) - 1)/2
-                return np.median(arr[w+1:])
-
-            def __backward_median__(arr):
-                w = (len(arr) - 1)/2
-                return np.median(arr[:w])
-
-            def __closest_to_mid_quote__(qq):
-                qq[np.isnan(qq)] = qq[3]
-                diff = np.abs(qq[0:2] - qq[3])
-                select = np.where(np.min(diff) == diff)
-                value = qq[select]
-                if len(value) > 1:
-                    value = np.median(value)
-                return value
-
-            all_matrix = np.zeros((len(mid_quotes), 4))
-            all_matrix[:, 0] = meds
-            all_matrix[:, 1] = mid_quotes.rolling(
-                window=2*window + 1, center=True).apply(__forward_median__)
-            all_matrix[:, 2] = mid_quotes.rolling(
-                window=2*window + 1, center=True).apply(__backward_median__)
-            all_matrix[:, 3] = mid_quotes
-            roll_meds = np.apply_along_axis(__closest_to_mid_quote__,
-                                            axis=1, arr=all_matrix)
+            # closest of the centered and forward medians to the mid quote,
+            # with missing medians standing in as the mid quote itself
+            meds = np.where(np.isnan(meds), mids, meds)
+            forward = np.where(np.isnan(forward), mids, forward)
+            meds_diff = np.abs(meds - mids)
+            forward_diff = np.abs(forward - mids)
+            roll_meds = np.where(
+                meds_diff < forward_diff, meds,
+                np.where(forward_diff < meds_diff, forward,
+                         (meds + forward) / 2))
 
         max_criterion = roll_meds + mult * mq_mad
         min_criterion = roll_meds - mult * mq_mad
-        min_condition = np.less(min_criterion, mid_quotes.values)
-        max_condition = np.less(mid_quotes.values, max_criterion)
+        min_condition = np.less(min_criterion, mids)
+        max_condition = np.less(mids, max_criterion)
         condition = np.logical_and(min_condition, max_condition)
-        cleaned_qd = quotes.ix[condition]
-        final_count = len(cleaned_qd)
-    print("Removed {} outliers".format(original_count - final_count))
-    return cleaned_qd
+    return condition
+
+
+def rm_quote_outliers(quotes, mult=10, window=50, center=np.median,
+                      filter_type='advanced'):
+    return __run_rule__(CleaningPipeline.for_quotes(
+        ["outliers"], {"outliers": {"mult": mult, "window": window,
+                                    "center": center,
+                                    "filter_type": filter_type}}), quotes)
+
+
+def __first_valid__(values):
+    valid = ~np.isnan(values)
+    return np.argmax(valid) if valid.any() else len(values)
+
+
+def ordered_quote_mask(quotes, filled=None):
+    if filled is None:
+        temp = quotes.ffill()
+        return (temp.bid < temp.ask).values
+    # rows before the first bid or ask are NaN in the forward filled
+    # quotes and never pass
+    condition = np.array(filled.bid < filled.ask, dtype=bool)
+    condition[:max(__first_valid__(quotes.bid.values),
+                   __first_valid__(quotes.ask.values))] = False
+    return condition
 
 
 def rm_erroneous_quotes(quotes):
-    __check_quotes__(quotes)
-    original_count = len(quotes.index)
-    temp = quotes.ffill()
-    quotes = quotes.ix[temp.bid < temp.ask]
-    final_count = len(quotes.index)
-    print("Removed {} erroneous quotes".format(original_count - final_count))
-    return quotes
+    return __run_rule__(CleaningPipeline.for_quotes(["error_quotes"]), quotes)
 
 clean_quote_funcs = {
     "zero_quotes": no_zero_quotes,
@@ -172,3 +300,16 @@ clean_quote_funcs = {
 clean_trade_funcs = {
     "zero_prices": no_zero_prices
 }
+
+
+clean_quote_masks = {
+    "zero_quotes": non_zero_quote_mask,
+    "error_quotes": ordered_quote_mask,
+    "outliers": outlier_mask,
+    "large_spreads": spread_mask
+}
+
+
+clean_trade_masks = {
+    "zero_prices": non_zero_price_mask
+}
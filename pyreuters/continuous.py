@@ -0,0 +1,193 @@
+import logging
+
+import pandas as pd
+import numpy as np
+import tables
+
+from . import hdf5_dir
+from .data import Roll
+from .handles import handle_cache
+from .symbol import Symbol, __read_range__, __projection__, \
+    __quotes_frame__, __trades_frame__, quote_columns, trade_columns
+
+
+def is_outright(contract):
+    """False for calendar spreads (EDH6-M6) and butterflies."""
+    return "-" not in contract and "BF" not in contract
+
+
+def daily_volume(node, chunk_rows=10000000):
+    """Traded volume of a trades table per file date, as a Series.
+
+    Only the file_date and volume columns are read, in chunks.
+    """
+    totals = {}
+    for start in range(0, node.nrows, chunk_rows):
+        file_dates = node.read(start, start + chunk_rows, field="file_date")
+        volume = node.read(start, start + chunk_rows, field="volume")
+        dates, positions = np.unique(file_dates, return_inverse=True)
+        sums = np.bincount(positions, weights=np.where(volume > 0, volume, 0),
+                           minlength=len(dates))
+        for date, total in zip(dates, sums):
+            totals[int(date)] = totals.get(int(date), 0) + total
+    return pd.Series(totals, dtype=np.float64).sort_index()
+
+
+def roll_dates(volumes):
+    """Front contract per file date from a file date x contract frame of
+    daily volumes.
+
+    The front contract of a date is the one that traded most on the
+    previous date, so the schedule only uses information available before
+    the session. Contracts never come back once rolled out of, so a quiet
+    day on the new front does not roll back to the old one.
+    """
+    front = []
+    current = None
+    retired = set()
+    values = volumes.fillna(0)
+    for i, date in enumerate(values.index):
+        if current is None:
+            current = values.loc[date].idxmax()
+        front.append(current)
+        candidates = values.loc[date].drop(list(retired) + [current])
+        if len(candidates) > 0 and \
+                candidates.max() > values.loc[date, current]:
+            retired.add(current)
+            current = candidates.idxmax()
+    return pd.Series(front, index=values.index, name="contract")
+
+
+class ContinuousSymbol(Symbol):
+    """Front month series of a symbol stitched from its contract tables.
+
+    The roll schedule is derived from daily traded volume (the raw files
+    have no open interest) and cached in /rolls/volume of the hdf5 file.
+    The cache is rebuilt when any trades table has changed size since.
+    `contracts` limits the contracts that can be the front month, by
+    default every outright.
+    """
+    def __init__(self, symbol, exchange=None, h5_dir=hdf5_dir,
+                 tz="US/Central", handles=handle_cache, contracts=None,
+                 cache=True):
+        Symbol.__init__(self, symbol, exchange=exchange, h5_dir=h5_dir,
+                        tz=tz, handles=handles)
+        self.contracts = contracts
+        self.cache = cache
+
+    def __candidates__(self, store):
+        names = [x.name for x in store.list_nodes("/trades", "Table")]
+        if self.contracts is not None:
+            return [x for x in names if x in self.contracts]
+        return [x for x in names if is_outright(x)]
+
+    def __signature__(self, store, contracts):
+        return ";".join("{}:{}".format(x, store.get_node("/trades", x).nrows)
+                        for x in contracts)
+
+    def roll_schedule(self, refresh=False):
+        """Front contract per file date (YYYYMMDD int), as a Series.
+
+        The schedule is saved in the hdf5 file when it can be opened to
+        write. When it cannot, e.g. while another process reads or writes
+        it, the schedule is returned all the same and computed again next
+        time.
+        """
+        with self.handles.open(self.hdf5_file) as store:
+            with self.handles.io_lock:
+                contracts = self.__candidates__(store)
+                signature = self.__signature__(store, contracts)
+                if not refresh and store.__contains__("/rolls/volume"):
+                    node = store.get_node("/rolls/volume")
+                    if node.attrs.signature == signature:
+                        records = node.read()
+                        return pd.Series(
+                            [x.decode("utf-8") for x in records["contract"]],
+                            index=records["file_date"].astype(np.int64),
+                            name="contract")
+                volumes = pd.DataFrame(dict(
+                    (x, daily_volume(store.get_node("/trades", x)))
+                    for x in contracts))
+
+        schedule = roll_dates(volumes)
+        if self.cache:
+            try:
+                self.__save_schedule__(schedule, signature)
+            except (IOError, OSError, ValueError,
+                    tables.HDF5ExtError) as err:
+                logging.getLogger(__name__).warning(
+                    "Roll schedule of {} not saved: {}".format(
+                        self.hdf5_file, err))
+        return schedule
+
+    def __save_schedule__(self, schedule, signature):
+        with self.handles.open_for_append(self.hdf5_file) as store:
+            if store.__contains__("/rolls/volume"):
+                store.remove_node("/rolls/volume")
+            node = store.create_table("/rolls", "volume", Roll,
+                                      "Front month by traded volume",
+                                      createparents=True,
+                                      expectedrows=len(schedule))
+            records = np.zeros(len(schedule), dtype=node.dtype)
+            records["file_date"] = schedule.index.values
+            records["contract"] = [x.encode("utf-8") for x in schedule]
+            node.append(records)
+            node.attrs.signature = signature
+
+    def load(self, start_time, end_time, columns=None):
+        """Load the front month quotes and trades between start_time
+        (inclusive) and end_time into quotes[symbol] and trades[symbol].
+
+        Each contract is read only for the file dates it is the front
+        month, and the frames get a contract column.
+        """
+        start_time = pd.Timestamp(start_time, tz=self.tz).value
+        end_time = pd.Timestamp(end_time, tz=self.tz).value
+        schedule = self.roll_schedule()
+
+        # a file may hold ticks a little outside its own UTC day
+        day = 86400 * 10**9
+        days = pd.to_datetime(schedule.index.astype(str),
+                              format="%Y%m%d").values.astype(
+            "datetime64[ns]").astype(np.int64)
+        schedule = schedule[(days - day < end_time) &
+                            (days + 2 * day > start_time)]
+
+        quote_fields = __projection__(columns, quote_columns)
+        trade_fields = __projection__(columns, trade_columns)
+        quotes, trades = [], []
+        logger = logging.getLogger(__name__)
+        with self.handles.open(self.hdf5_file) as store:
+            for contract, dates in schedule.groupby(schedule, sort=False):
+                condition = "(file_date >= {}) & (file_date <= {}) & " \
+                            "(date_time >= {}) & (date_time < {})".format(
+                                dates.index.min(), dates.index.max(),
+                                start_time, end_time)
+                logger.debug("Loading {} for {} to {}".format(
+                    contract, dates.index.min(), dates.index.max()))
+                if quote_fields != []:
+                    with self.handles.io_lock:
+                        records = __read_range__(
+                            store.get_node("/quotes", contract), condition,
+                            quote_fields)
+                    quotes.append(__quotes_frame__(records, self.tz)
+                                  .assign(contract=contract))
+                if trade_fields != []:
+                    with self.handles.io_lock:
+                        records = __read_range__(
+                            store.get_node("/trades", contract), condition,
+                            trade_fields)
+                    trades.append(__trades_frame__(records, self.tz)
+                                  .assign(contract=contract))
+
+        if quotes:
+            self.quotes[self.symbol] = __stitch__(quotes)
+        if trades:
+            self.trades[self.symbol] = __stitch__(trades)
+        return self
+
+
+def __stitch__(frames):
+    data = pd.concat(frames)
+    data["contract"] = data["contract"].astype("category")
+    return data
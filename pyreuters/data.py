@@ -2,31 +2,234 @@ import pandas as pd
 from pandas.tseries.offsets import BDay
 import numpy as np
 import os
+import io
+import gzip
 import datetime
+import queue
+import threading
+from multiprocessing.pool import ThreadPool
 
+from tables import dtype_from_descr
 from tables.description import IsDescription, Float64Col, UInt64Col, UInt32Col, \
-    Int32Col, Int64Col
+    Int32Col, Int64Col, StringCol
 
 from . import reuters_data_dir
 
 
-def read_raw(symbol, date=pd.datetime.today() - BDay(1),
-             path=reuters_data_dir, verbose=False, logger=None):
+tick_columns = ['Date[G]', 'Time[G]', 'Type', 'Price', 'Volume',
+                'Bid Price', 'Bid Size', 'Ask Price', 'Ask Size']
+
+tick_dtypes = {'Date[G]': 'category', 'Time[G]': object, 'Type': 'category',
+               'Price': np.float64, 'Volume': np.float64,
+               'Bid Price': np.float64, 'Bid Size': np.float64,
+               'Ask Price': np.float64, 'Ask Size': np.float64}
+
+# nanoseconds per character of HH:MM:SS.fffffffff, 0 for the separators
+__time_weights__ = np.array(
+    [36000, 3600, 0, 600, 60, 0, 10, 1, 0], dtype=np.int64) * 10**9
+__time_weights__ = np.concatenate(
+    [__time_weights__, 10**np.arange(8, -1, -1, dtype=np.int64)])
+
+__time_digits__ = [0, 1, 3, 4, 6, 7] + list(range(9, 18))
+
+
+def __time_of_day__(times):
+    """Nanoseconds since midnight for HH:MM:SS[.f] strings.
+
+    The strings are parsed as fixed-width bytes with numpy, falling back to
+    pd.to_timedelta for anything that does not fit the layout.
+    """
+    values = np.asarray(times).astype('S18')
+    chars = values.view(np.uint8).reshape(len(values), 18)
+    digits = chars - np.uint8(48)
+    digits[chars == 0] = 0
+    if not (np.all(chars[:, 2] == ord(':')) and
+            np.all(chars[:, 5] == ord(':')) and
+            np.all((chars[:, 8] == ord('.')) | (chars[:, 8] == 0)) and
+            np.all(digits[:, __time_digits__] <= 9)):
+        return pd.to_timedelta(pd.Series(times)).values.astype(
+            'timedelta64[ns]').astype(np.int64)
+    return digits.astype(np.int64).dot(__time_weights__)
+
+
+def tick_times(dates, times):
+    """UTC timestamps as int64 nanoseconds from the Date[G] and Time[G]
+    columns of a raw file.
+
+    Each distinct date is parsed once.
+    """
+    dates = pd.Series(dates).astype('category')
+    days = pd.to_datetime(pd.Series(dates.cat.categories),
+                          format='%d-%b-%Y').values.astype(
+        'datetime64[ns]').astype(np.int64)
+    codes = dates.cat.codes.values
+    nanos = days[codes] + __time_of_day__(times)
+    nanos[codes < 0] = np.datetime64('NaT').astype(np.int64)
+    return nanos
+
+
+raw_quote_columns = ['Bid Price', 'Bid Size', 'Ask Price', 'Ask Size']
+
+quote_columns = ['bid', 'bid_size', 'ask', 'ask_size']
+
+raw_trade_columns = ['Price', 'Volume']
+
+trade_columns = ['price', 'volume']
+
+
+def raw_file(symbol, date, path=reuters_data_dir):
     if isinstance(date, str):
         date = datetime.datetime.strptime(date, '%Y-%m-%d')
-
     path = os.path.expanduser(path)
-
     date_dir = os.path.join(path, date.strftime('%Y%m%d'))
-    to_read = os.path.join(date_dir, date.strftime("%Y.%m.%d") + '.' +
-                           symbol + ".csv.gz")
+    return os.path.join(date_dir, date.strftime("%Y.%m.%d") + '.' +
+                        symbol + ".csv.gz")
+
+
+def __tick_index__(rd):
+    return pd.DatetimeIndex(
+        tick_times(rd['Date[G]'], rd['Time[G]']).astype('datetime64[ns]'),
+        name='date_time')
+
+
+def read_raw(symbol, date=pd.datetime.today() - BDay(1),
+             path=reuters_data_dir, verbose=False, logger=None):
+    to_read = raw_file(symbol, date, path)
     if verbose and logger is not None:
         logger.info("Reading market data file - {}".format(to_read))
     if os.path.exists(to_read):
         rd = pd.read_csv(to_read, compression='gzip')
-        rd['date_time'] = pd.to_datetime(rd['Date[G]'] + " " + rd['Time[G]'],
-                                        format='%d-%b-%Y %H:%M:%S.%f')
-        rd.set_index('date_time', inplace=True)
+        rd.index = __tick_index__(rd)
+        return rd
+    else:
+        return None
+
+
+def __gzip_blocks__(to_read, block_size):
+    """Header line and blocks of whole lines of a gzip csv file.
+
+    The file is closed when the generator is exhausted or closed.
+    """
+    with gzip.open(to_read, 'rb') as stream:
+        header = stream.readline()
+        yield header
+        rest = b''
+        while True:
+            data = stream.read(block_size)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                rest = data
+                continue
+            rest = data[end:]
+            yield data[:end]
+        if rest:
+            yield rest
+
+
+def __parse_block__(args):
+    names, block = args
+    dtypes = dict(tick_dtypes, **{'Date[G]': object, 'Type': object})
+    rd = pd.read_csv(io.BytesIO(block), header=None, names=names,
+                     usecols=tick_columns, dtype=dtypes)
+    rd['date_time'] = tick_times(rd['Date[G]'], rd['Time[G]'])
+    return rd[['date_time'] + tick_columns[2:]]
+
+
+def __read_ticks_threaded__(to_read, threads, block_size):
+    """read_ticks with decompression and parsing overlapped.
+
+    A producer thread decompresses the file into line aligned blocks and
+    hands them to `threads` pool threads to parse; zlib and the pandas C
+    parser release the GIL for most of that work. At most 2 * threads
+    decompressed blocks are waiting at a time. When a block fails to parse
+    the producer is stopped and joined and the file closed before the
+    error is raised.
+    """
+    blocks = __gzip_blocks__(to_read, block_size)
+    names = next(blocks).decode('utf-8').rstrip('\r\n').split(',')
+    pool = ThreadPool(threads)
+    pending = queue.Queue(2 * threads)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for block in blocks:
+                if stop.is_set():
+                    break
+                put(pool.apply_async(__parse_block__, ((names, block),)))
+        except Exception as err:
+            put(err)
+        finally:
+            blocks.close()
+            put(None)
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    frames = []
+    try:
+        while True:
+            result = pending.get()
+            if result is None:
+                break
+            if isinstance(result, Exception):
+                raise result
+            frames.append(result.get())
+    finally:
+        stop.set()
+        producer.join()
+        pool.terminate()
+        pool.join()
+
+    if not frames:
+        frames = [__parse_block__((names, b''))]
+    rd = pd.concat(frames, ignore_index=True)
+    rd.index = pd.DatetimeIndex(rd['date_time'].values.astype(
+        'datetime64[ns]'), name='date_time')
+    rd['Type'] = rd['Type'].astype('category')
+    return rd[tick_columns[2:]]
+
+
+def read_ticks(symbol, date=pd.datetime.today() - BDay(1),
+               path=reuters_data_dir, verbose=False, logger=None, threads=1,
+               block_size=32 << 20, cache=None):
+    """Like read_raw, but reads only the tick_columns with fixed dtypes.
+
+    With `threads` above 1 the file is decompressed in a background thread
+    and parsed in blocks of about `block_size` uncompressed bytes by a
+    thread pool, so one large file can use several cores. With a
+    pyreuters.cache.TickCache as `cache`, a file parsed before is loaded
+    from the cache instead, and a new one is stored in it. This is the
+    reader used by reuters_convert.
+    """
+    to_read = raw_file(symbol, date, path)
+    if verbose and logger is not None:
+        logger.info("Reading market data file - {}".format(to_read))
+    if os.path.exists(to_read):
+        if cache is not None:
+            rd = cache.get(to_read)
+            if rd is not None:
+                return rd
+        if threads > 1:
+            rd = __read_ticks_threaded__(to_read, threads, block_size)
+        else:
+            rd = pd.read_csv(to_read, compression='gzip',
+                             usecols=tick_columns, dtype=tick_dtypes)
+            rd.index = __tick_index__(rd)
+            rd = rd[tick_columns[2:]]
+        if cache is not None:
+            cache.put(to_read, rd)
         return rd
     else:
         return None
@@ -63,8 +266,8 @@ def quotes_data(symbol=None, **kargs):
 
     if tick_data is not None:
         qd = tick_data[tick_data.Type == 'Quote']
-        qd = qd[['Bid Price', 'Bid Size', 'Ask Price', 'Ask Size']]
-        qd.columns = ['bid', 'bid_size', 'ask', 'ask_size']
+        qd = qd[raw_quote_columns]
+        qd.columns = quote_columns
         return qd
     else:
         return None
@@ -101,12 +304,46 @@ def trades_data(symbol=None, **kargs):
 
     if tick_data is not None:
         td = tick_data[tick_data.Type == 'Trade']
-        td = td[['price', 'volume']]
+        td = td[raw_trade_columns]
+        td.columns = trade_columns
         return td
     else:
         return None
 
 
+def split_ticks(symbol=None, date=pd.datetime.today() - BDay(1),
+                path=reuters_data_dir, raw_data=None, verbose=False,
+                logger=None, threads=1, cache=None):
+    """Quotes and trades of one raw file from a single parse.
+
+    The file is read with read_ticks (with `threads` and `cache`) unless
+    `raw_data` is given, rows are grouped by Type in one pass and both frames
+    come back projected and renamed like quotes_data and trades_data.
+    Returns (None, None) when the file does not exist.
+    """
+    tick_data = raw_data
+    if tick_data is None:
+        if symbol is None:
+            return None, None
+        tick_data = read_ticks(symbol=symbol, date=date, path=path,
+                               verbose=verbose, logger=logger,
+                               threads=threads, cache=cache)
+    if tick_data is None:
+        return None, None
+
+    groups = tick_data.groupby('Type', sort=False).indices
+    empty = np.array([], dtype=np.intp)
+    columns = list(tick_data.columns)
+
+    qd = tick_data.iloc[groups.get('Quote', empty),
+                        [columns.index(x) for x in raw_quote_columns]]
+    qd.columns = quote_columns
+    td = tick_data.iloc[groups.get('Trade', empty),
+                        [columns.index(x) for x in raw_trade_columns]]
+    td.columns = trade_columns
+    return qd, td
+
+
 class Quote(IsDescription):
     file_date = UInt32Col(dflt=0)
     date_time = Int64Col()
@@ -121,3 +358,210 @@ class Trade(IsDescription):
     date_time = Int64Col()
     price = Float64Col(dflt=np.NaN)
     volume = Int64Col(dflt=-1)
+
+
+class Bar(IsDescription):
+    file_date = UInt32Col(dflt=0)
+    date_time = Int64Col()
+    open = Float64Col(dflt=np.NaN)
+    high = Float64Col(dflt=np.NaN)
+    low = Float64Col(dflt=np.NaN)
+    close = Float64Col(dflt=np.NaN)
+    volume = Float64Col(dflt=0)
+    vwap = Float64Col(dflt=np.NaN)
+    count = Int64Col(dflt=0)
+    bid = Float64Col(dflt=np.NaN)
+    bid_size = Float64Col(dflt=np.NaN)
+    ask = Float64Col(dflt=np.NaN)
+    ask_size = Float64Col(dflt=np.NaN)
+
+
+class Roll(IsDescription):
+    file_date = UInt32Col(dflt=0)
+    contract = StringCol(64)
+
+
+quote_dtype = dtype_from_descr(Quote)
+
+trade_dtype = dtype_from_descr(Trade)
+
+bar_dtype = dtype_from_descr(Bar)
+
+
+def __nanos__(index):
+    return index.values.astype('datetime64[ns]').astype(np.int64)
+
+
+def __fill_missing__(values, fill=-1):
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isnan(values), fill, values).astype(np.int64)
+
+
+def quote_records(quotes, file_date):
+    """Quotes frame as a structured array matching the Quote table layout.
+
+    Missing sizes are stored as -1 and missing prices as NaN, the same
+    sentinels as the column defaults in Quote.
+    """
+    records = np.empty(len(quotes.index), dtype=quote_dtype)
+    records['file_date'] = file_date
+    records['date_time'] = __nanos__(quotes.index)
+    records['bid'] = quotes['bid'].values
+    records['ask'] = quotes['ask'].values
+    records['bid_size'] = __fill_missing__(quotes['bid_size'].values)
+    records['ask_size'] = __fill_missing__(quotes['ask_size'].values)
+    return records
+
+
+def trade_records(trades, file_date):
+    """Trades frame as a structured array matching the Trade table layout.
+    """
+    records = np.empty(len(trades.index), dtype=trade_dtype)
+    records['file_date'] = file_date
+    records['date_time'] = __nanos__(trades.index)
+    records['price'] = trades['price'].values
+    records['volume'] = __fill_missing__(trades['volume'].values)
+    return records
+
+
+bar_columns = ['open', 'high', 'low', 'close', 'volume', 'vwap', 'count',
+               'bid', 'bid_size', 'ask', 'ask_size']
+
+
+def bar_nanos(freq):
+    """Length in nanoseconds of a bar frequency such as 1s or 1min.
+
+    Bars are aligned on midnight UTC, so the length has to divide a day.
+    """
+    nanos = pd.Timedelta(freq).value
+    if nanos <= 0 or (86400 * 10**9) % nanos != 0:
+        raise ValueError("Bar frequency {} does not divide a day".format(
+            freq))
+    return nanos
+
+
+def __sorted_times__(data):
+    times = __nanos__(data.index)
+    order = np.argsort(times, kind='mergesort')
+    return times[order], order
+
+
+def bar_records(quotes, trades, file_date, freq):
+    """Bars of `freq` for the quotes and trades of one file date, as a
+    structured array matching the Bar table layout.
+
+    There is a bar for every interval with at least one quote or trade,
+    stamped with the start of the interval. open, high, low, close, volume,
+    vwap and count come from the trades in the interval and bid, ask and
+    their sizes are the top of book at its end, each side from the last
+    quote that updated it. The book starts empty on every file date, so
+    bars of different dates never depend on each other and a day can be
+    appended on its own.
+    """
+    nanos = bar_nanos(freq)
+
+    trade_times, order = __sorted_times__(trades)
+    price = trades['price'].values[order]
+    volume = np.nan_to_num(trades['volume'].values[order])
+    traded = ~np.isnan(price)
+    trade_times, price, volume = \
+        trade_times[traded], price[traded], volume[traded]
+    quote_times, quote_order = __sorted_times__(quotes)
+
+    trade_bars = trade_times // nanos * nanos
+    starts = np.union1d(trade_bars, quote_times // nanos * nanos)
+    records = np.zeros(len(starts), dtype=bar_dtype)
+    records['file_date'] = file_date
+    records['date_time'] = starts
+    for name in ('open', 'high', 'low', 'close', 'vwap', 'bid', 'bid_size',
+                 'ask', 'ask_size'):
+        records[name] = np.nan
+
+    if len(trade_bars) > 0:
+        first = np.flatnonzero(np.r_[True, trade_bars[1:] != trade_bars[:-1]])
+        at = np.searchsorted(starts, trade_bars[first])
+        total = np.add.reduceat(volume, first)
+        notional = np.add.reduceat(price * volume, first)
+        records['open'][at] = price[first]
+        records['close'][at] = price[np.r_[first[1:], len(price)] - 1]
+        records['high'][at] = np.maximum.reduceat(price, first)
+        records['low'][at] = np.minimum.reduceat(price, first)
+        records['volume'][at] = total
+        records['count'][at] = np.diff(np.r_[first, len(price)])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            records['vwap'][at] = np.where(total > 0, notional / total,
+                                           np.nan)
+
+    # last quote before the end of each bar
+    latest = np.searchsorted(quote_times, starts + nanos, side='left') - 1
+    for side, size in (('bid', 'bid_size'), ('ask', 'ask_size')):
+        values = quotes[side].values[quote_order]
+        updated = ~np.isnan(values)
+        last = np.where(updated, np.arange(len(updated)), -1)
+        np.maximum.accumulate(last, out=last)
+        # -1 picks the NaN appended below
+        at = np.append(last, -1)[latest]
+        records[side] = np.append(values, np.nan)[at]
+        records[size] = np.append(
+            quotes[size].values[quote_order].astype(np.float64), np.nan)[at]
+    return records
+
+
+indexed_columns = ('date_time', 'file_date')
+
+
+def index_table(table, columns=indexed_columns, force=False):
+    """Create or refresh completely sorted indexes on `columns` of `table`.
+
+    Indexes that are not completely sorted, e.g. the default medium ones
+    of older files or CSI ones that appends with autoindex on have added
+    to, are replaced by CSI ones. Indexes left dirty by appends made with
+    autoindex switched off are rebuilt, as is every index when `force` is
+    set. Automatic index updates are switched back on afterwards.
+    """
+    for name in columns:
+        column = table.colinstances[name]
+        if column.is_indexed and not column.index.is_csi:
+            # reindex keeps the kind of an index, so it is created again
+            column.remove_index()
+        if not column.is_indexed:
+            column.create_csindex()
+        elif force:
+            column.reindex()
+        else:
+            column.reindex_dirty()
+    table.autoindex = True
+    return table
+
+
+def ingested_dates(table):
+    """File dates already stored in `table`, as a set of YYYYMMDD ints.
+
+    The dates are kept in the `file_dates` attribute of the table, next to
+    the number of rows the table had when they were written in
+    `file_dates_nrows`. The append and the attribute update are not atomic,
+    so when the row counts disagree, or the table was written before the
+    attributes existed, the dates are rebuilt from the file_date column and
+    saved unless the file is open read-only. Dates that added no rows are
+    lost in a rebuild, which only means they are parsed again.
+    """
+    names = table.attrs._v_attrnames
+    if 'file_dates' in names and 'file_dates_nrows' in names and \
+            int(table.attrs.file_dates_nrows) == table.nrows:
+        return set(int(x) for x in table.attrs.file_dates)
+    dates = set(int(x) for x in np.unique(table.col('file_date')))
+    if table._v_file.mode != 'r':
+        __save_ingested_dates__(table, dates)
+    return dates
+
+
+def __save_ingested_dates__(table, dates):
+    table.attrs.file_dates = np.array(sorted(dates), dtype=np.uint32)
+    table.attrs.file_dates_nrows = table.nrows
+
+
+def add_ingested_date(table, file_date):
+    dates = ingested_dates(table)
+    dates.add(int(file_date))
+    __save_ingested_dates__(table, dates)
+    return dates
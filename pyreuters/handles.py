@@ -0,0 +1,188 @@
+"""Process wide cache of read-only hdf5 file handles.
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import tables
+
+
+class HandleCache(object):
+    """LRU bounded cache of read-only PyTables file handles.
+
+    Handles are reopened when the file changes on disk and are never shared
+    with a forked child: a child process starts with an empty cache and
+    leaves the handles it inherited to the parent. Handles checked out with
+    `open` are not evicted until they are given back.
+
+    HDF5 locks the files it has open, so while a handle is cached no other
+    process can open that file to write, e.g. reuters_convert, and this
+    process cannot open it to write either, except through
+    `open_for_append`. Handles are closed once they have not been used for
+    `idle_timeout` seconds. With `idle_timeout=None` they stay open until
+    they are evicted or closed.
+
+    The HDF5 library PyTables ships with is not thread safe, so threads
+    reading through the cache hold `io_lock` for the duration of each read.
+    """
+    def __init__(self, max_size=32, idle_timeout=5):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.__reset__()
+
+    def __reset__(self):
+        self.pid = os.getpid()
+        self.lock = threading.RLock()
+        self.io_lock = threading.RLock()
+        self.handles = OrderedDict()
+        self.in_use = {}
+        self.used = {}
+        self.timer = None
+
+    def __check_fork__(self):
+        if self.pid != os.getpid():
+            self.__reset__()
+
+    def __retire__(self, path):
+        # handles still checked out are closed when they are given back
+        handle = self.handles.pop(path)[0]
+        self.used.pop(path, None)
+        if self.in_use.get(handle, 0) == 0:
+            handle.close()
+
+    def __evict__(self):
+        for path in list(self.handles.keys()):
+            if len(self.handles) <= self.max_size:
+                break
+            if self.in_use.get(self.handles[path][0], 0) == 0:
+                self.__retire__(path)
+
+    def __schedule__(self):
+        # called with `lock` held, a single timer closes the idle handles
+        if self.idle_timeout is None or self.timer is not None:
+            return
+        idle = [self.used.get(path, 0) for path, (handle, _) in
+                self.handles.items() if self.in_use.get(handle, 0) == 0]
+        if not idle:
+            return
+        delay = max(min(idle) + self.idle_timeout - time.time(), 0)
+        self.timer = threading.Timer(delay, self.__sweep__)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def __sweep__(self):
+        # the handles are closed with io_lock held, like any other hdf5 call
+        with self.io_lock:
+            with self.lock:
+                if self.pid != os.getpid():
+                    return
+                self.timer = None
+                now = time.time()
+                for path in list(self.handles.keys()):
+                    handle = self.handles[path][0]
+                    if self.in_use.get(handle, 0) == 0 and \
+                            now - self.used.get(path, 0) >= \
+                            self.idle_timeout:
+                        self.__retire__(path)
+                self.__schedule__()
+
+    def get(self, hdf_file):
+        self.__check_fork__()
+        path = os.path.abspath(os.path.expanduser(hdf_file))
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            if path in self.handles:
+                handle, opened_mtime = self.handles[path]
+                if opened_mtime == mtime and handle.isopen:
+                    self.hits += 1
+                    self.handles[path] = self.handles.pop(path)
+                    self.used[path] = time.time()
+                    self.__schedule__()
+                    return handle
+                self.__retire__(path)
+            self.misses += 1
+            handle = tables.open_file(path, mode='r')
+            self.handles[path] = (handle, mtime)
+            self.used[path] = time.time()
+            self.__evict__()
+            self.__schedule__()
+            return handle
+
+    @contextmanager
+    def open(self, hdf_file):
+        self.__check_fork__()
+        with self.lock:
+            handle = self.get(hdf_file)
+            self.in_use[handle] = self.in_use.get(handle, 0) + 1
+        try:
+            yield handle
+        finally:
+            with self.lock:
+                self.in_use[handle] = self.in_use.get(handle, 1) - 1
+                if self.in_use[handle] == 0:
+                    del self.in_use[handle]
+                    cached = [path for path, x in self.handles.items()
+                              if x[0] is handle]
+                    if not cached:
+                        handle.close()
+                    for path in cached:
+                        self.used[path] = time.time()
+                self.__evict__()
+                self.__schedule__()
+
+    @contextmanager
+    def open_for_append(self, hdf_file):
+        """Handle to write to hdf_file, opened once its read-only handle
+        is closed and held with `io_lock` until it is closed again.
+
+        HDF5 cannot open a file for writing while the process still has it
+        open read-only, so this fails when the handle is checked out.
+        """
+        self.__check_fork__()
+        path = os.path.abspath(os.path.expanduser(hdf_file))
+        with self.io_lock:
+            with self.lock:
+                if path in self.handles:
+                    if self.in_use.get(self.handles[path][0], 0) > 0:
+                        raise IOError("{} is being read and cannot be "
+                                      "opened for writing".format(path))
+                    self.__retire__(path)
+            handle = tables.open_file(path, mode='a')
+            try:
+                yield handle
+            finally:
+                handle.close()
+
+    def close(self, hdf_file=None):
+        self.__check_fork__()
+        with self.lock:
+            if hdf_file is None:
+                paths = list(self.handles.keys())
+            else:
+                paths = [os.path.abspath(os.path.expanduser(hdf_file))]
+            for path in paths:
+                if path in self.handles:
+                    self.__retire__(path)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "open": len(self.handles), "max_size": self.max_size,
+                "idle_timeout": self.idle_timeout}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+handle_cache = HandleCache()
+
+atexit.register(handle_cache.close)
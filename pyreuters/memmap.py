@@ -0,0 +1,125 @@
+"""Uncompressed column files of quotes and trades, read with np.memmap.
+
+A store is a directory with one directory per kind and contract:
+
+    <root>/quotes/<contract>/index.json
+    <root>/quotes/<contract>/date_time.bin
+    <root>/quotes/<contract>/bid.bin ...
+
+Every column is a flat native array, date_time as int64 UTC nanoseconds
+and the rest as float64 with NaN for missing values, so the arrays are
+exactly what Symbol returns and can be used without a conversion. Days are
+appended in file date order and index.json lists the rows of each day.
+reuters_export writes a store from an hdf5 file and Symbol reads it with
+storage="memmap".
+"""
+
+import json
+import os
+
+import numpy as np
+
+memmap_columns = {"quotes": ["bid", "bid_size", "ask", "ask_size"],
+                  "trades": ["price", "volume"]}
+
+
+def __kind__(where):
+    return where.strip("/")
+
+
+class MemmapStore(object):
+    def __init__(self, root):
+        self.root = os.path.expanduser(root)
+
+    def path(self, where, contract, column=None):
+        path = os.path.join(self.root, __kind__(where), contract)
+        if column is None:
+            return path
+        return os.path.join(path, column + ".bin")
+
+    def contracts(self, where):
+        path = os.path.join(self.root, __kind__(where))
+        if not os.path.isdir(path):
+            return []
+        return sorted(x for x in os.listdir(path) if os.path.exists(
+            os.path.join(path, x, "index.json")))
+
+    def available(self):
+        return {"Quote": self.contracts("quotes"),
+                "Trade": self.contracts("trades")}
+
+    def index(self, where, contract):
+        to_read = os.path.join(self.path(where, contract), "index.json")
+        if not os.path.exists(to_read):
+            return {"rows": 0, "days": [], "sorted": True}
+        with open(to_read) as index_file:
+            return json.load(index_file)
+
+    def ingested_dates(self, where, contract):
+        return set(x[0] for x in self.index(where, contract)["days"])
+
+    def append(self, where, contract, file_date, data):
+        """Append one file date of `data`, a dict of arrays with date_time
+        and the columns of the kind.
+
+        The column files are written first and the index last, replaced
+        with a rename, so readers only ever see whole days.
+        """
+        kind = __kind__(where)
+        path = self.path(kind, contract)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        index = self.index(kind, contract)
+        rows = index["rows"]
+        date_time = np.ascontiguousarray(data["date_time"], dtype=np.int64)
+        last = np.array(self.__column__(kind, contract, "date_time",
+                                        rows)[-1:])
+        ordered = len(date_time) == 0 or (
+            np.all(date_time[1:] >= date_time[:-1]) and
+            (len(last) == 0 or date_time[0] >= last[0]))
+        for column in ["date_time"] + memmap_columns[kind]:
+            values = date_time if column == "date_time" else \
+                np.ascontiguousarray(data[column], dtype=np.float64)
+            with open(self.path(kind, contract, column), "r+b" if rows
+                      else "wb") as column_file:
+                # anything after the last indexed row is a failed append
+                column_file.seek(rows * values.itemsize)
+                column_file.truncate()
+                column_file.write(values.tobytes())
+        index["days"].append([int(file_date), rows, rows + len(date_time)])
+        index["rows"] = rows + len(date_time)
+        index["sorted"] = index["sorted"] and bool(ordered)
+        to_write = os.path.join(path, "index.json")
+        with open(to_write + ".tmp", "w") as index_file:
+            json.dump(index, index_file)
+        os.rename(to_write + ".tmp", to_write)
+
+    def __column__(self, where, contract, column, rows):
+        if rows == 0:
+            return np.zeros(0, dtype=np.int64 if column == "date_time"
+                            else np.float64)
+        return np.memmap(self.path(where, contract, column),
+                         dtype=np.int64 if column == "date_time"
+                         else np.float64, mode="r", shape=(rows,))
+
+    def read(self, where, contract, start_time, end_time, columns=None):
+        """Rows of `contract` with start_time <= date_time < end_time, as a
+        dict of read-only arrays backed by the files.
+
+        The rows are found with a binary search on date_time and the arrays
+        are slices of the memory maps, so nothing is copied. A contract
+        whose days are not in time order is masked instead, which copies.
+        """
+        kind = __kind__(where)
+        index = self.index(kind, contract)
+        if columns is None:
+            columns = memmap_columns[kind]
+        arrays = dict((x, self.__column__(kind, contract, x, index["rows"]))
+                      for x in ["date_time"] + columns)
+        date_time = arrays["date_time"]
+        if index["sorted"]:
+            selected = slice(np.searchsorted(date_time, start_time, "left"),
+                             np.searchsorted(date_time, end_time, "left"))
+        else:
+            selected = (date_time >= start_time) & (date_time < end_time)
+        return dict((x, arrays[x][selected]) for x in arrays)
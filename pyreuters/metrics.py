@@ -0,0 +1,269 @@
+"""Market microstructure metrics computed on the arrays of loaded data.
+
+The kernels take the int64 UTC nanosecond timestamps and float64 columns
+that the hdf5 tables hold (Symbol frames give them as `index.asi8` and
+`.values`), with NaN for missing values, and never modify their inputs, so
+the read-only arrays of the memmap storage can be passed as they are.
+
+Quotes rows only carry the side that was updated, so quote metrics are
+computed on the prevailing quote, each side carried forward from its last
+update. Kernels that are a sequential scan use Numba when it is installed
+and NumPy otherwise; `engine` picks one explicitly.
+"""
+
+import numpy as np
+import pandas as pd
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def __jit__(function):
+    if numba is None:
+        return None
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+def __ffill_loop__(values):
+    filled = np.empty(len(values), dtype=np.float64)
+    last = np.nan
+    for i in range(len(values)):
+        if not np.isnan(values[i]):
+            last = values[i]
+        filled[i] = last
+    return filled
+
+
+def __tick_signs_loop__(prices):
+    signs = np.zeros(len(prices), dtype=np.int8)
+    last_price = np.nan
+    sign = 0
+    for i in range(len(prices)):
+        price = prices[i]
+        if np.isnan(price):
+            continue
+        if price > last_price:
+            sign = 1
+        elif price < last_price:
+            sign = -1
+        signs[i] = sign
+        last_price = price
+    return signs
+
+
+def __time_weighted_loop__(times, values, end_time):
+    total = 0.0
+    weight = 0.0
+    for i in range(len(times)):
+        stop = times[i + 1] if i + 1 < len(times) else end_time
+        if not np.isnan(values[i]):
+            total += values[i] * (stop - times[i])
+            weight += stop - times[i]
+    return total / weight if weight > 0 else np.nan
+
+
+__kernels__ = {"ffill": __jit__(__ffill_loop__),
+               "tick_signs": __jit__(__tick_signs_loop__),
+               "time_weighted": __jit__(__time_weighted_loop__)}
+
+
+def __use_numba__(engine):
+    if engine is None:
+        return numba is not None
+    if engine == "numba":
+        if numba is None:
+            raise ValueError("engine='numba' needs numba to be installed")
+        return True
+    if engine == "numpy":
+        return False
+    raise ValueError("Unknown engine {}".format(engine))
+
+
+def __floats__(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def prevailing(values, engine=None):
+    """`values` with every NaN replaced by the last value before it."""
+    values = __floats__(values)
+    if __use_numba__(engine):
+        return __kernels__["ffill"](values)
+    last = np.where(np.isnan(values), -1, np.arange(len(values)))
+    np.maximum.accumulate(last, out=last)
+    # -1 picks the NaN appended for the values before the first update
+    return np.append(values, np.nan)[last]
+
+
+def mid_quote(bid, ask):
+    return (__floats__(bid) + __floats__(ask)) / 2
+
+
+def spread(bid, ask):
+    return __floats__(ask) - __floats__(bid)
+
+
+def microprice(bid, bid_size, ask, ask_size):
+    """Mid weighted by the size on the opposite side, which leans towards
+    the side more likely to trade through.
+    """
+    bid_size = __floats__(bid_size)
+    ask_size = __floats__(ask_size)
+    return (__floats__(bid) * ask_size + __floats__(ask) * bid_size) / \
+        (bid_size + ask_size)
+
+
+def imbalance(bid_size, ask_size):
+    """(bid_size - ask_size) / (bid_size + ask_size), between -1 and 1."""
+    bid_size = __floats__(bid_size)
+    ask_size = __floats__(ask_size)
+    return (bid_size - ask_size) / (bid_size + ask_size)
+
+
+def time_weighted_mean(times, values, end_time=None, engine=None):
+    """Mean of `values`, each weighted by the nanoseconds until the next
+    timestamp, the last one until `end_time` (by default it gets no
+    weight). NaN values and their durations are left out.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = __floats__(values)
+    if len(times) == 0:
+        return np.nan
+    end_time = times[-1] if end_time is None else end_time
+    if __use_numba__(engine):
+        return __kernels__["time_weighted"](times, values, np.int64(end_time))
+    durations = np.diff(times, append=np.int64(end_time)).astype(np.float64)
+    valid = ~np.isnan(values)
+    weight = durations[valid].sum()
+    if weight <= 0:
+        return np.nan
+    return np.dot(values[valid], durations[valid]) / weight
+
+
+def asof(times, values, at, tolerance=None):
+    """The last of `values` at or before each of the `at` timestamps, NaN
+    when there is none or it is older than `tolerance` nanoseconds.
+    `times` must be sorted.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    at = np.asarray(at, dtype=np.int64)
+    latest = np.searchsorted(times, at, side="right") - 1
+    if tolerance is not None and len(times):
+        latest[at - times[np.maximum(latest, 0)] > tolerance] = -1
+    return np.append(__floats__(values), np.nan)[latest]
+
+
+def tick_signs(prices, engine=None):
+    """Trade signs by the tick rule: 1 for a trade above the previous
+    price, -1 below, the previous sign for a zero tick and 0 until the
+    first price change. NaN prices are skipped and get 0.
+    """
+    prices = __floats__(prices)
+    if __use_numba__(engine):
+        return __kernels__["tick_signs"](prices)
+    signs = np.zeros(len(prices), dtype=np.int8)
+    valid = np.flatnonzero(~np.isnan(prices))
+    ticks = np.sign(np.diff(prices[valid], prepend=np.nan))
+    ticks[np.isnan(ticks)] = 0
+    last = np.where(ticks != 0, np.arange(len(ticks)), 0)
+    np.maximum.accumulate(last, out=last)
+    signs[valid] = ticks[last]
+    return signs
+
+
+def trade_signs(prices, mids, engine=None):
+    """Trade signs by the Lee and Ready rule: 1 for a trade above the
+    prevailing mid, -1 below, and the tick rule for trades at the mid or
+    without a quote.
+    """
+    prices = __floats__(prices)
+    signs = np.sign(prices - __floats__(mids))
+    signs[np.isnan(signs)] = 0
+    signs = signs.astype(np.int8)
+    at_mid = signs == 0
+    signs[at_mid] = tick_signs(prices, engine)[at_mid]
+    return signs
+
+
+def effective_spread(prices, signs, mids):
+    """2 * sign * (price - mid), the cost of a trade against the mid it
+    was made at. With the mid some time after the trade, this is the
+    realized spread earned by the liquidity provider.
+    """
+    return 2 * signs * (__floats__(prices) - __floats__(mids))
+
+
+def realized_volatility(times, prices, freq="5min"):
+    """Square root of the sum of the squared log returns of the last price
+    of every `freq` interval.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    prices = __floats__(prices)
+    valid = ~np.isnan(prices)
+    times, prices = times[valid], prices[valid]
+    if len(times) < 2:
+        return np.nan
+    buckets = times // pd.Timedelta(freq).value
+    last = np.append(np.flatnonzero(np.diff(buckets)), len(buckets) - 1)
+    return np.sqrt(np.sum(np.diff(np.log(prices[last])) ** 2))
+
+
+def quote_metrics(quotes, engine=None):
+    """Prevailing bid and ask, mid, spread, microprice and imbalance of a
+    quotes frame as returned by Symbol.get_quotes.
+    """
+    bid = prevailing(quotes["bid"].values, engine)
+    ask = prevailing(quotes["ask"].values, engine)
+    bid_size = prevailing(quotes["bid_size"].values, engine)
+    ask_size = prevailing(quotes["ask_size"].values, engine)
+    return pd.DataFrame({"bid": bid, "ask": ask,
+                         "mid": mid_quote(bid, ask),
+                         "spread": spread(bid, ask),
+                         "microprice": microprice(bid, bid_size, ask,
+                                                  ask_size),
+                         "imbalance": imbalance(bid_size, ask_size)},
+                        index=quotes.index,
+                        columns=["bid", "ask", "mid", "spread", "microprice",
+                                 "imbalance"])
+
+
+def time_weighted_spread(quotes, end_time=None, engine=None):
+    """Time weighted mean of the prevailing spread of a quotes frame,
+    until `end_time` (anything pd.Timestamp accepts) or the last quote.
+    """
+    if end_time is not None:
+        end_time = pd.Timestamp(end_time, tz=quotes.index.tz).value
+    return time_weighted_mean(
+        quotes.index.asi8,
+        spread(prevailing(quotes["bid"].values, engine),
+               prevailing(quotes["ask"].values, engine)),
+        end_time, engine)
+
+
+def trade_metrics(trades, quotes, delay="5min", engine=None):
+    """Mid at each trade, Lee and Ready sign, effective spread and the
+    realized spread against the mid `delay` later, for a trades frame and
+    the quotes frame of the same contract.
+    """
+    quote_times = quotes.index.asi8
+    if not quotes.index.is_monotonic_increasing:
+        order = np.argsort(quote_times, kind="mergesort")
+        quotes = quotes.iloc[order]
+        quote_times = quote_times[order]
+    mids = mid_quote(prevailing(quotes["bid"].values, engine),
+                     prevailing(quotes["ask"].values, engine))
+    trade_times = trades.index.asi8
+    prices = trades["price"].values
+    at_trade = asof(quote_times, mids, trade_times)
+    later = asof(quote_times, mids,
+                 trade_times + pd.Timedelta(delay).value)
+    signs = trade_signs(prices, at_trade, engine)
+    return pd.DataFrame({"price": prices, "mid": at_trade, "sign": signs,
+                         "effective_spread": effective_spread(
+                             prices, signs, at_trade),
+                         "realized_spread": effective_spread(
+                             prices, signs, later)},
+                        index=trades.index,
+                        columns=["price", "mid", "sign", "effective_spread",
+                                 "realized_spread"])
@@ -0,0 +1,149 @@
+"""Partitioned Parquet storage for quotes, trades and bars.
+
+A store is a directory with one Parquet file per contract and file date:
+
+    <root>/quotes/<contract>/<YYYYMMDD>.parquet
+    <root>/trades/<contract>/<YYYYMMDD>.parquet
+    <root>/bars/<freq>/<contract>/<YYYYMMDD>.parquet
+
+holding the same columns as the Quote, Trade and Bar hdf5 tables, with
+date_time as a UTC timestamp. reuters_convert writes it with --format
+parquet and Symbol reads it with storage="parquet". Needs pyarrow.
+"""
+
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .data import quote_dtype, trade_dtype, bar_dtype
+
+
+date_time_type = pa.timestamp('ns', tz='UTC')
+
+record_dtypes = {"quotes": quote_dtype, "trades": trade_dtype,
+                 "bars": bar_dtype}
+
+
+def __schema__(dtype):
+    return pa.schema([(name, date_time_type if name == 'date_time' else
+                       pa.from_numpy_dtype(dtype[name]))
+                      for name in dtype.names])
+
+
+schemas = dict((where, __schema__(dtype))
+               for where, dtype in record_dtypes.items())
+
+
+def __kind__(where):
+    return where.strip("/")
+
+
+def __schema_of__(kind):
+    # bars/<freq> share one schema
+    return schemas[kind.split("/")[0]]
+
+
+class ParquetStore(object):
+    def __init__(self, root):
+        self.root = os.path.expanduser(root)
+
+    def path(self, where, contract, file_date=None):
+        path = os.path.join(self.root, __kind__(where), contract)
+        if file_date is None:
+            return path
+        return os.path.join(path, "{}.parquet".format(file_date))
+
+    def contracts(self, where):
+        path = os.path.join(self.root, __kind__(where))
+        if not os.path.isdir(path):
+            return []
+        return sorted(x for x in os.listdir(path)
+                      if os.path.isdir(os.path.join(path, x)))
+
+    def available(self):
+        return {"Quote": self.contracts("quotes"),
+                "Trade": self.contracts("trades")}
+
+    def ingested_dates(self, where, contract):
+        """File dates stored for `contract`, as a set of YYYYMMDD ints.
+        """
+        path = self.path(where, contract)
+        if not os.path.isdir(path):
+            return set()
+        return set(int(x[:-len(".parquet")]) for x in os.listdir(path)
+                   if x.endswith(".parquet"))
+
+    def append(self, where, contract, file_date, records):
+        """Write the quote or trade `records` of one file date.
+
+        The file is written next to its final name and renamed into place,
+        so readers never see a partial file and a rerun replaces it.
+        """
+        kind = __kind__(where)
+        to_write = self.path(kind, contract, file_date)
+        if not os.path.isdir(os.path.dirname(to_write)):
+            os.makedirs(os.path.dirname(to_write))
+        schema = __schema_of__(kind)
+        columns = []
+        for field in schema:
+            values = np.ascontiguousarray(records[field.name])
+            if field.name == 'date_time':
+                values = values.view('datetime64[ns]')
+            columns.append(pa.array(values, type=field.type))
+        table = pa.Table.from_arrays(columns, schema=schema)
+        # dot files are skipped by dataset discovery
+        part_file = os.path.join(os.path.dirname(to_write),
+                                 "." + os.path.basename(to_write))
+        pq.write_table(table, part_file)
+        os.rename(part_file, to_write)
+
+    def __scanner__(self, where, contract, start_time, end_time, columns,
+                    batch_size=None):
+        kind = __kind__(where)
+        dataset = ds.dataset(self.path(kind, contract),
+                             schema=__schema_of__(kind), format="parquet")
+        # compared against the row group statistics, so row groups and
+        # files outside the range are never decoded
+        condition = \
+            (ds.field('date_time') >= pa.scalar(start_time, date_time_type)) \
+            & (ds.field('date_time') < pa.scalar(end_time, date_time_type))
+        fields = None if columns is None else ['date_time'] + columns
+        options = {} if batch_size is None else {"batch_size": batch_size}
+        return dataset.scanner(columns=fields, filter=condition, **options)
+
+    def read(self, where, contract, start_time, end_time, columns=None):
+        """Rows of `contract` with start_time <= date_time < end_time, as a
+        dict of numpy arrays (date_time as int64 nanoseconds).
+
+        `columns` restricts the fields read besides date_time. Columns that
+        come back in one chunk are handed over without a copy.
+        """
+        table = self.__scanner__(where, contract, start_time, end_time,
+                                 columns).to_table()
+        return __arrays__(table)
+
+    def iter_read(self, where, contract, start_time, end_time,
+                  chunk_rows=1000000, columns=None):
+        """Like read, in dicts of at most `chunk_rows` rows, in date order.
+        """
+        scanner = self.__scanner__(where, contract, start_time, end_time,
+                                   columns, batch_size=chunk_rows)
+        for batch in scanner.to_batches():
+            if batch.num_rows > 0:
+                yield __arrays__(pa.Table.from_batches([batch]))
+
+
+def __arrays__(table):
+    arrays = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if column.num_chunks > 1:
+            column = column.combine_chunks()
+        values = column.to_numpy()
+        if name == 'date_time':
+            values = values.view(np.int64)
+        arrays[name] = values
+    return arrays
@@ -0,0 +1,173 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from . import hdf5_dir
+from .symbol import Symbol, __range_condition__, __read_rows__, \
+    __first_position__, __time_index__
+
+replay_dtype = np.dtype([("date_time", np.int64), ("source", np.int32),
+                         ("bid", np.float64), ("bid_size", np.float64),
+                         ("ask", np.float64), ("ask_size", np.float64),
+                         ("price", np.float64), ("volume", np.float64)])
+
+
+def __events__(records, source):
+    """Table records as replay events, with NaN for the -1 placeholders.
+    """
+    events = np.empty(len(records), dtype=replay_dtype)
+    events["date_time"] = records["date_time"]
+    events["source"] = source
+    for name in ("bid", "bid_size", "ask", "ask_size", "price", "volume"):
+        if name not in records.dtype.names:
+            events[name] = np.nan
+        elif records.dtype[name].kind == "i":
+            events[name] = np.where(records[name] == -1, np.nan,
+                                    records[name])
+        else:
+            events[name] = records[name]
+    return events
+
+
+class Replay(object):
+    """Quotes and trades of many contracts merged in date_time order.
+
+    Iterating gives structured arrays of replay_dtype with at most
+    `batch_size` events. `source` indexes `sources`, a list of (symbol,
+    contract, "quotes" or "trades"); fields that do not apply to an event
+    are NaN. Each table is read in chunks of `chunk_rows` rows, so memory
+    is bounded by one chunk per table whatever the length of the range.
+
+    The merge works on blocks rather than events: a heap orders the tables
+    by the last date_time of their current chunk, and every buffered event
+    up to the smallest of those is merged with one stable sort, after
+    which that table reads its next chunk. Events with the same date_time
+    come in `sources` order within a block.
+
+    Tables are read in date_time order whatever the order of their rows,
+    so dates converted out of order are replayed like the others. The
+    range is found with a binary search on the CSI index of date_time kept
+    by reuters_convert, which also gives the rows in time order; a table
+    without one has the coordinates of the range sorted by time instead.
+    """
+    def __init__(self, symbols, start_time, end_time, contracts=None,
+                 kinds=("quotes", "trades"), batch_size=100000,
+                 chunk_rows=100000, exchange=None, h5_dir=hdf5_dir,
+                 tz="US/Central"):
+        self.symbols = [x if isinstance(x, Symbol) else
+                        Symbol(x, exchange=exchange, h5_dir=h5_dir, tz=tz)
+                        for x in symbols]
+        self.start_time = pd.Timestamp(start_time, tz=tz).value
+        self.end_time = pd.Timestamp(end_time, tz=tz).value
+        self.batch_size = batch_size
+        self.chunk_rows = chunk_rows
+        self.sources = []
+        for symbol in self.symbols:
+            existing = Symbol.available(symbol.hdf5_file,
+                                        handles=symbol.handles)
+            for kind, data_type in (("quotes", "Quote"), ("trades", "Trade")):
+                if kind not in kinds:
+                    continue
+                for contract in existing[data_type]:
+                    if contracts is None or contract in contracts:
+                        self.sources.append((symbol, contract, kind))
+
+    def __chunks__(self, source):
+        symbol, contract, kind = self.sources[source]
+        lock = symbol.handles.io_lock
+        with symbol.handles.open(symbol.hdf5_file) as store:
+            node = store.get_node("/" + kind, contract)
+            with lock:
+                index = __time_index__(node)
+                if index is not None:
+                    first = __first_position__(index, self.start_time)
+                    stop = __first_position__(index, self.end_time)
+                else:
+                    # without a CSI index the coordinates of the range are
+                    # put in time order here
+                    coords = node.get_where_list(__range_condition__(
+                        self.start_time, self.end_time))
+                    times = node.read_coordinates(coords, field="date_time")
+                    coords = coords[np.argsort(times, kind="mergesort")]
+                    first, stop = 0, len(coords)
+            for start in range(first, stop, self.chunk_rows):
+                end = min(start + self.chunk_rows, stop)
+                with lock:
+                    records = __read_rows__(
+                        node, index[start:end] if index is not None
+                        else coords[start:end])
+                yield __events__(records, source)
+
+    def __blocks__(self):
+        streams = [self.__chunks__(x) for x in range(len(self.sources))]
+        chunks = [None] * len(streams)
+        # contiguous copies of the chunk times, for the binary searches
+        times = [None] * len(streams)
+        positions = [0] * len(streams)
+        heap = []
+
+        def refill(i):
+            chunks[i] = next(streams[i], None)
+            positions[i] = 0
+            if chunks[i] is not None:
+                times[i] = np.ascontiguousarray(chunks[i]["date_time"])
+                heapq.heappush(heap, (times[i][-1], i))
+
+        for i in range(len(streams)):
+            refill(i)
+        while heap:
+            watermark = heap[0][0]
+            parts = []
+            for i, chunk in enumerate(chunks):
+                if chunk is None:
+                    continue
+                cut = np.searchsorted(times[i], watermark, side="right")
+                if cut > positions[i]:
+                    parts.append(chunk[positions[i]:cut])
+                    positions[i] = cut
+            block = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            if len(parts) > 1:
+                block = block[np.argsort(block["date_time"],
+                                         kind="mergesort")]
+            yield block
+            # the tables whose chunk ends at the watermark are used up
+            while heap and heap[0][0] == watermark:
+                refill(heapq.heappop(heap)[1])
+
+    def __iter__(self):
+        pending = None
+        for block in self.__blocks__():
+            pending = block if pending is None else \
+                np.concatenate([pending, block])
+            while len(pending) >= self.batch_size:
+                yield pending[:self.batch_size]
+                pending = pending[self.batch_size:]
+        if pending is not None and len(pending) > 0:
+            yield pending
+
+    def frames(self):
+        """Like iterating, with each batch as a DataFrame indexed by
+        date_time and with symbol, contract and kind columns.
+        """
+        symbols = np.array([x[0].symbol for x in self.sources] + [""])
+        contracts = np.array([x[1] for x in self.sources] + [""])
+        kinds = np.array([x[2] for x in self.sources] + [""])
+        tz = self.symbols[0].tz if self.symbols else "UTC"
+        for batch in self:
+            data = pd.DataFrame(batch[list(replay_dtype.names[2:])])
+            data.insert(0, "kind", kinds[batch["source"]])
+            data.insert(0, "contract", contracts[batch["source"]])
+            data.insert(0, "symbol", symbols[batch["source"]])
+            data.index = pd.DatetimeIndex(batch["date_time"],
+                                          tz="UTC").tz_convert(tz)
+            yield data
+
+
+def replay(symbols, start_time, end_time, **kwargs):
+    """Replay of `symbols` between start_time (inclusive) and end_time.
+
+    `symbols` are names or Symbol objects and the keyword arguments are
+    those of Replay.
+    """
+    return Replay(symbols, start_time, end_time, **kwargs)
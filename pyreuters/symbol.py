@@ -1,98 +1,369 @@
 import pandas as pd
 import numpy as np
-import tables
 import os
 
 from . import hdf5_dir
+from .handles import handle_cache
+
+
+quote_columns = ["bid", "bid_size", "ask", "ask_size"]
+
+trade_columns = ["price", "volume"]
+
+bar_columns = ["open", "high", "low", "close", "volume", "vwap", "count",
+               "bid", "bid_size", "ask", "ask_size"]
+
+
+def __range_condition__(start_time, end_time):
+    return '(date_time >= {}) & (date_time < {})'.format(start_time,
+                                                         end_time)
+
+
+def __read_range__(node, condition, columns=None):
+    records = node.read_where(condition)
+    if columns is None:
+        return records
+    # rows are stored whole, so they are read once and only the requested
+    # fields are kept
+    return dict((field, records[field]) for field in ["date_time"] + columns)
+
+
+def __read_rows__(node, coords):
+    """Rows of `node` at `coords`, in that order.
+
+    The coordinates of a time range are mostly long runs of consecutive
+    rows, one per file date, which are read as slices. Short runs are read
+    as points.
+    """
+    breaks = np.flatnonzero(np.diff(coords) != 1) + 1
+    if len(coords) < 256 * (len(breaks) + 1):
+        return node.read_coordinates(coords)
+    starts = np.r_[0, breaks]
+    stops = np.r_[breaks, len(coords)]
+    parts = [node.read(coords[a], coords[b - 1] + 1)
+             for a, b in zip(starts, stops)]
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def __first_position__(index, value):
+    """First position of the sorted `index` with a value >= `value`."""
+    low, high = 0, index.nelements
+    while low < high:
+        middle = (low + high) // 2
+        if index.read_sorted(middle, middle + 1)[0] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def __time_index__(node):
+    """The date_time index of `node` when it can be read in sorted order.
+    """
+    column = node.cols.date_time
+    if column.is_indexed and column.index.is_csi and \
+            not column.index.dirty:
+        return column.index
+    return None
+
+
+def __projection__(columns, known):
+    if columns is None:
+        return None
+    return [x for x in known if x in columns]
+
+
+def __missing_as_nan__(values):
+    # sizes and volumes are stored as integers with -1 when missing
+    values = values.astype(np.float64)
+    values[values == -1] = np.nan
+    return values
+
+
+def __quotes_frame__(records, tz):
+    return __columns_frame__(records, quote_columns, tz,
+                             {"bid_size": __missing_as_nan__,
+                              "ask_size": __missing_as_nan__})
+
+
+def __trades_frame__(records, tz):
+    return __columns_frame__(records, trade_columns, tz,
+                             {"volume": __missing_as_nan__})
+
+
+def __columns_frame__(arrays, columns, tz, convert=None):
+    """DataFrame of the `columns` present in `arrays`, a dict of arrays or
+    structured array with date_time, indexed by date_time in `tz`.
+
+    Contiguous arrays, e.g. from the Parquet or memmap stores, are used as
+    they are, without a copy. Fields of hdf5 records are copied once, and
+    `convert` maps a column to a function applied to it before.
+    """
+    convert = convert or {}
+    names = arrays.dtype.names if isinstance(arrays, np.ndarray) else arrays
+    columns = [x for x in columns if x in names]
+    index = pd.DatetimeIndex(arrays["date_time"].view("datetime64[ns]"),
+                             tz="UTC").tz_convert(tz)
+    data = {}
+    for column in columns:
+        if column in convert:
+            data[column] = convert[column](arrays[column])
+        else:
+            data[column] = np.ascontiguousarray(arrays[column])
+    return pd.DataFrame(data, index=index, columns=columns, copy=False)
+
+
+def __bars_frame__(records, tz):
+    return __columns_frame__(records, bar_columns, tz)
+
+
+def __index_nanos__(index):
+    # asi8 is in the unit of the index, which is not always nanoseconds
+    return index.values.astype("datetime64[ns]").view(np.int64)
+
+
+def __asof_join__(quotes, trades, tolerance=None):
+    """Trades with the bid and ask prevailing at each trade.
+
+    Each side is taken from the last quote at or before the trade that
+    updated it, and left missing when that quote is older than `tolerance`
+    nanoseconds. Quotes are sorted once if needed and trades are matched
+    with a single searchsorted on the int64 timestamps.
+    """
+    quote_times = __index_nanos__(quotes.index)
+    if not quotes.index.is_monotonic_increasing:
+        order = np.argsort(quote_times, kind="mergesort")
+        quotes = quotes.iloc[order]
+        quote_times = quote_times[order]
+    trade_times = __index_nanos__(trades.index)
+    latest = np.searchsorted(quote_times, trade_times, side="right") - 1
+
+    data = trades.copy()
+    for price, size in (("bid", "bid_size"), ("ask", "ask_size")):
+        columns = [x for x in (price, size) if x in quotes]
+        if not columns:
+            continue
+        updated = ~np.isnan(quotes[columns[0]].values)
+        last = np.where(updated, np.arange(len(updated)), -1)
+        np.maximum.accumulate(last, out=last)
+        # -1 picks the NaN appended to every column below
+        side = np.append(last, -1)[latest]
+        if tolerance is not None:
+            stale = trade_times - np.append(quote_times, 0)[side] > tolerance
+            side[stale] = -1
+        for column in columns:
+            data[column] = np.append(
+                quotes[column].values.astype(np.float64), np.nan)[side]
+    return data
 
 
 class Symbol(object):
     def __init__(self, symbol, exchange=None, h5_dir=hdf5_dir,
-                 tz="US/Central"):
+                 tz="US/Central", handles=handle_cache, storage="hdf5"):
+        """`storage` is "hdf5" to read <h5_dir>/<exchange>_<symbol>.h5,
+        "parquet" to read the Parquet store of the same name without the .h5
+        extension, as written by reuters_convert --format parquet, or
+        "memmap" to read the column files written by reuters_export in
+        <h5_dir>/memmap.
+        """
         self.symbol = symbol
         self.exchange = exchange
         self.tz = tz
+        self.handles = handles
         filename = "{}.h5".format(symbol) if \
             exchange is None else "{}_{}.h5".format(exchange, symbol)
         self.hdf5_file = os.path.join(os.path.expanduser(h5_dir), filename)
+        self.storage = storage
+        self.parquet = None
+        self.memmap = None
+        if storage == "parquet":
+            from .parquet import ParquetStore
+            self.parquet = ParquetStore(os.path.splitext(self.hdf5_file)[0])
+        elif storage == "memmap":
+            from .memmap import MemmapStore
+            self.memmap = MemmapStore(os.path.join(
+                os.path.expanduser(h5_dir), "memmap",
+                os.path.splitext(filename)[0]))
+        elif storage != "hdf5":
+            raise ValueError("Unknown storage {}".format(storage))
         self.quotes = {}
         self.trades = {}
+        self.lazy_quotes = {}
+        self.lazy_trades = {}
+
+    def load(self, start_time, end_time, contracts=None, columns=None,
+             lazy=False):
+        """Load quotes and trades between start_time (inclusive) and
+        end_time.
 
-    def load(self, start_time, end_time):
+        `contracts` restricts the tables read and `columns` the fields read
+        from them. Quote and trade tables without any of the requested
+        columns are skipped. With `lazy`, nothing is read here and each
+        contract is read on its first get_quotes/get_trades call.
+        """
         start_time = pd.Timestamp(start_time, tz=self.tz).value
         end_time = pd.Timestamp(end_time, tz=self.tz).value
-        store = tables.open_file(self.hdf5_file, mode='r')
-        existing = Symbol.available(self.hdf5_file)
+        if self.parquet is not None:
+            existing = self.parquet.available()
+        elif self.memmap is not None:
+            existing = self.memmap.available()
+        else:
+            existing = Symbol.available(self.hdf5_file, handles=self.handles)
 
         quote_tables = existing["Quote"]
         trade_tables = existing["Trade"]
+        if contracts is not None:
+            quote_tables = [x for x in quote_tables if x in contracts]
+            trade_tables = [x for x in trade_tables if x in contracts]
+
+        quote_fields = __projection__(columns, quote_columns)
+        trade_fields = __projection__(columns, trade_columns)
+        if quote_fields == []:
+            quote_tables = []
+        if trade_fields == []:
+            trade_tables = []
+
+        if lazy:
+            for qt in quote_tables:
+                self.lazy_quotes[qt] = (start_time, end_time, quote_fields)
+            for tt in trade_tables:
+                self.lazy_trades[tt] = (start_time, end_time, trade_fields)
+            return self
 
         for qt in quote_tables:
             print("Loading quotes for {}".format(qt))
-            node = store.get_node("/quotes", qt)
-            data = pd.DataFrame(node.read_where(
-                '(date_time >= {}) & (date_time < {})'.format(start_time,
-                                                              end_time)))
-            data["bid_size"] = data["bid_size"].astype(np.float64)
-            data.loc[data["bid_size"] == -1, "bid_size"] = np.nan
-            data["ask_size"] = data["ask_size"].astype(np.float64)
-            data.loc[data["ask_size"] == -1, "ask_size"] = np.nan
-            data.index = pd.DatetimeIndex(data.date_time.values,
-                                          tz="UTC").tz_convert(self.tz)
-            data = data[["bid", "bid_size", "ask", "ask_size"]]
-
-            self.quotes[qt] = data
+            self.quotes[qt] = self.__fetch__("/quotes", qt, start_time,
+                                             end_time, quote_fields,
+                                             __quotes_frame__)
 
         for tt in trade_tables:
             print("Loading trades for {}".format(tt))
-            node = store.get_node("/trades", tt)
-            data = pd.DataFrame(node.read_where(
-                '(date_time >= {}) & (date_time < {})'.format(start_time,
-                                                              end_time)))
+            self.trades[tt] = self.__fetch__("/trades", tt, start_time,
+                                             end_time, trade_fields,
+                                             __trades_frame__)
+
+        return self
 
-            data["volume"] = data["volume"].astype(np.float64)
-            data.loc[data["volume"] == -1, "volume"] = np.nan
-            data.index = pd.DatetimeIndex(data.date_time.values,
-                                          tz="UTC").tz_convert(self.tz)
-            data = data[["price", "volume"]]
+    def load_contract(self, contract, start_time, end_time, columns=None):
+        start_time = pd.Timestamp(start_time, tz=self.tz).value
+        end_time = pd.Timestamp(end_time, tz=self.tz).value
+        quote_fields = __projection__(columns, quote_columns)
+        trade_fields = __projection__(columns, trade_columns)
 
-            self.trades[tt] = data
+        if quote_fields != []:
+            self.quotes[contract] = self.__fetch__(
+                "/quotes", contract, start_time, end_time, quote_fields,
+                __quotes_frame__)
 
-        store.close()
-        return self
+        if trade_fields != []:
+            self.trades[contract] = self.__fetch__(
+                "/trades", contract, start_time, end_time, trade_fields,
+                __trades_frame__)
 
-    def load_contract(self, contract, start_time, end_time):
-        start_time = pd.Timestamp(start_time, self.tz).value
-        end_time = pd.Timestamp(end_time, self.tz).value
-        store = tables.open_file(self.hdf5_file, mode='r')
+    def __fetch__(self, where, contract, start_time, end_time, fields,
+                  to_frame):
+        if self.parquet is not None:
+            return to_frame(self.parquet.read(where, contract, start_time,
+                                              end_time, fields), self.tz)
+        if self.memmap is not None:
+            return __columns_frame__(
+                self.memmap.read(where, contract, start_time, end_time,
+                                 fields),
+                quote_columns if where == "/quotes" else trade_columns,
+                self.tz)
+        with self.handles.open(self.hdf5_file) as store:
+            with self.handles.io_lock:
+                records = __read_range__(
+                    store.get_node(where, contract),
+                    __range_condition__(start_time, end_time), fields)
+        return to_frame(records, self.tz)
 
-        node = store.get_node("/quotes", contract)
-        data = pd.DataFrame(node.read_where(
-            '(date_time >= {}) & (date_time < {})'.format(start_time,
-                                                          end_time)))
+    def __iter_chunks__(self, where, contract, start_time, end_time,
+                        chunk_rows, to_frame):
+        start_time = pd.Timestamp(start_time, tz=self.tz).value
+        end_time = pd.Timestamp(end_time, tz=self.tz).value
+        if self.parquet is not None:
+            for arrays in self.parquet.iter_read(where, contract, start_time,
+                                                 end_time, chunk_rows):
+                yield to_frame(arrays, self.tz)
+            return
+        if self.memmap is not None:
+            arrays = self.memmap.read(where, contract, start_time, end_time)
+            columns = quote_columns if where == "/quotes" else trade_columns
+            for start in range(0, len(arrays["date_time"]), chunk_rows):
+                yield __columns_frame__(
+                    dict((x, arrays[x][start:start + chunk_rows])
+                         for x in arrays), columns, self.tz)
+            return
+        with self.handles.open(self.hdf5_file) as store:
+            node = store.get_node(where, contract)
+            with self.handles.io_lock:
+                index = __time_index__(node)
+                if index is not None:
+                    # bounds of the range in the sorted date_time index
+                    first = __first_position__(index, start_time)
+                    stop = __first_position__(index, end_time)
+            if index is not None:
+                for start in range(first, stop, chunk_rows):
+                    with self.handles.io_lock:
+                        records = __read_rows__(node, index[
+                            start:min(start + chunk_rows, stop)])
+                    yield to_frame(records, self.tz)
+                return
+            # without one the table is scanned chunk_rows rows at a time
+            # and the matching rows are buffered up to chunk_rows
+            condition = __range_condition__(start_time, end_time)
+            parts, rows = [], 0
+            for start in range(0, node.nrows, chunk_rows):
+                with self.handles.io_lock:
+                    parts.append(node.read_where(condition, start=start,
+                                                 stop=start + chunk_rows))
+                rows += len(parts[-1])
+                if rows >= chunk_rows:
+                    records = np.concatenate(parts)
+                    yield to_frame(records[:chunk_rows], self.tz)
+                    parts, rows = [records[chunk_rows:]], rows - chunk_rows
+            if rows > 0:
+                yield to_frame(np.concatenate(parts), self.tz)
 
-        data["bid_size"] = data["bid_size"].astype(np.float64)
-        data.loc[data["bid_size"] == -1, "bid_size"] = np.nan
-        data["ask_size"] = data["ask_size"].astype(np.float64)
-        data.loc[data["ask_size"] == -1, "ask_size"] = np.nan
-        data.index = pd.DatetimeIndex(data.date_time.values,
-                                      tz="UTC").tz_convert(self.tz)
-        data = data[["bid", "bid_size", "ask", "ask_size"]]
+    def iter_quotes(self, contract, start_time, end_time,
+                    chunk_rows=1000000):
+        """Quotes of `contract` between start_time (inclusive) and end_time
+        as DataFrames of at most `chunk_rows` rows.
 
-        self.quotes[contract] = data
+        The bounds of the range are found with a binary search on the CSI
+        index of date_time kept by reuters_convert, and the rows are read
+        from it a chunk at a time in date_time order. A table without the
+        index is scanned chunk_rows rows at a time and comes in table order.
+        Either way only about one chunk is held in memory, whatever the
+        length of the range. Nothing is stored in `quotes`.
+        """
+        return self.__iter_chunks__("/quotes", contract, start_time,
+                                    end_time, chunk_rows, __quotes_frame__)
 
-        node = store.get_node("/trades", contract)
-        data = pd.DataFrame(node.read_where(
-            '(date_time >= {}) & (date_time < {})'.format(start_time,
-                                                          end_time)))
+    def iter_trades(self, contract, start_time, end_time,
+                    chunk_rows=1000000):
+        """Trades of `contract` in chunks, like iter_quotes.
+        """
+        return self.__iter_chunks__("/trades", contract, start_time,
+                                    end_time, chunk_rows, __trades_frame__)
 
-        data["volume"] = data["volume"].astype(np.float64)
-        data.loc[data["volume"] == -1, "volume"] = np.nan
-        data.index = pd.DatetimeIndex(data.date_time.values,
-                                      tz="UTC").tz_convert(self.tz)
-        data = data[["price", "volume"]]
+    def load_bars(self, contract, freq, start_time, end_time, columns=None):
+        """Bars of `freq` for `contract` starting between start_time
+        (inclusive) and end_time, as stored by reuters_convert --bars.
 
-        self.trades[contract] = data
+        Only intervals with a quote or trade have a bar. `columns`
+        restricts the fields read. reuters_export does not export bars, so
+        they cannot be read with storage="memmap".
+        """
+        if self.memmap is not None:
+            raise ValueError("Bars are not exported to memmap stores, read "
+                             "them with storage=\"hdf5\" or \"parquet\"")
+        start_time = pd.Timestamp(start_time, tz=self.tz).value
+        end_time = pd.Timestamp(end_time, tz=self.tz).value
+        return self.__fetch__("/bars/{}".format(freq), contract, start_time,
+                              end_time, __projection__(columns, bar_columns),
+                              __bars_frame__)
 
     def loaded_contracts(self, data_type="Quote"):
         if data_type is "Quote":
@@ -101,28 +372,67 @@ class Symbol(object):
             return self.trades.keys()
 
     def merge_qt(self, contract=None):
-        contracts = self.quotes.keys()
+        contracts = list(self.quotes.keys()) + list(self.lazy_quotes.keys())
         if contract is not None:
             contracts = [contract]
         for cont in contracts:
-            q = self.quotes[cont]
-            t = self.trades[cont]
+            q = self.get_quotes(cont)
+            t = self.get_trades(cont)
             qt = q.combine_first(t)
             self.quotes[cont] = qt
         return self
 
+    def asof_merge(self, contract=None, tolerance=None):
+        """Trades of `contract` with the prevailing bid, ask and sizes.
+
+        Unlike merge_qt, which forms the union of the quote and trade
+        timestamps, the result keeps the trade index and adds the quote
+        columns as of each trade. A side older than `tolerance` (anything
+        pd.Timedelta accepts) is left missing. A contract without trades
+        gives an empty frame with the trade and quote columns. Without a
+        contract, returns a dict with the merge of every loaded contract
+        that has trades.
+        """
+        if tolerance is not None:
+            tolerance = pd.Timedelta(tolerance).value
+        if contract is None:
+            contracts = list(self.trades.keys()) + \
+                list(self.lazy_trades.keys())
+            return dict((cont, self.asof_merge(cont, tolerance))
+                        for cont in contracts)
+        quotes = self.get_quotes(contract)
+        if quotes is None:
+            quotes = pd.DataFrame(columns=quote_columns, dtype=np.float64,
+                                  index=pd.DatetimeIndex([], tz=self.tz))
+        trades = self.get_trades(contract)
+        if trades is None:
+            trades = pd.DataFrame(columns=trade_columns, dtype=np.float64,
+                                  index=pd.DatetimeIndex([], tz=self.tz))
+        return __asof_join__(quotes, trades, tolerance)
+
     def get_quotes(self, contract):
+        if self.lazy_quotes.__contains__(contract):
+            start_time, end_time, fields = self.lazy_quotes.pop(contract)
+            self.quotes[contract] = self.__fetch__(
+                "/quotes", contract, start_time, end_time, fields,
+                __quotes_frame__)
         if self.quotes.__contains__(contract):
             return self.quotes[contract]
 
     def get_trades(self, contract):
+        if self.lazy_trades.__contains__(contract):
+            start_time, end_time, fields = self.lazy_trades.pop(contract)
+            self.trades[contract] = self.__fetch__(
+                "/trades", contract, start_time, end_time, fields,
+                __trades_frame__)
         if self.trades.__contains__(contract):
             return self.trades[contract]
 
     @staticmethod
-    def available(hdf_file):
-        store = tables.open_file(hdf_file, mode='r')
-        quote_tables = [x.name for x in store.list_nodes("/quotes", "Table")]
-        trade_tables = [x.name for x in store.list_nodes("/trades", "Table")]
-        store.close()
+    def available(hdf_file, handles=handle_cache):
+        with handles.open(hdf_file) as store:
+            quote_tables = [x.name for x in
+                            store.list_nodes("/quotes", "Table")]
+            trade_tables = [x.name for x in
+                            store.list_nodes("/trades", "Table")]
         return {"Quote": quote_tables, "Trade": trade_tables}
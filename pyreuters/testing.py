@@ -0,0 +1,46 @@
+"""Synthetic raw tick files for the tests and the benchmarks.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .data import raw_file
+
+
+def write_raw_file(data_path, ric, date, n, seed=0):
+    """Write a synthetic raw .csv.gz tick file of `ric` for `date` under
+    `data_path`, laid out like the files reuters_download fetches, and
+    return its path.
+    """
+    rs = np.random.RandomState(seed)
+    times = pd.Timestamp(date) + pd.to_timedelta(
+        np.sort(rs.randint(0, 86400 * 10**6, n)), unit="us")
+    kind = rs.choice(["Quote", "Trade", "Correction"], n, p=[.8, .18, .02])
+    price = np.round(98.5 + rs.randn(n).cumsum() * 0.0025, 4)
+    quote = kind == "Quote"
+    trade = kind == "Trade"
+    bid = quote & (rs.rand(n) < .5)
+    ask = quote & ~bid
+    ticks = pd.DataFrame({
+        "#RIC": ric,
+        "Date[G]": times.strftime("%d-%b-%Y").str.upper(),
+        "Time[G]": times.strftime("%H:%M:%S.%f"),
+        "GMT Offset": -5,
+        "Type": kind,
+        "Price": np.where(trade, price, np.nan),
+        "Volume": np.where(trade, rs.randint(1, 50, n), np.nan),
+        "Bid Price": np.where(bid, price - .0025, np.nan),
+        "Bid Size": np.where(bid, rs.randint(1, 500, n), np.nan),
+        "Ask Price": np.where(ask, price + .0025, np.nan),
+        "Ask Size": np.where(ask, rs.randint(1, 500, n), np.nan),
+        "Qualifiers": "[IRGCOND]"},
+        columns=["#RIC", "Date[G]", "Time[G]", "GMT Offset", "Type", "Price",
+                 "Volume", "Bid Price", "Bid Size", "Ask Price", "Ask Size",
+                 "Qualifiers"])
+    to_write = raw_file(ric, pd.Timestamp(date), data_path)
+    if not os.path.isdir(os.path.dirname(to_write)):
+        os.makedirs(os.path.dirname(to_write))
+    ticks.to_csv(to_write, index=False, compression="gzip")
+    return to_write
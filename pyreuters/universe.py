@@ -0,0 +1,111 @@
+import multiprocessing
+import time
+from multiprocessing.pool import ThreadPool
+
+import pandas as pd
+
+from . import hdf5_dir
+from .symbol import Symbol
+
+
+def __load_symbol__(task):
+    """Load one symbol and return its quotes, trades and timing.
+
+    Runs in the pool workers, so it only takes and returns picklable
+    values.
+    """
+    symbol, exchange, h5_dir, tz, storage, start_time, end_time, \
+        contracts, columns = task
+    start = time.time()
+    loaded = Symbol(symbol, exchange=exchange, h5_dir=h5_dir, tz=tz,
+                    storage=storage).load(start_time, end_time,
+                                          contracts=contracts,
+                                          columns=columns)
+    return loaded.quotes, loaded.trades, time.time() - start
+
+
+class Universe(object):
+    """A set of symbols loaded together.
+
+    Symbols are loaded by a pool of `max_workers` threads, or processes
+    with `processes=True`. Threads overlap the Parquet reads and the
+    conversion of the records to DataFrames; hdf5 reads are serialized by
+    the handle cache, so files that are slow to decompress load faster
+    with processes. After load, `symbols` holds a loaded Symbol per symbol
+    and `timings` the seconds and rows each one took.
+    """
+    def __init__(self, symbols, exchange=None, h5_dir=hdf5_dir,
+                 tz="US/Central", storage="hdf5"):
+        self.names = list(symbols)
+        self.exchange = exchange
+        self.h5_dir = h5_dir
+        self.tz = tz
+        self.storage = storage
+        self.symbols = {}
+        self.timings = pd.DataFrame(
+            columns=["seconds", "quotes", "trades"], dtype=float)
+
+    def load(self, start_time, end_time, contracts=None, columns=None,
+             max_workers=4, processes=False):
+        tasks = [(x, self.exchange, self.h5_dir, self.tz, self.storage,
+                  start_time, end_time, contracts, columns)
+                 for x in self.names]
+        if max_workers > 1:
+            pool = multiprocessing.Pool(max_workers) if processes else \
+                ThreadPool(max_workers)
+            try:
+                results = pool.map(__load_symbol__, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [__load_symbol__(x) for x in tasks]
+
+        timings = []
+        for name, (quotes, trades, elapsed) in zip(self.names, results):
+            loaded = Symbol(name, exchange=self.exchange, h5_dir=self.h5_dir,
+                            tz=self.tz, storage=self.storage)
+            loaded.quotes = quotes
+            loaded.trades = trades
+            self.symbols[name] = loaded
+            timings.append((elapsed,
+                            sum(len(x) for x in quotes.values()),
+                            sum(len(x) for x in trades.values())))
+        self.timings = pd.DataFrame(timings, index=self.names,
+                                    columns=["seconds", "quotes", "trades"])
+        return self
+
+    def __frame__(self, data_type):
+        frames = {}
+        for name in self.names:
+            loaded = self.symbols[name]
+            data = loaded.quotes if data_type == "Quote" else loaded.trades
+            for contract, frame in data.items():
+                frames[(name, contract)] = frame
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, names=["symbol", "contract", "date_time"])
+
+    def quotes_frame(self):
+        """Quotes of every loaded contract in one frame indexed by symbol,
+        contract and date_time.
+        """
+        return self.__frame__("Quote")
+
+    def trades_frame(self):
+        """Trades of every loaded contract, indexed like quotes_frame.
+        """
+        return self.__frame__("Trade")
+
+
+def load_many(symbols, start_time, end_time, max_workers=4, processes=False,
+              exchange=None, h5_dir=hdf5_dir, tz="US/Central",
+              storage="hdf5", contracts=None, columns=None):
+    """Load `symbols` between start_time and end_time into a Universe.
+    """
+    return Universe(symbols, exchange=exchange, h5_dir=h5_dir, tz=tz,
+                    storage=storage).load(start_time, end_time,
+                                          contracts=contracts,
+                                          columns=columns,
+                                          max_workers=max_workers,
+                                          processes=processes)
@@ -21,11 +21,18 @@ setup(
         'pysftp',
         'statsmodels'
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+        'numba': ['numba']
+    },
     entry_points={
         'console_scripts':
             ["reuters_download=pyreuters.bin.download:main",
              "reuters_convert=pyreuters.bin.convert:main",
-             "reuters_search=pyreuters.bin.search:main"]
+             "reuters_search=pyreuters.bin.search:main",
+             "reuters_index=pyreuters.bin.index:main",
+             "reuters_repack=pyreuters.bin.repack:main",
+             "reuters_export=pyreuters.bin.export:main"]
     },
     package_data={
         '': ['*.json']
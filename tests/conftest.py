@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from pyreuters.bin.convert import open_store, get_table
+from pyreuters.data import quote_records, trade_records, index_table, \
+    add_ingested_date
+from pyreuters.testing import write_raw_file
+
+
+def synthetic_day(file_date, n, seed=0):
+    """Quotes and trades of one file date, at random times of the day."""
+    rs = np.random.RandomState(seed)
+    day = pd.Timestamp(str(file_date))
+    index = day + pd.to_timedelta(
+        np.sort(rs.randint(0, 86400 * 10**6, n)), unit="us")
+    bid = 98.5 + np.round(rs.randn(n).cumsum() * 0.0025, 4)
+    quotes = pd.DataFrame({"bid": bid, "ask": bid + 0.005,
+                           "bid_size": rs.randint(1, 500, n).astype(float),
+                           "ask_size": rs.randint(1, 500, n).astype(float)},
+                          index=index)
+    quotes.loc[rs.rand(n) < 0.3, ["bid", "bid_size"]] = np.nan
+    quotes.loc[rs.rand(n) < 0.3, ["ask", "ask_size"]] = np.nan
+    picked = np.sort(rs.choice(n, n // 5, replace=False))
+    trades = pd.DataFrame({"price": bid[picked],
+                           "volume": rs.randint(1, 50, len(picked))
+                           .astype(float)},
+                          index=index[picked])
+    return quotes, trades
+
+
+def write_store(hdf_file, contracts, file_dates, n=2000):
+    """Append `file_dates` of every contract to `hdf_file` in the order
+    given, the way reuters_convert does.
+    """
+    store = open_store(hdf_file)
+    written = []
+    for file_date in file_dates:
+        for seed, contract in enumerate(contracts):
+            quotes, trades = synthetic_day(file_date, n,
+                                           seed + 10 * len(written))
+            for where, records in (
+                    ("quotes", quote_records(quotes, file_date)),
+                    ("trades", trade_records(trades, file_date))):
+                table = get_table(store, where, contract)
+                table.autoindex = False
+                table.append(records)
+                table.flush()
+                add_ingested_date(table, file_date)
+                written.append(table)
+    for table in written:
+        index_table(table)
+    store.close()
+
+
+def sorted_rows(arrays):
+    """The rows of a list of equal length arrays in one canonical order."""
+    order = np.lexsort([np.nan_to_num(x, nan=-1.0) for x in arrays[::-1]])
+    return [x[order] for x in arrays]
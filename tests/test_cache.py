@@ -0,0 +1,105 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from pyreuters import cache as cache_module
+from pyreuters.cache import TickCache
+from pyreuters.data import read_ticks, raw_file
+
+from .conftest import write_raw_file
+
+
+@pytest.fixture
+def raw_path(tmpdir):
+    data_path = str(tmpdir.join("raw"))
+    for seed, ric in enumerate(["EDH6", "EDM6", "EDU6"]):
+        write_raw_file(data_path, ric, "2016-01-04", 2000, seed)
+    return data_path
+
+
+def test_cached_frame_equals_read_ticks(tmpdir, raw_path):
+    cache = TickCache(str(tmpdir.join("cache")))
+    expected = read_ticks("EDH6", "2016-01-04", raw_path)
+    stored = read_ticks("EDH6", "2016-01-04", raw_path, cache=cache)
+    assert len(cache.entries()) == 1
+    cached = cache.get(raw_file("EDH6", "2016-01-04", raw_path))
+    for got in [stored, cached,
+                read_ticks("EDH6", "2016-01-04", raw_path, cache=cache)]:
+        pd.testing.assert_frame_equal(got, expected)
+    assert list(cached.dtypes) == list(expected.dtypes)
+
+
+@pytest.mark.parametrize("change", ["mtime", "size"])
+def test_changed_files_are_not_read_from_the_cache(tmpdir, raw_path, change):
+    cache = TickCache(str(tmpdir.join("cache")))
+    to_read = raw_file("EDH6", "2016-01-04", raw_path)
+    read_ticks("EDH6", "2016-01-04", raw_path, cache=cache)
+    assert cache.get(to_read) is not None
+    if change == "mtime":
+        mtime = os.path.getmtime(to_read)
+        os.utime(to_read, (mtime, mtime + 10))
+    else:
+        write_raw_file(raw_path, "EDH6", "2016-01-04", 2500, 7)
+    assert cache.get(to_read) is None
+    expected = read_ticks("EDH6", "2016-01-04", raw_path)
+    pd.testing.assert_frame_equal(
+        read_ticks("EDH6", "2016-01-04", raw_path, cache=cache), expected)
+    assert len(cache.entries()) == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmpdir, raw_path):
+    cache = TickCache(str(tmpdir.join("cache")))
+    files = [raw_file(x, "2016-01-04", raw_path)
+             for x in ["EDH6", "EDM6", "EDU6"]]
+    frames = [read_ticks(x, "2016-01-04", raw_path)
+              for x in ["EDH6", "EDM6", "EDU6"]]
+    cache.put(files[0], frames[0])
+    cache.put(files[1], frames[1])
+    sizes = dict((x[2], x[1]) for x in cache.entries())
+    # room for two entries, and the first one is read after the second
+    cache.max_bytes = int(sum(sizes.values()) * 1.05 / cache_module.low_water)
+    for entry in sizes:
+        os.utime(entry, (time.time() - 60, time.time() - 60))
+    assert cache.get(files[0]) is not None
+    cache.put(files[2], frames[2])
+    assert cache.get(files[1]) is None
+    assert cache.get(files[0]) is not None
+    assert cache.get(files[2]) is not None
+    assert cache.size() <= cache.max_bytes
+    assert cache.total == cache.size()
+
+
+def test_cache_directory_is_walked_only_past_max_bytes(tmpdir, raw_path,
+                                                      monkeypatch):
+    cache = TickCache(str(tmpdir.join("cache")))
+    walks = []
+    entries = TickCache.entries
+    monkeypatch.setattr(TickCache, "entries",
+                        lambda self: walks.append(1) or entries(self))
+    for ric in ["EDH6", "EDM6", "EDU6"]:
+        read_ticks(ric, "2016-01-04", raw_path, cache=cache)
+    # once for the first put of the process
+    assert len(walks) == 1
+    assert cache.total == cache.size()
+
+    cache.max_bytes = cache.total // 2
+    os.utime(raw_file("EDH6", "2016-01-04", raw_path), (0, 0))
+    read_ticks("EDH6", "2016-01-04", raw_path, cache=cache)
+    assert cache.size() <= cache.max_bytes * cache_module.low_water
+
+
+def test_stale_temporary_entries_are_removed(tmpdir, raw_path):
+    cache_dir = str(tmpdir.join("cache"))
+    stale = os.path.join(cache_dir, ".stale")
+    fresh = os.path.join(cache_dir, ".fresh")
+    for part in [stale, fresh]:
+        os.makedirs(part)
+        with open(os.path.join(part, "date_time.npy"), "w") as npy:
+            npy.write("x")
+    old = time.time() - 2 * cache_module.stale_seconds
+    os.utime(stale, (old, old))
+    read_ticks("EDH6", "2016-01-04", raw_path, cache=TickCache(cache_dir))
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
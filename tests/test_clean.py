@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+from statsmodels.robust.scale import mad
+
+from pyreuters import clean
+
+
+def reference_rolling_medians(values, window):
+    """The rolling().apply medians rm_quote_outliers used to compute."""
+    series = pd.Series(values)
+
+    def modified_median(arr):
+        w = len(arr)
+        return np.median(np.append(arr[0:(w - 1) // 2], arr[w // 2 + 1:w]))
+
+    def forward_median(arr):
+        return np.median(arr[(len(arr) - 1) // 2 + 1:])
+
+    def backward_median(arr):
+        return np.median(arr[:(len(arr) - 1) // 2])
+
+    wide = series.rolling(window=2 * window + 1, center=True)
+    return (series.rolling(window=window + 1, center=True)
+            .apply(modified_median, raw=True).values,
+            wide.apply(forward_median, raw=True).values,
+            wide.apply(backward_median, raw=True).values)
+
+
+def reference_outlier_mask(quotes, mult=10, window=50, center=np.median,
+                           filter_type="advanced"):
+    """rm_quote_outliers before its medians were vectorized."""
+    if len(quotes.index) <= window:
+        return np.ones(len(quotes.index), dtype=bool)
+    window = int(np.floor(window / 2) * 2)
+    temp = quotes.ffill().bfill()
+    mid_quotes = (temp.bid + temp.ask) / 2
+    mq_mad = mad(mid_quotes, center=center)
+    if mq_mad == 0:
+        m = mid_quotes
+        s = np.append(
+            [True], (m[1:len(m)].values - m[0:(len(m) - 1)].values) != 0)
+        mq_mad = mad(mid_quotes[s])
+    meds, forward, _ = reference_rolling_medians(mid_quotes.values, window)
+
+    if filter_type == "standard":
+        roll_meds = pd.Series(meds).ffill().bfill().values
+    else:
+        def closest_to_mid_quote(qq):
+            qq[np.isnan(qq)] = qq[2]
+            diff = np.abs(qq[0:2] - qq[2])
+            return np.median(qq[np.where(np.min(diff) == diff)])
+
+        roll_meds = np.apply_along_axis(
+            closest_to_mid_quote, axis=1,
+            arr=np.column_stack([meds, forward, mid_quotes.values]))
+
+    return np.logical_and(roll_meds - mult * mq_mad < mid_quotes.values,
+                          mid_quotes.values < roll_meds + mult * mq_mad)
+
+
+def synthetic_quotes(n, seed=0, tick=0.0025):
+    """Quotes on a price grid, so windows are full of ties."""
+    rs = np.random.RandomState(seed)
+    bid = 98.5 + tick * rs.randint(-3, 4, n).cumsum()
+    spikes = rs.rand(n) < 0.01
+    bid[spikes] += rs.choice([-5, 5], spikes.sum())
+    quotes = pd.DataFrame({"bid": bid, "ask": bid + tick,
+                           "bid_size": rs.randint(1, 500, n).astype(float),
+                           "ask_size": rs.randint(1, 500, n).astype(float)},
+                          index=pd.date_range("2016-01-04", periods=n,
+                                              freq="s"))
+    quotes.loc[rs.rand(n) < 0.3, ["bid", "bid_size"]] = np.nan
+    quotes.loc[rs.rand(n) < 0.3, ["ask", "ask_size"]] = np.nan
+    return quotes
+
+
+@pytest.mark.parametrize("n", [0, 1, 10, 11, 20, 21, 31, 500])
+@pytest.mark.parametrize("window", [2, 4, 10])
+def test_rolling_medians_match_rolling_apply(n, window):
+    rs = np.random.RandomState(n)
+    values = np.round(rs.randn(n).cumsum(), 1)
+    expected = reference_rolling_medians(values, window)
+    got = clean.rolling_medians(values, window)
+    for e, g in zip(expected, got):
+        np.testing.assert_array_equal(g, e)
+
+
+def test_sliding_order_stats_across_chunks():
+    values = np.random.RandomState(3).randint(0, 20, 1000).astype(float)
+    stats = clean.__sliding_order_stats__(values, 7, [2, 3], chunk_rows=64)
+    windows = np.array([np.sort(values[i:i + 7]) for i in range(994)])
+    np.testing.assert_array_equal(stats, windows[:, [2, 3]])
+
+
+@pytest.mark.parametrize("filter_type", ["standard", "advanced"])
+@pytest.mark.parametrize("n,window", [(30, 50), (50, 50), (51, 50),
+                                      (80, 50), (2000, 50), (2000, 21)])
+def test_outlier_mask_matches_reference(filter_type, n, window):
+    quotes = synthetic_quotes(n, seed=n)
+    expected = reference_outlier_mask(quotes, window=window,
+                                      filter_type=filter_type)
+    got = clean.outlier_mask(quotes, window=window, filter_type=filter_type)
+    np.testing.assert_array_equal(got, expected)
+
+
+@pytest.mark.parametrize("filter_type", ["standard", "advanced"])
+def test_outlier_mask_zero_mad_fallback(filter_type):
+    # the mid quote rarely moves, so its MAD is 0 and the MAD of the
+    # changes is used instead
+    quotes = synthetic_quotes(1000, seed=5)
+    quotes["bid"] = 98.5
+    quotes["ask"] = 98.505
+    quotes.iloc[::97, 0] = 98.4975
+    quotes.iloc[500, 0] = 90.0
+    temp = quotes.ffill().bfill()
+    assert mad((temp.bid + temp.ask) / 2) == 0
+    expected = reference_outlier_mask(quotes, filter_type=filter_type)
+    got = clean.outlier_mask(quotes, filter_type=filter_type)
+    np.testing.assert_array_equal(got, expected)
+    assert not got[500]
+
+
+@pytest.mark.parametrize("helper,rule,options", [
+    (clean.no_zero_quotes, "zero_quotes", {}),
+    (clean.rm_erroneous_quotes, "error_quotes", {}),
+    (clean.rm_large_spreads, "large_spreads", {"mult": 2}),
+    (clean.rm_quote_outliers, "outliers", {"window": 20,
+                                           "filter_type": "standard"})])
+def test_quote_helpers_run_the_pipeline(helper, rule, options, capsys):
+    quotes = synthetic_quotes(2000, seed=1)
+    quotes.iloc[::50] = 0
+    quotes.iloc[7::40, 1] = quotes.iloc[7::40, 0] - 0.01
+    cleaned, report = clean.CleaningPipeline.for_quotes(
+        [rule], {rule: options}).run(quotes)
+    assert report.removed[rule] > 0
+    assert helper(quotes, **options).equals(cleaned)
+    assert capsys.readouterr().out == ""
+
+
+def test_trade_helper_runs_the_pipeline(capsys):
+    trades = pd.DataFrame({"price": [98.5, 0, np.nan, 98.51],
+                           "volume": [1., 2., 3., 0.]})
+    assert clean.no_zero_prices(trades).equals(trades.iloc[:1])
+    assert capsys.readouterr().out == ""
+
+
+def test_pipeline_options_reach_the_masks():
+    quotes = synthetic_quotes(2000, seed=2)
+    for options in [{"window": 20}, {"mult": 3, "filter_type": "standard"}]:
+        _, report = clean.CleaningPipeline.for_quotes(
+            ["outliers"], {"outliers": options}).run(quotes)
+        filled = quotes.ffill().bfill()
+        expected = clean.outlier_mask(quotes, filled=filled, **options)
+        assert report.removed["outliers"] == (~expected).sum()
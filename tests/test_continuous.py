@@ -0,0 +1,76 @@
+import logging
+import subprocess
+import sys
+
+import pytest
+
+from pyreuters.continuous import ContinuousSymbol
+from pyreuters.handles import HandleCache
+
+from .conftest import write_store
+
+
+@pytest.fixture
+def h5_dir(tmpdir):
+    write_store(str(tmpdir.join("ED.h5")), ["EDH6", "EDM6"],
+                [20160104, 20160105, 20160106])
+    return str(tmpdir)
+
+
+def test_roll_schedule_is_saved_through_the_handle_cache(h5_dir, capsys):
+    handles = HandleCache()
+    symbol = ContinuousSymbol("ED", h5_dir=h5_dir, handles=handles)
+    # a cached read-only handle is open before the schedule is written
+    with handles.open(symbol.hdf5_file) as store:
+        assert not store.__contains__("/rolls/volume")
+    schedule = symbol.roll_schedule()
+    assert list(schedule.index) == [20160104, 20160105, 20160106]
+
+    misses = handles.stats()["misses"]
+    assert symbol.roll_schedule().equals(schedule)
+    with handles.open(symbol.hdf5_file) as store:
+        assert store.__contains__("/rolls/volume")
+    assert handles.stats()["misses"] == misses + 1
+
+    symbol.load("2016-01-04", "2016-01-07")
+    assert len(symbol.quotes["ED"]) > 0
+    assert set(symbol.trades["ED"]["contract"]) <= {"EDH6", "EDM6"}
+    assert capsys.readouterr().out == ""
+    handles.close()
+
+
+def test_schedule_is_returned_when_it_cannot_be_saved(h5_dir, caplog):
+    handles = HandleCache()
+    symbol = ContinuousSymbol("ED", h5_dir=h5_dir, handles=handles)
+    with handles.open(symbol.hdf5_file):
+        with caplog.at_level(logging.WARNING):
+            schedule = symbol.roll_schedule()
+    assert len(schedule) == 3
+    assert any("not saved" in x.getMessage() for x in caplog.records)
+    with handles.open(symbol.hdf5_file) as store:
+        assert not store.__contains__("/rolls/volume")
+
+    assert symbol.roll_schedule().equals(schedule)
+    with handles.open(symbol.hdf5_file) as store:
+        assert store.__contains__("/rolls/volume")
+    handles.close()
+
+
+def test_schedule_of_a_file_held_by_another_process(h5_dir):
+    symbol = ContinuousSymbol("ED", h5_dir=h5_dir, handles=HandleCache())
+    # the other process keeps the file open, and locked, until its stdin
+    # is closed
+    reader = subprocess.Popen(
+        [sys.executable, "-c", "import sys, tables; "
+         "h = tables.open_file(sys.argv[1]); print('open', flush=True); "
+         "sys.stdin.read()", symbol.hdf5_file],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        assert reader.stdout.readline().strip() == b"open"
+        schedule = symbol.roll_schedule()
+        loaded = symbol.load("2016-01-04", "2016-01-07")
+    finally:
+        reader.communicate()
+    assert list(schedule.index) == [20160104, 20160105, 20160106]
+    assert len(loaded.quotes["ED"]) > 0
+    symbol.handles.close()
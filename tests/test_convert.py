@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import sys
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import pandas as pd
+import pytest
+import tables
+
+from pyreuters.bin import convert
+from pyreuters.handles import HandleCache
+from pyreuters.symbol import Symbol
+
+from .conftest import write_raw_file
+
+
+def run_convert(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["reuters_convert", "-i", "ED",
+                                      "--no-cache"] + list(args))
+    convert.main()
+
+
+def journal_of(dest_path):
+    with open(os.path.join(dest_path, ".reuters_convert.json")) as data_file:
+        return json.load(data_file)
+
+
+@pytest.fixture
+def raw_path(tmpdir):
+    data_path = str(tmpdir.join("raw"))
+    for seed, ric in enumerate(["EDH6", "EDM6"]):
+        write_raw_file(data_path, ric, "2016-01-04", 3000, seed)
+    return data_path
+
+
+def test_incremental_detects_file_replaced(tmpdir, raw_path, monkeypatch,
+                                           caplog):
+    dest_path = str(tmpdir.join("h5"))
+    os.makedirs(dest_path)
+    run_convert(monkeypatch, "-r", raw_path, "-d", dest_path, "--incremental")
+
+    # replaced with a rename, as reuters_download does, which changes the
+    # mtime of the directory
+    replaced = write_raw_file(str(tmpdir.join("new")), "EDH6", "2016-01-04",
+                              4000, 7)
+    date_dir = os.path.join(raw_path, "20160104")
+    os.rename(replaced, os.path.join(date_dir, os.path.basename(replaced)))
+    dir_mtime = os.path.getmtime(date_dir)
+    os.utime(date_dir, (dir_mtime, dir_mtime + 10))
+
+    with caplog.at_level(logging.WARNING):
+        run_convert(monkeypatch, "-r", raw_path, "-d", dest_path,
+                    "--incremental")
+    assert any("20160104/2016.01.04.EDH6.csv.gz changed" in x.getMessage()
+               for x in caplog.records)
+    files = list(journal_of(dest_path)["files"].values())[0]
+    stat = os.stat(os.path.join(date_dir, os.path.basename(replaced)))
+    assert files["20160104"]["2016.01.04.EDH6.csv.gz"] == [stat.st_size,
+                                                          stat.st_mtime]
+
+
+def test_incremental_skips_unchanged_directories(tmpdir, raw_path,
+                                                 monkeypatch):
+    dest_path = str(tmpdir.join("h5"))
+    os.makedirs(dest_path)
+    run_convert(monkeypatch, "-r", raw_path, "-d", dest_path, "--incremental")
+    write_raw_file(raw_path, "EDH6", "2016-01-05", 3000, 3)
+
+    stats, listed = [], []
+    stat, listdir = os.stat, os.listdir
+
+    def recorded_stat(path, *args, **kwargs):
+        stats.append(str(path))
+        return stat(path, *args, **kwargs)
+
+    def recorded_listdir(path="."):
+        listed.append(str(path))
+        return listdir(path)
+    monkeypatch.setattr(os, "stat", recorded_stat)
+    monkeypatch.setattr(os, "listdir", recorded_listdir)
+    run_convert(monkeypatch, "-r", raw_path, "-d", dest_path,
+                "--incremental")
+    monkeypatch.undo()
+
+    # the new file is also stat-ed when it is read
+    raw = set(x for x in stats if x.endswith(".csv.gz"))
+    assert raw == set([os.path.join(raw_path, "20160105",
+                                    "2016.01.05.EDH6.csv.gz")])
+    assert os.path.join(raw_path, "20160104") not in listed
+    files = list(journal_of(dest_path)["files"].values())[0]
+    assert sorted(files) == ["20160104", "20160105"]
+    assert sorted(files["20160104"]) == ["2016.01.04.EDH6.csv.gz",
+                                         "2016.01.04.EDM6.csv.gz"]
+
+
+def test_load_journal_nests_flat_keys(tmpdir):
+    journal_file = str(tmpdir.join(".reuters_convert.json"))
+    with open(journal_file, "w") as data_file:
+        json.dump({"files": {"scope": {"20160104/a.csv.gz": [1, 2.0],
+                                       "20160104/b.csv.gz": [3, 4.0],
+                                       "20160105/a.csv.gz": [5, 6.0]}},
+                   "dirs": {"scope|ED": {"20160104": 7.0}}}, data_file)
+    journal = convert.load_journal(journal_file)
+    assert journal["files"] == {"scope": {
+        "20160104": {"a.csv.gz": [1, 2.0], "b.csv.gz": [3, 4.0]},
+        "20160105": {"a.csv.gz": [5, 6.0]}}}
+    assert journal["dirs"] == {"scope|ED": {"20160104": 7.0}}
+
+
+def test_incremental_journal_is_keyed_on_absolute_paths(tmpdir, raw_path,
+                                                        monkeypatch):
+    dest_path = str(tmpdir.join("h5"))
+    os.makedirs(dest_path)
+    monkeypatch.chdir(str(tmpdir))
+    run_convert(monkeypatch, "-r", raw_path, "-d", "h5", "--incremental")
+    run_convert(monkeypatch, "-r", raw_path, "-d", "./h5/", "--incremental")
+    run_convert(monkeypatch, "-r", raw_path, "-d", dest_path,
+                "--incremental")
+    journal = journal_of(dest_path)
+    assert list(journal["files"]) == ["{}|quotes,trades".format(
+        os.path.join(dest_path, "GE.h5"))]
+    assert len(journal["dirs"]) == 1
+
+
+class CountingPool(ThreadPool):
+    """Records how many jobs were submitted and not handed back yet."""
+
+    def __init__(self, processes):
+        ThreadPool.__init__(self, processes)
+        self.submitted = 0
+
+    def apply_async(self, func, args=()):
+        self.submitted += 1
+        return ThreadPool.apply_async(self, func, args)
+
+
+def test_imap_bounded_limits_pending_jobs():
+    pool = CountingPool(2)
+    try:
+        results = []
+        for result in convert.imap_bounded(pool, abs, range(0, -50, -1), 4):
+            assert pool.submitted - len(results) <= 4
+            results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+    assert results == list(range(50))
+
+
+def test_parallel_convert_matches_serial(tmpdir, monkeypatch):
+    raw_path = str(tmpdir.join("raw"))
+    for day in ["2016-01-04", "2016-01-05", "2016-01-06"]:
+        for seed, ric in enumerate(["EDH6", "EDM6"]):
+            write_raw_file(raw_path, ric, day, 2000, seed)
+    stores = []
+    for workers in ["1", "2"]:
+        dest_path = str(tmpdir.join("h5_" + workers))
+        os.makedirs(dest_path)
+        run_convert(monkeypatch, "-r", raw_path, "-d", dest_path, "-c",
+                    "-b", "1min", "-w", workers)
+        stores.append(tables.open_file(os.path.join(dest_path, "GE.h5")))
+    try:
+        serial, parallel = stores
+        nodes = [x._v_pathname for x in serial.walk_nodes("/", "Table")]
+        assert len(nodes) == 6
+        assert nodes == [x._v_pathname for x in
+                         parallel.walk_nodes("/", "Table")]
+        for node in nodes:
+            expected = serial.get_node(node)
+            got = parallel.get_node(node)
+            assert got.nrows == expected.nrows > 0
+            assert got.read().tobytes() == expected.read().tobytes()
+            assert got.attrs.file_dates.tolist() == \
+                expected.attrs.file_dates.tolist()
+    finally:
+        for store in stores:
+            store.close()
+
+
+def test_convert_after_an_interrupted_run(tmpdir, raw_path, monkeypatch):
+    dest_path = str(tmpdir.join("h5"))
+    os.makedirs(dest_path)
+
+    def interrupted(table, file_date):
+        # the process dies, which closes the file
+        table._v_file.close()
+        raise KeyboardInterrupt()
+    # stopped after the first rows are flushed, before their date is saved
+    monkeypatch.setattr(convert, "add_ingested_date", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run_convert(monkeypatch, "-r", raw_path, "-d", dest_path)
+    monkeypatch.undo()
+
+    run_convert(monkeypatch, "-r", raw_path, "-d", dest_path)
+    with tables.open_file(os.path.join(dest_path, "GE.h5")) as store:
+        tables_written = list(store.walk_nodes("/", "Table"))
+        assert len(tables_written) == 4
+        for table in tables_written:
+            assert table.attrs.file_dates.tolist() == [20160104]
+            assert table.attrs.file_dates_nrows == table.nrows
+            # no file date was appended twice
+            rows = table.read()
+            assert len(np.unique(rows, axis=0)) == len(rows) > 0
+
+
+def index_calls(monkeypatch):
+    calls = []
+    for name in ["create_csindex", "reindex", "reindex_dirty",
+                 "remove_index"]:
+        def spy(self, *args, **kwargs):
+            calls.append((spy.name, self.name))
+            return spy.method(self, *args, **kwargs)
+        spy.name = name
+        spy.method = getattr(tables.Column, name)
+        monkeypatch.setattr(tables.Column, name, spy)
+    return calls
+
+
+def table_indexes(dest_path):
+    with tables.open_file(os.path.join(dest_path, "GE.h5")) as store:
+        return dict((x._v_pathname, (
+            x.nrows, [(x.colinstances[c].index.nelements,
+                       x.colinstances[c].index.dirty,
+                       x.colinstances[c].index.is_csi)
+                      for c in ("date_time", "file_date")]))
+            for x in store.walk_nodes("/", "Table"))
+
+
+def assert_index_order(dest_path):
+    # an index still reported completely sorted after incremental updates
+    # gives the rows in time order
+    with tables.open_file(os.path.join(dest_path, "GE.h5")) as store:
+        for table in store.walk_nodes("/", "Table"):
+            index = table.cols.date_time.index
+            if index.is_csi:
+                times = table.read_coordinates(index[:], field="date_time")
+                assert (np.diff(times) >= 0).all()
+
+
+def test_small_appends_update_the_indexes_in_place(tmpdir, raw_path,
+                                                   monkeypatch):
+    dest_path = str(tmpdir.join("h5"))
+    os.makedirs(dest_path)
+    run_convert(monkeypatch, "-r", raw_path, "-d", dest_path)
+    for nrows, indexes in table_indexes(dest_path).values():
+        assert indexes == [(nrows, False, True)] * 2
+
+    # a few rows added to tables of thousands, one of the days before the
+    # rows already there
+    for seed, ric in enumerate(["EDH6", "EDM6"]):
+        write_raw_file(raw_path, ric, "2016-01-05", 100, seed + 2)
+        write_raw_file(raw_path, ric, "2016-01-03", 100, seed + 4)
+    calls = index_calls(monkeypatch)
+    run_convert(monkeypatch, "-r", raw_path, "-d", dest_path)
+    monkeypatch.undo()
+    assert calls == []
+    indexes = table_indexes(dest_path)
+    for nrows, columns in indexes.values():
+        assert [x[:2] for x in columns] == [(nrows, False)] * 2
+    assert_index_order(dest_path)
+
+    # range queries use the updated indexes
+    symbol = Symbol("GE", h5_dir=dest_path, tz="UTC", handles=HandleCache())
+    symbol.load("2016-01-05", "2016-01-06")
+    with tables.open_file(os.path.join(dest_path, "GE.h5")) as store:
+        for contract in ["EDH6", "EDM6"]:
+            times = store.get_node("/quotes", contract).col("date_time")
+            day = pd.Timestamp("2016-01-05").value
+            expected = np.sort(times[(times >= day) &
+                                     (times < day + 86400 * 10**9)])
+            assert len(expected) > 0
+            np.testing.assert_array_equal(
+                np.sort(symbol.quotes[contract].index.asi8), expected)
+    symbol.handles.close()
+
+    # a day as large as the tables is a bulk load
+    write_raw_file(raw_path, "EDH6", "2016-01-06", 3000, 5)
+    run_convert(monkeypatch, "-r", raw_path, "-d", dest_path)
+    for node, (nrows, indexes) in table_indexes(dest_path).items():
+        if node.endswith("EDH6"):
+            assert indexes == [(nrows, False, True)] * 2
+        else:
+            assert [x[:2] for x in indexes] == [(nrows, False)] * 2
+    assert_index_order(dest_path)
+
+    with tables.open_file(os.path.join(dest_path, "GE.h5")) as store:
+        table = store.root.quotes.EDM6
+        file_dates = table.col("file_date")
+        assert sorted(table.get_where_list("file_date == 20160105")) == \
+            list(np.flatnonzero(file_dates == 20160105))
+        assert table.attrs.file_dates.tolist() == [20160103, 20160104,
+                                               20160105]
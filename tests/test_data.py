@@ -0,0 +1,314 @@
+import gzip
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+import tables
+
+from pyreuters import data
+from pyreuters.data import index_table, indexed_columns, ingested_dates, \
+    add_ingested_date, quote_records, bar_records, bar_nanos, read_ticks, \
+    raw_file, tick_times
+
+from .conftest import write_store, synthetic_day, write_raw_file
+
+
+@pytest.mark.parametrize("kind", ["ultralight", "light", "medium"])
+@pytest.mark.parametrize("force", [False, True])
+def test_index_table_makes_csi_indexes(tmpdir, kind, force):
+    hdf_file = str(tmpdir.join("ED.h5"))
+    write_store(hdf_file, ["EDH6"], [20160104])
+    with tables.open_file(hdf_file, mode="a") as store:
+        table = store.root.quotes.EDH6
+        for name in indexed_columns:
+            table.colinstances[name].remove_index()
+            table.colinstances[name].create_index(optlevel=6, kind=kind)
+            assert not table.colinstances[name].index.is_csi
+        index_table(table, force=force)
+        for name in indexed_columns:
+            assert table.colinstances[name].index.is_csi
+            assert not table.colinstances[name].index.dirty
+
+
+def test_index_table_rebuilds_dirty_indexes(tmpdir):
+    hdf_file = str(tmpdir.join("ED.h5"))
+    write_store(hdf_file, ["EDH6"], [20160105, 20160104])
+    with tables.open_file(hdf_file, mode="a") as store:
+        table = store.root.quotes.EDH6
+        table.autoindex = False
+        table.append(table.read(0, 10))
+        table.flush()
+        assert table.cols.date_time.index.dirty
+        index_table(table)
+        assert table.cols.date_time.index.is_csi
+        assert not table.cols.date_time.index.dirty
+        assert table.cols.date_time.index.nelements == table.nrows
+
+
+def test_ingested_dates_are_rebuilt_after_an_interrupted_append(tmpdir):
+    hdf_file = str(tmpdir.join("ED.h5"))
+    write_store(hdf_file, ["EDH6"], [20160104])
+    with tables.open_file(hdf_file, mode="a") as store:
+        table = store.root.quotes.EDH6
+        assert ingested_dates(table) == {20160104}
+        # the rows of 20160105 are flushed but its date is not recorded
+        table.append(quote_records(synthetic_day(20160105, 500)[0],
+                                   20160105))
+        table.flush()
+        assert table.attrs.file_dates.tolist() == [20160104]
+        assert ingested_dates(table) == {20160104, 20160105}
+        assert table.attrs.file_dates.tolist() == [20160104, 20160105]
+        assert table.attrs.file_dates_nrows == table.nrows
+
+        # a date without rows is kept while the row count matches
+        assert add_ingested_date(table, 20160106) == \
+            {20160104, 20160105, 20160106}
+        assert ingested_dates(table) == {20160104, 20160105, 20160106}
+
+
+@pytest.mark.parametrize("attrs", [["file_dates", "file_dates_nrows"],
+                                   ["file_dates_nrows"]])
+def test_ingested_dates_of_legacy_tables_are_backfilled(tmpdir, attrs):
+    hdf_file = str(tmpdir.join("ED.h5"))
+    write_store(hdf_file, ["EDH6"], [20160105, 20160104])
+    with tables.open_file(hdf_file, mode="a") as store:
+        for name in attrs:
+            store.root.quotes.EDH6.attrs.__delattr__(name)
+
+    with tables.open_file(hdf_file, mode="r") as store:
+        table = store.root.quotes.EDH6
+        assert ingested_dates(table) == {20160104, 20160105}
+        # read-only files are not written to
+        assert "file_dates_nrows" not in table.attrs._v_attrnames
+
+    with tables.open_file(hdf_file, mode="a") as store:
+        table = store.root.quotes.EDH6
+        assert ingested_dates(table) == {20160104, 20160105}
+        assert table.attrs.file_dates.tolist() == [20160104, 20160105]
+        assert table.attrs.file_dates_nrows == table.nrows
+
+
+def resampled_bars(quotes, trades, freq):
+    """The bars of bar_records computed with pandas resample."""
+    trades = trades[trades["price"].notna()].copy()
+    trades["volume"] = trades["volume"].fillna(0)
+    trades["notional"] = trades["price"] * trades["volume"]
+    by_bar = trades.resample(freq)
+    bars = pd.DataFrame({"open": by_bar["price"].first(),
+                         "high": by_bar["price"].max(),
+                         "low": by_bar["price"].min(),
+                         "close": by_bar["price"].last(),
+                         "volume": by_bar["volume"].sum(),
+                         "count": by_bar["price"].count()})
+    bars["vwap"] = by_bar["notional"].sum() / bars["volume"].where(
+        bars["volume"] > 0)
+    starts = bars.index[bars["count"] > 0].union(
+        quotes.index.floor(freq)).unique()
+    bars = bars.reindex(starts)
+    bars["volume"] = bars["volume"].fillna(0)
+    bars["count"] = bars["count"].fillna(0).astype(np.int64)
+    for side, size in (("bid", "bid_size"), ("ask", "ask_size")):
+        # the top of book at the end of a bar is the last update of the
+        # side, in this bar or any earlier one
+        book = quotes.loc[quotes[side].notna(), [side, size]]
+        book = book.resample(freq).last().dropna(how="all")
+        book = book.reindex(starts.union(book.index)).ffill()
+        bars[side] = book[side].reindex(starts)
+        bars[size] = book[size].reindex(starts)
+    return bars
+
+
+@pytest.mark.parametrize("freq", ["1s", "1min", "15min", "1h", "1D"])
+def test_bar_records_match_pandas_resample(freq):
+    quotes, trades = synthetic_day(20160104, 3000, 3)
+    # trades without a price, e.g. parsed from a correction, are skipped
+    trades.iloc[::7, trades.columns.get_loc("price")] = np.nan
+    trades.iloc[::11, trades.columns.get_loc("volume")] = np.nan
+    records = bar_records(quotes, trades, 20160104, freq)
+    expected = resampled_bars(quotes, trades, freq)
+
+    assert (records["file_date"] == 20160104).all()
+    np.testing.assert_array_equal(
+        records["date_time"],
+        expected.index.values.astype("datetime64[ns]").astype(np.int64))
+    np.testing.assert_array_equal(records["count"], expected["count"])
+    for name in ("open", "high", "low", "close", "bid", "bid_size", "ask",
+                 "ask_size"):
+        np.testing.assert_array_equal(records[name], expected[name].values,
+                                      err_msg=name)
+    for name in ("volume", "vwap"):
+        np.testing.assert_allclose(records[name], expected[name].values,
+                                   rtol=1e-12, err_msg=name)
+
+
+def test_bar_records_without_trades_keep_the_book():
+    quotes, trades = synthetic_day(20160104, 500, 4)
+    records = bar_records(quotes, trades.iloc[:0], 20160104, "1h")
+    expected = resampled_bars(quotes, trades.iloc[:0], "1h")
+    assert (records["count"] == 0).all()
+    assert np.isnan(records["open"]).all()
+    np.testing.assert_array_equal(records["bid"], expected["bid"].values)
+    np.testing.assert_array_equal(records["ask"], expected["ask"].values)
+
+
+def test_quotes_at_the_end_of_a_bar_start_the_next_one():
+    index = pd.to_datetime(["2016-01-04 09:30:00", "2016-01-04 10:00:00",
+                            "2016-01-04 10:59:59.999999999"],
+                           format="ISO8601")
+    quotes = pd.DataFrame({"bid": [98.5, 98.6, np.nan],
+                           "ask": [98.51, np.nan, 98.62],
+                           "bid_size": [1.0, 2.0, np.nan],
+                           "ask_size": [3.0, np.nan, 4.0]}, index=index)
+    trades = pd.DataFrame({"price": [98.505, np.nan],
+                           "volume": [5.0, 6.0]}, index=index[1:])
+    records = bar_records(quotes, trades, 20160104, "1h")
+    assert records["date_time"].tolist() == \
+        [x.value for x in index[:2].floor("1h")]
+    assert records["bid"].tolist() == [98.5, 98.6]
+    assert records["bid_size"].tolist() == [1.0, 2.0]
+    assert records["ask"].tolist() == [98.51, 98.62]
+    assert records["ask_size"].tolist() == [3.0, 4.0]
+    assert records["count"].tolist() == [0, 1]
+    assert records["vwap"][1] == 98.505
+
+
+@pytest.mark.parametrize("freq", ["7min", "25h", "0s", "-1min"])
+def test_bar_frequencies_must_divide_a_day(freq):
+    quotes, trades = synthetic_day(20160104, 100)
+    with pytest.raises(ValueError, match="does not divide a day"):
+        bar_nanos(freq)
+    with pytest.raises(ValueError, match="does not divide a day"):
+        bar_records(quotes, trades, 20160104, freq)
+
+
+def rewrite_raw_file(to_write, lines):
+    with gzip.open(to_write, "wb") as raw:
+        raw.write(b"".join(lines))
+
+
+@pytest.fixture
+def raw_path(tmpdir):
+    data_path = str(tmpdir.join("raw"))
+    full = write_raw_file(data_path, "EDH6", "2016-01-04", 5000)
+    with gzip.open(full, "rb") as raw:
+        lines = raw.readlines()
+    for ric, kept in (("EDM6", lines[:1]), ("EDU6", lines[:2]),
+                      ("EDZ6", lines[:300])):
+        to_write = raw_file(ric, "2016-01-04", data_path)
+        rewrite_raw_file(to_write, [x.replace(b"EDH6", ric.encode())
+                                    for x in kept])
+    # the last line without its newline
+    rewrite_raw_file(raw_file("GEH7", "2016-01-04", data_path),
+                     lines[:-1] + [lines[-1].rstrip(b"\r\n")])
+    return data_path
+
+
+@pytest.mark.parametrize("ric", ["EDH6", "EDM6", "EDU6", "EDZ6", "GEH7"])
+@pytest.mark.parametrize("threads,block_size", [(2, 1 << 10), (4, 1 << 14),
+                                                (3, 32 << 20)])
+def test_threaded_read_equals_serial_read(raw_path, ric, threads,
+                                          block_size):
+    serial = read_ticks(ric, "2016-01-04", raw_path)
+    threaded = read_ticks(ric, "2016-01-04", raw_path, threads=threads,
+                          block_size=block_size)
+    pd.testing.assert_frame_equal(threaded, serial)
+    assert list(threaded.dtypes) == list(serial.dtypes)
+    assert list(threaded["Type"].cat.categories) == \
+        list(serial["Type"].cat.categories)
+    assert threaded.index.name == serial.index.name == "date_time"
+
+
+def test_threaded_read_cleans_up_when_a_block_fails(raw_path, monkeypatch):
+    opened = []
+    gzip_open = gzip.open
+
+    def tracked_open(*args, **kwargs):
+        opened.append(gzip_open(*args, **kwargs))
+        return opened[-1]
+
+    parse_block = data.__parse_block__
+    parsed = []
+
+    def failing_parse(args):
+        parsed.append(1)
+        if len(parsed) == 3:
+            raise ValueError("bad block")
+        return parse_block(args)
+
+    monkeypatch.setattr(gzip, "open", tracked_open)
+    monkeypatch.setattr(data, "__parse_block__", failing_parse)
+    before = set(threading.enumerate())
+    errors = []
+
+    def read():
+        try:
+            read_ticks("EDH6", "2016-01-04", raw_path, threads=2,
+                       block_size=1 << 10)
+        except ValueError as err:
+            errors.append(err)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    reader.join(30)
+    assert not reader.is_alive()
+    assert [str(x) for x in errors] == ["bad block"]
+    assert len(opened) == 1 and opened[0].closed
+    # the producer and the pool threads are gone
+    assert set(threading.enumerate()) - before == set()
+
+
+def expected_times(dates, times):
+    days = pd.to_datetime(pd.Series(dates), format="%d-%b-%Y")
+    return (days.values.astype("datetime64[ns]") +
+            pd.to_timedelta(pd.Series(times)).values.astype(
+                "timedelta64[ns]")).astype(np.int64)
+
+
+def test_tick_times_fast_path(monkeypatch):
+    rs = np.random.RandomState(0)
+    stamps = pd.Timestamp("2016-01-04") + pd.to_timedelta(
+        np.sort(rs.randint(0, 3 * 86400 * 10**6, 1000)), unit="us")
+    dates = stamps.strftime("%d-%b-%Y").str.upper()
+    times = stamps.strftime("%H:%M:%S.%f")
+
+    def fallback(*args, **kwargs):
+        raise AssertionError("pd.to_timedelta called")
+    monkeypatch.setattr(pd, "to_timedelta", fallback)
+    got = tick_times(dates, times)
+    monkeypatch.undo()
+    np.testing.assert_array_equal(got, stamps.values.astype(
+        "datetime64[ns]").astype(np.int64))
+    assert len(np.unique(dates)) == 3
+
+
+@pytest.mark.parametrize("times", [
+    ["10:00:00", "10:00:00.5", "10:00:00.123456789", "23:59:59.999"],
+    ["00:00:00.000", "12:30:15.250", "18:00:00.1", "23:59:59"]])
+def test_tick_times_fractional_seconds(times):
+    dates = ["04-JAN-2016", "05-JAN-2016", "04-JAN-2016", "06-JAN-2016"]
+    np.testing.assert_array_equal(tick_times(dates, times),
+                                  expected_times(dates, times))
+
+
+@pytest.mark.parametrize("malformed", ["9:30:00.000", "09:30", "9:5:3",
+                                       "09:30:00:000"])
+def test_tick_times_fall_back_for_other_layouts(malformed):
+    dates = ["04-JAN-2016", "05-JAN-2016", "05-JAN-2016"]
+    times = ["08:00:00.000", malformed, "17:00:00.250"]
+    try:
+        expected = expected_times(dates, times)
+    except ValueError:
+        with pytest.raises(ValueError):
+            tick_times(dates, times)
+        return
+    np.testing.assert_array_equal(tick_times(dates, times), expected)
+
+
+def test_tick_times_of_missing_dates():
+    got = tick_times(["04-JAN-2016", np.nan, "05-JAN-2016"],
+                     ["10:00:00.000", "10:00:00.000", "11:00:00.000"])
+    assert got[1] == np.datetime64("NaT").astype(np.int64)
+    np.testing.assert_array_equal(
+        got[[0, 2]], expected_times(["04-JAN-2016", "05-JAN-2016"],
+                                    ["10:00:00.000", "11:00:00.000"]))
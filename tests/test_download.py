@@ -0,0 +1,235 @@
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pyreuters.bin import download
+from pyreuters.bin.download import fetch
+
+
+def gzipped(seed, n):
+    rs = np.random.RandomState(seed)
+    return gzip.compress(rs.bytes(n))
+
+
+class Interrupted(IOError):
+    pass
+
+
+class FakeRemote(io.BytesIO):
+    """Remote file that fails once `fail_after` bytes have been read."""
+    def __init__(self, data, fail_after=None):
+        io.BytesIO.__init__(self, data)
+        self.fail_after = fail_after
+
+    def read(self, size=-1):
+        if self.fail_after is not None and self.tell() >= self.fail_after:
+            raise Interrupted("connection dropped")
+        if self.fail_after is not None:
+            size = min(size, self.fail_after - self.tell())
+        return io.BytesIO.read(self, size)
+
+
+class FakeConnection(object):
+    """Stands in for pysftp.Connection, serving files from a dict."""
+    def __init__(self, files, fail_after=None):
+        self.files = files
+        self.fail_after = fail_after
+        self.offsets = []
+
+    def open(self, remote_file, mode="rb"):
+        remote = FakeRemote(self.files[remote_file], self.fail_after)
+        seek = remote.seek
+
+        def recorded_seek(offset, *args):
+            self.offsets.append(offset)
+            return seek(offset, *args)
+        remote.seek = recorded_seek
+        return remote
+
+
+@pytest.fixture
+def paths(tmpdir, monkeypatch):
+    # small blocks so an interruption leaves a partial file
+    monkeypatch.setattr(download, "block_size", 1024)
+    return (str(tmpdir.join("ED.csv.gz.part")),
+            str(tmpdir.join("ED.csv.gz")))
+
+
+def test_interrupted_download_resumes(paths):
+    part_file, dest_file = paths
+    data = gzipped(0, 50000)
+    version = {"size": len(data), "mtime": 100}
+
+    with pytest.raises(Interrupted):
+        fetch(FakeConnection({"r": data}, fail_after=20000), "r", version,
+              part_file, dest_file)
+    assert os.path.getsize(part_file) == 20000
+    assert not os.path.exists(dest_file)
+
+    connection = FakeConnection({"r": data})
+    fetch(connection, "r", version, part_file, dest_file)
+    assert connection.offsets == [20000]
+    with open(dest_file, "rb") as data_file:
+        assert data_file.read() == data
+    assert not os.path.exists(part_file)
+    assert not os.path.exists(part_file + ".json")
+
+
+@pytest.mark.parametrize("raw_size", [60000, 50000])
+def test_changed_remote_file_restarts(paths, raw_size):
+    part_file, dest_file = paths
+    old = gzipped(0, 50000)
+    with pytest.raises(Interrupted):
+        fetch(FakeConnection({"r": old}, fail_after=20000), "r",
+              {"size": len(old), "mtime": 100}, part_file, dest_file)
+
+    # replaced on the server by a larger file, or one of the same size
+    new = gzipped(1, raw_size)
+    assert len(new) > len(old) if raw_size > 50000 else len(new) == len(old)
+    connection = FakeConnection({"r": new})
+    fetch(connection, "r", {"size": len(new), "mtime": 200}, part_file,
+          dest_file)
+    assert connection.offsets == [0]
+    with open(dest_file, "rb") as data_file:
+        assert data_file.read() == new
+
+
+def test_partial_without_version_restarts(paths):
+    part_file, dest_file = paths
+    data = gzipped(0, 50000)
+    with open(part_file, "wb") as data_file:
+        data_file.write(b"x" * 1000)
+    connection = FakeConnection({"r": data})
+    fetch(connection, "r", {"size": len(data), "mtime": 100}, part_file,
+          dest_file)
+    assert connection.offsets == [0]
+    with open(dest_file, "rb") as data_file:
+        assert data_file.read() == data
+
+
+def test_corrupt_download_is_not_kept(paths):
+    part_file, dest_file = paths
+    data = bytearray(gzipped(0, 50000))
+    data[len(data) // 2] ^= 0xff
+    with pytest.raises(IOError):
+        fetch(FakeConnection({"r": bytes(data)}), "r",
+              {"size": len(data), "mtime": 100}, part_file, dest_file)
+    assert not os.path.exists(dest_file)
+    assert not os.path.exists(part_file)
+
+
+class FakeServer(object):
+    """Remote directories of files, shared by every FakeSession."""
+    def __init__(self, files):
+        self.files = files
+        self.fail_after = {}
+        self.opened = []
+        self.sessions = []
+
+    def connect(self, host, username=None, password=None):
+        session = FakeSession(self)
+        self.sessions.append(session)
+        return session
+
+
+class FakeSession(object):
+    """Stands in for pysftp.Connection in reuters_download."""
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def exists(self, remote_path):
+        return any(x.startswith(remote_path + "/") for x in self.server.files)
+
+    def listdir_attr(self, remote_path):
+        return [SimpleNamespace(filename=x[len(remote_path) + 1:],
+                                st_size=len(data), st_mtime=100)
+                for x, data in sorted(self.server.files.items())
+                if x.startswith(remote_path + "/")]
+
+    def open(self, remote_file, mode="rb"):
+        self.server.opened.append(remote_file)
+        return FakeRemote(self.server.files[remote_file],
+                          self.server.fail_after.get(remote_file))
+
+    def close(self):
+        self.closed = True
+
+
+def run_download(monkeypatch, server, save_dir, *args):
+    monkeypatch.setattr(download.pysftp, "Connection", server.connect)
+    monkeypatch.setattr(download, "remote_dir", "/csv/")
+    monkeypatch.setattr(sys, "argv", [
+        "reuters_download", "-u", "user", "-p", "secret", "-i", "ED",
+        "-s", "20160104", "-e", "20160106", "-d", save_dir] + list(args))
+    return download.main()
+
+
+@pytest.mark.parametrize("parallel", ["1", "3"])
+def test_main_collects_failures_and_resumes(tmpdir, monkeypatch, caplog,
+                                            parallel):
+    monkeypatch.setattr(download, "block_size", 1024)
+    server = FakeServer({
+        "/csv/2016.01.04/2016.01.04.EDH6.csv.gz": gzipped(0, 20000),
+        "/csv/2016.01.04/2016.01.04.EDM6.csv.gz": gzipped(1, 20000),
+        "/csv/2016.01.04/2016.01.04.GEH6.csv.gz": gzipped(2, 20000),
+        "/csv/2016.01.05/2016.01.05.EDH6.csv.gz": gzipped(3, 20000)})
+    server.fail_after["/csv/2016.01.04/2016.01.04.EDM6.csv.gz"] = 5000
+    save_dir = str(tmpdir.join("data"))
+    manifest_file = os.path.join(save_dir, "manifest.json")
+
+    with caplog.at_level(logging.ERROR):
+        assert run_download(monkeypatch, server, save_dir, "-P",
+                            parallel) == 1
+    # the failure did not stop the other files
+    assert sorted(server.opened) == [
+        "/csv/2016.01.04/2016.01.04.EDH6.csv.gz",
+        "/csv/2016.01.04/2016.01.04.EDM6.csv.gz",
+        "/csv/2016.01.05/2016.01.05.EDH6.csv.gz"]
+    errors = [x.getMessage() for x in caplog.records
+              if x.name == download.__name__]
+    assert "1 of 3 files failed to download" in errors[-1]
+    assert "2016.01.04.EDM6.csv.gz: connection dropped" in errors[-1]
+    with open(manifest_file) as data_file:
+        assert sorted(json.load(data_file)) == [
+            "20160104/2016.01.04.EDH6.csv.gz",
+            "20160105/2016.01.05.EDH6.csv.gz"]
+    assert not os.path.exists(os.path.join(save_dir, "20160104",
+                                           "2016.01.04.EDM6.csv.gz"))
+    assert all(x.closed for x in server.sessions)
+
+    # only the failed file is fetched again, from where it stopped
+    del server.fail_after["/csv/2016.01.04/2016.01.04.EDM6.csv.gz"]
+    server.opened = []
+    offsets = []
+    seek = FakeRemote.seek
+    monkeypatch.setattr(FakeRemote, "seek", lambda self, offset, *args:
+                        offsets.append(offset) or seek(self, offset, *args))
+    assert run_download(monkeypatch, server, save_dir, "-P",
+                        parallel) is None
+    assert server.opened == ["/csv/2016.01.04/2016.01.04.EDM6.csv.gz"]
+    assert offsets == [5000]
+    with open(manifest_file) as data_file:
+        manifest = json.load(data_file)
+    assert sorted(manifest) == [
+        "20160104/2016.01.04.EDH6.csv.gz",
+        "20160104/2016.01.04.EDM6.csv.gz",
+        "20160105/2016.01.05.EDH6.csv.gz"]
+    for key, version in manifest.items():
+        remote_file = "/csv/{}.{}.{}/{}".format(
+            key[:4], key[4:6], key[6:8], key.split("/")[1])
+        with open(os.path.join(save_dir, key), "rb") as data_file:
+            assert data_file.read() == server.files[remote_file]
+        assert version == {"size": len(server.files[remote_file]),
+                           "mtime": 100}
+
+    server.opened = []
+    assert run_download(monkeypatch, server, save_dir) is None
+    assert server.opened == []
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+import tables
+
+from pyreuters.bin.export import export_file
+from pyreuters.symbol import Symbol
+
+from .conftest import write_store
+
+
+@pytest.fixture
+def h5_dir(tmpdir):
+    write_store(str(tmpdir.join("ED.h5")), ["EDH6", "EDM6"],
+                [20160104, 20160105])
+    return str(tmpdir)
+
+
+def memmap_root(h5_dir):
+    return os.path.join(h5_dir, "memmap", "ED")
+
+
+def assert_same_data(h5_dir):
+    hdf5 = Symbol("ED", h5_dir=h5_dir).load("2016-01-03", "2016-01-07")
+    memmap = Symbol("ED", h5_dir=h5_dir, storage="memmap").load(
+        "2016-01-03", "2016-01-07")
+    for loaded, data in ((hdf5.quotes, memmap.quotes),
+                         (hdf5.trades, memmap.trades)):
+        assert sorted(data) == ["EDH6", "EDM6"]
+        for contract, frame in data.items():
+            assert frame.index.equals(loaded[contract].index)
+            for column in frame.columns:
+                np.testing.assert_array_equal(
+                    frame[column].values, loaded[contract][column].values)
+
+
+def test_export_uses_the_file_dates_attribute(h5_dir, monkeypatch):
+    def col(self, name):
+        raise AssertionError("{} column of {} read".format(
+            name, self._v_pathname))
+    monkeypatch.setattr(tables.Table, "col", col)
+    export_file(os.path.join(h5_dir, "ED.h5"), memmap_root(h5_dir))
+    monkeypatch.undo()
+    assert_same_data(h5_dir)
+
+
+def test_export_tables_without_file_dates(h5_dir):
+    hdf_file = os.path.join(h5_dir, "ED.h5")
+    with tables.open_file(hdf_file, mode="a") as store:
+        for table in store.walk_nodes("/", "Table"):
+            del table.attrs.file_dates
+    mtime = os.path.getmtime(hdf_file)
+    export_file(hdf_file, memmap_root(h5_dir))
+    export_file(hdf_file, memmap_root(h5_dir))
+    # the hdf5 file is only read
+    assert os.path.getmtime(hdf_file) == mtime
+    assert_same_data(h5_dir)
+
+
+def test_load_bars_from_memmap_raises(h5_dir):
+    export_file(os.path.join(h5_dir, "ED.h5"), memmap_root(h5_dir))
+    symbol = Symbol("ED", h5_dir=h5_dir, storage="memmap")
+    with pytest.raises(ValueError, match="not exported"):
+        symbol.load_bars("EDH6", "1min", "2016-01-04", "2016-01-05")
@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+import time
+
+from pyreuters.handles import HandleCache
+from pyreuters.symbol import Symbol
+
+from .conftest import write_store
+
+
+WRITER = """
+import sys
+import tables
+with tables.open_file(sys.argv[1], mode="a") as store:
+    store.root._v_attrs.written = True
+"""
+
+
+def write_from_another_process(hdf_file):
+    return subprocess.run([sys.executable, "-c", WRITER, hdf_file],
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE).returncode == 0
+
+
+def wait_closed(handles, timeout=5):
+    deadline = time.time() + timeout
+    while handles.stats()["open"] and time.time() < deadline:
+        time.sleep(0.05)
+    return handles.stats()["open"] == 0
+
+
+def test_idle_handles_are_closed_for_other_writers(tmpdir):
+    hdf_file = str(tmpdir.join("ED.h5"))
+    write_store(hdf_file, ["EDH6"], [20160104])
+    handles = HandleCache(idle_timeout=0.2)
+    Symbol("ED", h5_dir=str(tmpdir), handles=handles).load("2016-01-04",
+                                                           "2016-01-05")
+    if os.environ.get("HDF5_USE_FILE_LOCKING", "").upper() != "FALSE":
+        # the cached handle locks the file, checked out here so it is not
+        # closed before the other process has started
+        with handles.open(hdf_file):
+            assert handles.stats()["open"] == 1
+            assert not write_from_another_process(hdf_file)
+    assert wait_closed(handles)
+    assert write_from_another_process(hdf_file)
+
+    loaded = Symbol("ED", h5_dir=str(tmpdir), handles=handles).load(
+        "2016-01-04", "2016-01-05")
+    assert len(loaded.quotes["EDH6"]) > 0
+    assert wait_closed(handles)
+
+
+def test_checked_out_handles_stay_open(tmpdir):
+    hdf_file = str(tmpdir.join("ED.h5"))
+    write_store(hdf_file, ["EDH6"], [20160104])
+    handles = HandleCache(idle_timeout=0.1)
+    with handles.open(hdf_file) as store:
+        time.sleep(0.3)
+        assert store.isopen
+        assert store.root.quotes.EDH6.nrows > 0
+    assert wait_closed(handles)
+    assert not store.isopen
+
+
+def test_handles_without_idle_timeout_stay_cached(tmpdir):
+    hdf_file = str(tmpdir.join("ED.h5"))
+    write_store(hdf_file, ["EDH6"], [20160104])
+    with HandleCache(idle_timeout=None) as handles:
+        with handles.open(hdf_file):
+            pass
+        time.sleep(0.2)
+        assert handles.stats()["open"] == 1
+    assert handles.stats()["open"] == 0
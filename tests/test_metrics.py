@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyreuters import metrics
+from pyreuters.metrics import prevailing, tick_signs, time_weighted_mean, \
+    asof, realized_volatility
+
+from .conftest import synthetic_day
+
+
+def random_prices(n, seed, missing=0.3):
+    rs = np.random.RandomState(seed)
+    # few distinct prices, so there are zero ticks
+    prices = 98.5 + rs.randint(-3, 4, n) * 0.005
+    prices[rs.rand(n) < missing] = np.nan
+    return prices
+
+
+def random_times(n, seed):
+    rs = np.random.RandomState(seed)
+    # repeated timestamps included
+    return np.sort(rs.randint(0, 60 * 10**9, n)).astype(np.int64)
+
+
+@pytest.mark.parametrize("n", [0, 1, 5, 1000])
+@pytest.mark.parametrize("missing", [0.0, 0.3, 1.0])
+def test_numpy_kernels_match_the_loops(n, missing):
+    prices = random_prices(n, n, missing)
+    times = random_times(n, n + 1)
+    np.testing.assert_array_equal(prevailing(prices, "numpy"),
+                                  metrics.__ffill_loop__(prices))
+    np.testing.assert_array_equal(tick_signs(prices, "numpy"),
+                                  metrics.__tick_signs_loop__(prices))
+    for end_time in [None, 61 * 10**9]:
+        expected = metrics.__time_weighted_loop__(
+            times, prices, times[-1] if end_time is None and n else end_time)
+        got = time_weighted_mean(times, prices, end_time, "numpy")
+        if n == 0:
+            assert np.isnan(got)
+        else:
+            np.testing.assert_allclose(got, expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize("n", [0, 1, 1000])
+def test_numba_kernels_match_numpy(n):
+    pytest.importorskip("numba")
+    prices = random_prices(n, n)
+    times = random_times(n, n + 1)
+    np.testing.assert_array_equal(prevailing(prices, "numba"),
+                                  prevailing(prices, "numpy"))
+    np.testing.assert_array_equal(tick_signs(prices, "numba"),
+                                  tick_signs(prices, "numpy"))
+    np.testing.assert_allclose(
+        time_weighted_mean(times, prices, 61 * 10**9, "numba"),
+        time_weighted_mean(times, prices, 61 * 10**9, "numpy"), rtol=1e-12)
+
+
+def test_engines():
+    if metrics.numba is None:
+        with pytest.raises(ValueError, match="needs numba"):
+            prevailing([1.0], "numba")
+    with pytest.raises(ValueError, match="Unknown engine"):
+        prevailing([1.0], "cython")
+
+
+def test_prevailing_by_hand():
+    values = np.array([np.nan, 1.0, np.nan, np.nan, 2.0, np.nan])
+    np.testing.assert_array_equal(prevailing(values, "numpy"),
+                                  [np.nan, 1.0, 1.0, 1.0, 2.0, 2.0])
+    # the input is not modified, read-only arrays are accepted
+    values.flags.writeable = False
+    prevailing(values, "numpy")
+    assert np.isnan(values[0])
+
+
+def test_tick_signs_by_hand():
+    prices = [np.nan, 10.0, 10.0, 11.0, np.nan, 11.0, 10.5, 10.5, 12.0]
+    np.testing.assert_array_equal(tick_signs(prices, "numpy"),
+                                  [0, 0, 0, 1, 0, 1, -1, -1, 1])
+
+
+def test_time_weighted_mean_by_hand():
+    times = [0, 10, 40, 50]
+    values = [1.0, np.nan, 3.0, 5.0]
+    # 1 for 10ns, NaN for 30ns is left out, 3 for 10ns, 5 for 50ns
+    assert time_weighted_mean(times, values, 100, "numpy") == \
+        (1 * 10 + 3 * 10 + 5 * 50) / 70.0
+    # without end_time the last value gets no weight
+    assert time_weighted_mean(times, values, engine="numpy") == 2.0
+    assert np.isnan(time_weighted_mean([0], [1.0], engine="numpy"))
+    assert np.isnan(time_weighted_mean([], [], engine="numpy"))
+
+
+def test_asof_by_hand():
+    times = [10, 20, 20, 30]
+    values = [1.0, 2.0, 3.0, np.nan]
+    at = [5, 10, 19, 20, 25, 30, 100]
+    np.testing.assert_array_equal(asof(times, values, at),
+                                  [np.nan, 1.0, 1.0, 3.0, 3.0, np.nan,
+                                   np.nan])
+    np.testing.assert_array_equal(asof(times, values, at, tolerance=5),
+                                  [np.nan, 1.0, np.nan, 3.0, 3.0, np.nan,
+                                   np.nan])
+    np.testing.assert_array_equal(asof([], [], [1, 2]), [np.nan, np.nan])
+
+
+@pytest.mark.parametrize("tolerance", [None, 10**8, 10**9])
+def test_asof_matches_merge_asof(tolerance):
+    times = random_times(500, 3)
+    values = np.random.RandomState(4).randn(500)
+    at = random_times(200, 5)
+    expected = pd.merge_asof(
+        pd.DataFrame({"t": at}), pd.DataFrame({"t": times, "v": values}),
+        on="t", tolerance=tolerance)["v"].values
+    np.testing.assert_array_equal(asof(times, values, at, tolerance),
+                                  expected)
+
+
+def test_realized_volatility_by_hand():
+    minute = 60 * 10**9
+    times = np.array([0, 1, 2, 5, 6, 11, 12]) * minute
+    prices = np.array([100.0, 101.0, 102.0, np.nan, 104.0, 103.0, 105.0])
+    # the last price of [0, 5min) is 102, of [5min, 10min) 104 and of
+    # [10min, 15min) 105
+    expected = np.sqrt(np.log(104 / 102.) ** 2 + np.log(105 / 104.) ** 2)
+    assert realized_volatility(times, prices, "5min") == \
+        pytest.approx(expected, rel=1e-12)
+    assert np.isnan(realized_volatility(times[:1], prices[:1]))
+    assert np.isnan(realized_volatility(times[3:4], prices[3:4]))
+
+
+def test_realized_volatility_matches_resample():
+    _, trades = synthetic_day(20160104, 3000, 6)
+    last = trades["price"].resample("5min").last().dropna()
+    expected = np.sqrt((np.log(last).diff() ** 2).sum())
+    times = trades.index.values.astype("datetime64[ns]").astype(np.int64)
+    assert realized_volatility(times, trades["price"].values, "5min") == \
+        pytest.approx(expected, rel=1e-12)
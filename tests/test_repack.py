@@ -0,0 +1,80 @@
+import os
+import sys
+
+import pytest
+import tables
+
+from pyreuters.bin import repack
+from pyreuters.continuous import ContinuousSymbol
+from pyreuters.data import indexed_columns
+from pyreuters.handles import HandleCache
+
+from .conftest import write_store
+
+
+def snapshot(hdf_file):
+    """Rows, attributes and indexed columns of every table of hdf_file."""
+    with tables.open_file(hdf_file) as store:
+        tables_found = {}
+        for table in store.walk_nodes("/", "Table"):
+            attrs = dict((x, getattr(table.attrs, x).tolist()
+                          if hasattr(getattr(table.attrs, x), "tolist")
+                          else getattr(table.attrs, x))
+                         for x in table.attrs._v_attrnames
+                         if not x.startswith(("CLASS", "VERSION", "TITLE",
+                                              "FIELD_", "NROWS",
+                                              "AUTO_INDEX", "FILTERS")))
+            tables_found[table._v_pathname] = (
+                table.read().tobytes(), attrs,
+                sorted(x for x in table.colnames
+                       if table.colinstances[x].is_indexed))
+        return tables_found
+
+
+@pytest.fixture
+def hdf_file(tmpdir):
+    hdf_file = str(tmpdir.join("ED.h5"))
+    write_store(hdf_file, ["EDH6", "EDM6"], [20160105, 20160104, 20160106])
+    # a table without the indexed columns, written through the cache
+    handles = HandleCache()
+    ContinuousSymbol("ED", h5_dir=str(tmpdir), handles=handles) \
+        .roll_schedule()
+    handles.close()
+    return hdf_file
+
+
+@pytest.mark.parametrize("complib,complevel,chunkshape", [
+    ("blosc:zstd", 5, None), ("zlib", 9, 1000)])
+def test_repack_changes_filters_and_keeps_everything_else(
+        hdf_file, monkeypatch, complib, complevel, chunkshape):
+    if complib.split(":")[0] not in tables.filters.all_complibs:
+        pytest.skip("{} is not available".format(complib))
+    before = snapshot(hdf_file)
+    assert "/rolls/volume" in before
+    args = ["reuters_repack", "-d", os.path.dirname(hdf_file), "-f",
+            os.path.basename(hdf_file), "--complib", complib,
+            "--complevel", str(complevel)]
+    if chunkshape is not None:
+        args += ["--chunkshape", str(chunkshape)]
+    monkeypatch.setattr(sys, "argv", args)
+    repack.main()
+
+    assert snapshot(hdf_file) == before
+    with tables.open_file(hdf_file) as store:
+        assert store.root.quotes.EDH6.attrs.file_dates.tolist() == \
+            [20160104, 20160105, 20160106]
+        for leaf in store.walk_nodes("/", "Leaf"):
+            if "/_i_" in leaf._v_pathname:
+                continue
+            assert leaf.filters.complib == complib
+            assert leaf.filters.complevel == complevel
+            if chunkshape is not None:
+                assert leaf.chunkshape == (chunkshape,)
+        for table in store.walk_nodes("/", "Table"):
+            if table._v_pathname.startswith("/rolls"):
+                continue
+            for name in indexed_columns:
+                index = table.colinstances[name].index
+                assert index.is_csi and not index.dirty
+                assert index.nelements == table.nrows
+    assert os.listdir(os.path.dirname(hdf_file)) == ["ED.h5"]
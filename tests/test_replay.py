@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import tables
+
+from pyreuters.replay import replay
+from pyreuters.symbol import Symbol
+
+from .conftest import write_store, sorted_rows
+
+windows = [("2016-01-04 12:00", "2016-01-05 12:00"),
+           ("2016-01-03", "2016-01-04 18:00"),
+           ("2016-01-01", "2016-01-10")]
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+def test_replay_backfilled(tmpdir, indexed):
+    h5_dir = str(tmpdir)
+    hdf_file = str(tmpdir.join("ED.h5"))
+    # 20160104 is converted after the later dates
+    write_store(hdf_file, ["EDH6", "EDM6"], [20160105, 20160106, 20160104])
+    if not indexed:
+        with tables.open_file(hdf_file, mode="a") as store:
+            for table in store.walk_nodes("/", "Table"):
+                table.cols.date_time.remove_index()
+
+    for start_time, end_time in windows:
+        r = replay(["ED"], start_time, end_time, h5_dir=h5_dir,
+                   chunk_rows=300, batch_size=700)
+        events = np.concatenate(list(r))
+        assert np.all(np.diff(events["date_time"]) >= 0)
+
+        loaded = Symbol("ED", h5_dir=h5_dir).load(start_time, end_time)
+        total = 0
+        for source, (_, contract, kind) in enumerate(r.sources):
+            if kind == "quotes":
+                expected = loaded.get_quotes(contract)
+                columns = ["bid", "bid_size", "ask", "ask_size"]
+            else:
+                expected = loaded.get_trades(contract)
+                columns = ["price", "volume"]
+            replayed = events[events["source"] == source]
+            total += len(expected)
+            for a, b in zip(
+                    sorted_rows([replayed["date_time"]] +
+                                [replayed[x] for x in columns]),
+                    sorted_rows([expected.index.asi8] +
+                                [expected[x].values.astype(np.float64)
+                                 for x in columns])):
+                np.testing.assert_array_equal(a, b)
+        assert total == len(events)
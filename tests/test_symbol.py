@@ -0,0 +1,234 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import tables
+
+from pyreuters.handles import HandleCache
+from pyreuters.symbol import Symbol, __asof_join__
+
+from .conftest import write_store
+
+
+@pytest.fixture
+def h5_dir(tmpdir):
+    write_store(str(tmpdir.join("ED.h5")), ["EDH6", "EDM6"],
+                [20160104, 20160105])
+    return str(tmpdir)
+
+
+@pytest.mark.parametrize("columns", [["bid", "ask"], ["bid"], ["volume"],
+                                     ["ask_size", "price"]])
+def test_projected_load_matches_full_load(h5_dir, columns):
+    full = Symbol("ED", h5_dir=h5_dir).load("2016-01-04", "2016-01-06")
+    projected = Symbol("ED", h5_dir=h5_dir).load("2016-01-04", "2016-01-06",
+                                                 columns=columns)
+    for loaded, data in ((full.quotes, projected.quotes),
+                         (full.trades, projected.trades)):
+        for contract, frame in data.items():
+            assert list(frame.columns) == [x for x in loaded[contract]
+                                           if x in columns]
+            assert frame.index.equals(loaded[contract].index)
+            for column in frame.columns:
+                np.testing.assert_array_equal(
+                    frame[column].values, loaded[contract][column].values)
+
+
+def test_projected_load_reads_rows_once(h5_dir, monkeypatch):
+    reads = []
+    depth = [0]
+
+    def counted(original):
+        # reads made by another read method are not counted again
+        def read(self, *args, **kwargs):
+            if depth[0] == 0:
+                reads.append(self._v_pathname)
+            depth[0] += 1
+            try:
+                return original(self, *args, **kwargs)
+            finally:
+                depth[0] -= 1
+        return read
+
+    for method in ("read_where", "read_coordinates", "get_where_list",
+                   "read"):
+        monkeypatch.setattr(tables.Table, method,
+                            counted(getattr(tables.Table, method)))
+
+    Symbol("ED", h5_dir=h5_dir).load("2016-01-04", "2016-01-06",
+                                     columns=["bid", "ask", "price"])
+    assert sorted(reads) == ["/quotes/EDH6", "/quotes/EDM6",
+                             "/trades/EDH6", "/trades/EDM6"]
+
+
+class RecordingLock(object):
+    def __init__(self):
+        self.held = 0
+
+    def __enter__(self):
+        self.held += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.held -= 1
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+@pytest.mark.parametrize("chunk_rows", [100, 1000, 100000])
+def test_iter_chunks_match_load(tmpdir, monkeypatch, chunk_rows, indexed):
+    h5_dir = str(tmpdir)
+    hdf_file = str(tmpdir.join("ED.h5"))
+    write_store(hdf_file, ["EDH6"], [20160105, 20160106, 20160104])
+    if not indexed:
+        with tables.open_file(hdf_file, mode="a") as store:
+            for table in store.walk_nodes("/", "Table"):
+                table.cols.date_time.remove_index()
+    handles = HandleCache()
+    handles.io_lock = RecordingLock()
+    unlocked = []
+    largest = [0]
+
+    def locked(original):
+        def read(self, *args, **kwargs):
+            if handles.io_lock.held == 0:
+                unlocked.append(original.__name__)
+            result = original(self, *args, **kwargs)
+            largest[0] = max(largest[0], len(result))
+            return result
+        return read
+
+    start_time, end_time = "2016-01-04 12:00", "2016-01-05 12:00"
+    loaded = Symbol("ED", h5_dir=h5_dir, handles=handles).load(
+        start_time, end_time)
+    for method in ("read_where", "read_coordinates", "get_where_list",
+                   "read"):
+        monkeypatch.setattr(tables.Table, method,
+                            locked(getattr(tables.Table, method)))
+    for method in ("__getitem__", "read_sorted"):
+        monkeypatch.setattr(tables.index.Index, method,
+                            locked(getattr(tables.index.Index, method)))
+
+    symbol = Symbol("ED", h5_dir=h5_dir, handles=handles)
+    for chunks, expected in (
+            (symbol.iter_quotes("EDH6", start_time, end_time, chunk_rows),
+             loaded.quotes["EDH6"]),
+            (symbol.iter_trades("EDH6", start_time, end_time, chunk_rows),
+             loaded.trades["EDH6"])):
+        chunks = list(chunks)
+        assert all(len(x) <= chunk_rows for x in chunks)
+        if indexed:
+            # read through the index, so in date_time order
+            expected = expected.iloc[np.argsort(expected.index.asi8,
+                                                kind="mergesort")]
+        assert pd.concat(chunks).equals(expected)
+    assert unlocked == []
+    # nothing larger than a chunk is read, whatever the length of the range
+    assert 0 < largest[0] <= chunk_rows
+    handles.close()
+
+
+def test_parquet_frames_use_the_arrays_read(h5_dir, monkeypatch):
+    pytest.importorskip("pyarrow")
+    from pyreuters.parquet import ParquetStore
+
+    store = ParquetStore(os.path.join(h5_dir, "ED"))
+    with tables.open_file(os.path.join(h5_dir, "ED.h5")) as h5:
+        for table in h5.walk_nodes("/", "Table"):
+            kind = table._v_parent._v_name
+            for file_date in np.unique(table.col("file_date")):
+                store.append(kind, table.name, str(file_date),
+                             table.read_where("file_date == {}".format(
+                                 file_date)))
+
+    read = []
+    original = ParquetStore.read
+
+    def recorded(self, *args, **kwargs):
+        read.append(original(self, *args, **kwargs))
+        return read[-1]
+    monkeypatch.setattr(ParquetStore, "read", recorded)
+
+    hdf5 = Symbol("ED", h5_dir=h5_dir).load("2016-01-04", "2016-01-06")
+    parquet = Symbol("ED", h5_dir=h5_dir, storage="parquet").load(
+        "2016-01-04", "2016-01-06")
+    frames = list(parquet.quotes.values()) + list(parquet.trades.values())
+    assert len(read) == len(frames) == 4
+    for arrays, frame in zip(read, frames):
+        for column in ("bid", "ask", "price"):
+            if column in frame:
+                assert np.shares_memory(frame[column].values,
+                                        arrays[column])
+    for loaded, data in ((hdf5.quotes, parquet.quotes),
+                         (hdf5.trades, parquet.trades)):
+        for contract, frame in data.items():
+            assert frame.equals(loaded[contract])
+
+
+def merge_asof_per_side(quotes, trades, tolerance=None):
+    """__asof_join__ done with one pd.merge_asof per side of the book."""
+    merged = trades.copy()
+    for side, size in (("bid", "bid_size"), ("ask", "ask_size")):
+        book = quotes.loc[quotes[side].notna(), [side, size]]
+        book = book.iloc[np.argsort(book.index.asi8, kind="mergesort")]
+        joined = pd.merge_asof(
+            trades[[]], book.astype(np.float64), left_index=True,
+            right_index=True, direction="backward",
+            tolerance=None if tolerance is None else pd.Timedelta(tolerance))
+        merged[side] = joined[side].values
+        merged[size] = joined[size].values
+    return merged
+
+
+@pytest.mark.parametrize("tolerance", [None, "1s", "5min"])
+@pytest.mark.parametrize("shuffled", [False, True])
+def test_asof_join_matches_merge_asof(h5_dir, tolerance, shuffled):
+    symbol = Symbol("ED", h5_dir=h5_dir).load("2016-01-04", "2016-01-06")
+    quotes = symbol.get_quotes("EDH6")
+    trades = symbol.get_trades("EDH6")
+    assert len(quotes) > len(trades) > 0
+    if shuffled:
+        quotes = quotes.sample(frac=1, random_state=0)
+    expected = merge_asof_per_side(quotes, trades, tolerance)
+    got = __asof_join__(
+        quotes, trades,
+        None if tolerance is None else pd.Timedelta(tolerance).value)
+    pd.testing.assert_frame_equal(got, expected)
+    pd.testing.assert_frame_equal(
+        symbol.asof_merge("EDH6", tolerance=tolerance),
+        merge_asof_per_side(symbol.get_quotes("EDH6"), trades, tolerance))
+
+
+def test_asof_join_of_quotes_on_the_trade_timestamps():
+    index = pd.to_datetime(["2016-01-04 10:00:00", "2016-01-04 10:00:00",
+                            "2016-01-04 10:00:05"], utc=True)
+    quotes = pd.DataFrame({"bid": [98.5, 98.6, np.nan],
+                           "bid_size": [1.0, 2.0, np.nan],
+                           "ask": [98.51, np.nan, 98.52],
+                           "ask_size": [3.0, np.nan, 4.0]}, index=index)
+    trades = pd.DataFrame({"price": [98.4, 98.5, 98.55],
+                           "volume": [1.0, 2.0, 3.0]},
+                          index=pd.to_datetime(
+                              ["2016-01-04 09:59:59", "2016-01-04 10:00:00",
+                               "2016-01-04 10:00:10"], utc=True))
+    for tolerance in [None, "3s", "5s"]:
+        pd.testing.assert_frame_equal(
+            __asof_join__(quotes, trades, None if tolerance is None else
+                          pd.Timedelta(tolerance).value),
+            merge_asof_per_side(quotes, trades, tolerance))
+    got = __asof_join__(quotes, trades, pd.Timedelta("5s").value)
+    assert np.isnan(got["bid"].iloc[0])
+    assert got["bid"].iloc[1] == 98.6
+    assert got["ask"].iloc[1] == 98.51
+    # the bid of 10:00:00 is older than 5s at 10:00:10, the ask is not
+    assert np.isnan(got["bid"].iloc[2])
+    assert got["ask"].iloc[2] == 98.52
+
+
+def test_asof_merge_of_a_contract_without_trades(h5_dir):
+    symbol = Symbol("ED", h5_dir=h5_dir).load("2016-01-04", "2016-01-06",
+                                              columns=["bid", "ask"])
+    assert symbol.get_trades("EDH6") is None
+    merged = symbol.asof_merge("EDH6")
+    assert len(merged) == 0
+    assert list(merged.columns) == ["price", "volume", "bid", "ask"]
+    assert symbol.asof_merge() == {}
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyreuters.universe import load_many
+
+from .conftest import write_store
+
+
+@pytest.fixture
+def h5_dir(tmpdir):
+    for seed, symbol in enumerate(["ED", "GE", "FF"]):
+        contracts = ["{}H6".format(symbol), "{}M6".format(symbol)]
+        write_store(str(tmpdir.join("{}.h5".format(symbol))), contracts,
+                    [20160104, 20160105], n=500 + 100 * seed)
+    return str(tmpdir)
+
+
+@pytest.mark.parametrize("columns", [None, ["bid", "price"]])
+def test_load_many_is_the_same_serial_threaded_and_in_processes(h5_dir,
+                                                                columns):
+    symbols = ["ED", "GE", "FF"]
+    loads = [load_many(symbols, "2016-01-04", "2016-01-06", h5_dir=h5_dir,
+                       columns=columns, **kwargs)
+             for kwargs in [{"max_workers": 1},
+                            {"max_workers": 3, "processes": False},
+                            {"max_workers": 3, "processes": True}]]
+    serial = loads[0]
+    assert serial.quotes_frame().index.names == ["symbol", "contract",
+                                                 "date_time"]
+    assert sorted(set(serial.trades_frame().index.get_level_values(
+        "symbol"))) == sorted(symbols)
+    for loaded in loads[1:]:
+        assert list(loaded.symbols) == symbols
+        pd.testing.assert_frame_equal(loaded.quotes_frame(),
+                                      serial.quotes_frame())
+        pd.testing.assert_frame_equal(loaded.trades_frame(),
+                                      serial.trades_frame())
+        pd.testing.assert_frame_equal(loaded.timings[["quotes", "trades"]],
+                                      serial.timings[["quotes", "trades"]])
+        assert (loaded.timings["seconds"] > 0).all()
+    timings = serial.timings
+    assert list(timings.index) == symbols
+    assert timings.loc["ED", "quotes"] == len(
+        serial.symbols["ED"].quotes["EDH6"]) + len(
+        serial.symbols["ED"].quotes["EDM6"])
+    assert np.all(timings["trades"] > 0)
+
+
+def test_load_many_restricted_to_contracts(h5_dir):
+    loaded = load_many(["ED", "GE"], "2016-01-04", "2016-01-06",
+                       h5_dir=h5_dir, contracts=["EDH6", "GEM6"],
+                       max_workers=2)
+    contracts = loaded.quotes_frame().index.get_level_values("contract")
+    assert sorted(set(contracts)) == ["EDH6", "GEM6"]